@@ -1,10 +1,40 @@
+import os
+import click
 from flask import Flask
+from flask.helpers import get_debug_flag
+from werkzeug.serving import is_running_from_reloader
 from config import config
 from app.extensions import db, login_manager
 from app.routes import register_blueprints  
+from app.commands import register_commands
 from app.models.database_setup import init_database
+from app.services.free_spots import free_spot_index
+from app.services.holds import hold_sweeper
+from app.services.waitlist import promoter
+from app.services.idempotency import idempotency_purger
+from app.services.pricing import pricing_task
+from app.services.stats import stats_reconciler
+from app.services.rollups import rollup_refresher
+from app.services.scheduling import activation_task
+from app.services.cache import cache
+from app.services import geo_index, search_index
 from flask_jwt_extended import JWTManager
 
+def _serving_process(app):
+    """Whether this process serves requests: not a `flask` maintenance command
+    and not the reloader parent that only watches files (its child serves)"""
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        ctx = click.get_current_context(silent=True)
+        if ctx is None or ctx.command.name != 'run':
+            return False
+        reload = ctx.params.get('reload')
+        if reload is None:
+            reload = get_debug_flag()
+    else:
+        # app.run() reloads in debug mode, as run.py does
+        reload = app.debug
+    return not reload or is_running_from_reloader()
+
 def create_app(config_name='default'):
     """Create and configure Ease-Park! Flask application"""
     app = Flask(__name__)
@@ -23,6 +53,18 @@ def create_app(config_name='default'):
     # Initialize database with default data
     init_database(app)
     
+    # Closure table behind the "lots under this country/state" filters
+    geo_index.build(app)
+    
+    # Full-text index behind the lot searches
+    search_index.build(app)
+    
+    # Read-through cache for dashboards, listings and geography dropdowns
+    cache.init_app(app)
+    
+    # Build the in-memory free spot index used by the booking engine
+    free_spot_index.build(app)
+    
     # User loader for Flask-Login
     from app.models.user import User
     @login_manager.user_loader
@@ -32,6 +74,20 @@ def create_app(config_name='default'):
     # Register blueprints
     register_blueprints(app)
     
+    # Register CLI commands
+    register_commands(app)
+    
+    # Start background workers, once per serving process
+    if app.config['BACKGROUND_JOBS_ENABLED'] and _serving_process(app):
+        hold_sweeper.start(app, app.config['SPOT_HOLD_SWEEP_SECONDS'])
+        promoter.start(app, app.config['WAITLIST_POLL_SECONDS'])
+        idempotency_purger.start(app, app.config['IDEMPOTENCY_PURGE_SECONDS'])
+        stats_reconciler.start(app, app.config['STATS_RECONCILE_SECONDS'])
+        rollup_refresher.start(app, app.config['ROLLUP_REFRESH_SECONDS'])
+        activation_task.start(app, app.config['ADVANCE_BOOKING_ACTIVATE_SECONDS'])
+        if app.config['DYNAMIC_PRICING_ENABLED']:
+            pricing_task.start(app, app.config['DYNAMIC_PRICING_SECONDS'])
+    
     return app
 
 
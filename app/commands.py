@@ -0,0 +1,93 @@
+# Flask CLI maintenance commands, e.g. `flask --app "app:create_app()" reconcile-spots`
+import click
+from app.models.parking import ParkingLot
+from app.services.billing import audit_reservations
+from app.services.exports import ExportError, export_reservations
+from app.services.pricing import reprice_lots
+from app.services import geo_index, rollups, search_index, stats
+from app.services.scheduling import activate_due_reservations
+
+
+def register_commands(app):
+    # Register all CLI commands with the Flask app
+
+    @app.cli.command('reconcile-spots')
+    def reconcile_spots():
+        """Recount available and out-of-service spots for every lot and fix any drift"""
+        drifted = ParkingLot.reconcile_available_spots()
+        for row in drifted:
+            click.echo(
+                f"Lot {row['id']}: available_spots set to {row['available_spots']}, "
+                f"out_of_service_spots set to {row['out_of_service_spots']}"
+            )
+        click.echo(f"Reconciled {len(drifted)} drifted lot(s)")
+
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats():
+        """Recompute the materialized dashboard statistics and fix any drift"""
+        drifted = stats.reconcile()
+        click.echo(f"Reconciled {len(drifted)} drifted counter(s)")
+
+    @app.cli.command('rebuild-geography-index')
+    def rebuild_geography_index():
+        """Recompute the city ancestor rows behind the geography lot filters"""
+        rows = geo_index.rebuild()
+        click.echo(f"Wrote {rows} ancestor row(s)")
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Recompute the full-text lot search index (after bulk loading lots)"""
+        lots = search_index.rebuild()
+        click.echo(f"Indexed {lots} lot(s)")
+
+    @app.cli.command('backfill-rollups')
+    @click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to rebuild (default: first reservation)')
+    @click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Rebuild up to this day, exclusive (default: tomorrow)')
+    @click.option('--chunk-days', type=int, default=7, show_default=True, help='Days rebuilt per transaction')
+    def backfill_rollups(start, end, chunk_days):
+        """Rebuild the hourly and daily trend rollups from the reservation history"""
+        rows = rollups.backfill(start.date() if start else None, end.date() if end else None, chunk_days)
+        click.echo(f"Wrote {rows} rollup bucket(s)")
+
+    @app.cli.command('export-reservations')
+    @click.option('--directory', help='Output directory (default: EXPORT_DIRECTORY)')
+    @click.option('--format', 'fmt', type=click.Choice(['parquet', 'arrow']), default='parquet', show_default=True)
+    @click.option('--full', is_flag=True, help='Export everything instead of the rows changed since the last export')
+    def export_reservations_command(directory, fmt, full):
+        """Export reservations with their spot, lot and city as month-partitioned Parquet/Arrow files"""
+        try:
+            result = export_reservations(directory or app.config['EXPORT_DIRECTORY'], fmt, full)
+        except ExportError as e:
+            raise click.ClickException(str(e))
+        for path in result['files']:
+            click.echo(f"Wrote {path}")
+        click.echo(f"Exported {result['rows']} reservation(s) changed since {result['since'] or 'the beginning'}, "
+                   f"up to {result['watermark']}")
+
+    @app.cli.command('activate-reservations')
+    def activate_reservations():
+        """Start scheduled reservations whose time slot has begun (run every minute)"""
+        result = activate_due_reservations()
+        click.echo(f"Activated {result['activated']} reservation(s), {result['waiting']} still waiting for a spot")
+
+    @app.cli.command('reprice-lots')
+    def reprice_lots_command():
+        """Apply occupancy-based pricing to every lot now"""
+        changes = reprice_lots()
+        for change in changes:
+            click.echo(f"Lot {change['id']}: price_per_hour set to {change['price_per_hour']} (base {change['base_price_per_hour']})")
+        click.echo(f"Repriced {len(changes)} lot(s)")
+
+    @app.cli.command('audit-billing')
+    @click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='Reservations ending on or after this date')
+    @click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Reservations ending before this date')
+    @click.option('--rate', type=float, help='Reprice at this hourly rate instead of each lot\'s current rate')
+    @click.option('--lot', 'lot_id', type=int, help='Only this lot')
+    def audit_billing(start, end, rate, lot_id):
+        """Re-bill finished reservations and compare with what was charged"""
+        result = audit_reservations(start=start, end=end, hourly_rate=rate, lot_id=lot_id)
+        for lot, totals in sorted(result['lots'].items()):
+            click.echo(f"Lot {lot}: {totals['reservations']} reservation(s), charged {totals['charged']:.2f}, "
+                       f"repriced {totals['repriced']:.2f} ({totals['difference']:+.2f})")
+        click.echo(f"Total: {result['reservations']} reservation(s), charged {result['charged']:.2f}, "
+                   f"repriced {result['repriced']:.2f} ({result['difference']:+.2f})")
@@ -1,9 +1,10 @@
 from functools import wraps
-from flask import session, request, jsonify
+from flask import session, request, jsonify, make_response, current_app
 from flask_jwt_extended import verify_jwt_in_request, get_jwt
 from app.models import *
 from flask_login import current_user
 from app.models.enums import PermissionType
+from app.services import idempotency
 
 def require_permission(required_permission):
     """Decorator to check user permissions"""
@@ -87,4 +88,42 @@ def require_permission(required_permission):
                 print('[DEBUG require_permission] Exception:', str(e))
                 return jsonify({'msg': 'Authentication failed'}), 401
         return decorated_function
-    return decorator
\ No newline at end of file
+    return decorator
+
+def idempotent(f):
+    """Decorator to honor the Idempotency-Key header: retries get the stored response"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        user_id = session.get('user_id')
+        if not key or not user_id:
+            return f(*args, **kwargs)
+        if len(key) > 64:
+            return jsonify({'success': False, 'message': 'Idempotency-Key must be at most 64 characters'}), 400
+        
+        endpoint = f"{request.endpoint}:{request.view_args}"
+        if request.is_json:
+            body = request.get_json(silent=True)
+        elif request.form:
+            body = sorted(request.form.items(multi=True))
+        else:
+            body = request.get_data(as_text=True)
+        fingerprint = idempotency.fingerprint(request.method, request.endpoint, request.view_args, body)
+        stored = idempotency.begin(user_id, key, endpoint, fingerprint)
+        if stored == idempotency.IN_PROGRESS:
+            return jsonify({'success': False, 'message': 'A request with this Idempotency-Key is still being processed'}), 409
+        if stored == idempotency.MISMATCH:
+            return jsonify({'success': False, 'message': 'This Idempotency-Key was already used for a different request'}), 422
+        if stored is not None:
+            response = current_app.response_class(stored.body, status=stored.status_code, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            idempotency.finish(user_id, key, 500, None)
+            raise
+        idempotency.finish(user_id, key, response.status_code, response.get_data(as_text=True))
+        return response
+    return decorated_function
\ No newline at end of file
@@ -3,12 +3,12 @@ from .base import BaseModel
 from .enums import (
     UserStatus, RoleType, GenderEnum, ParkingLotStatus, 
     SpotStatus, ReservationStatus, PermissionType, 
-    GeographyStatus
+    GeographyStatus, WaitlistStatus
 )
 from .user import User, Role, UserRole
 from .permissions import Permission, RolePermission
-from .geography import Continent, Country, State, City
-from .parking import ParkingLot, ParkingSpot, Reservation
+from .geography import Continent, Country, State, City, CityAncestor
+from .parking import ParkingLot, ParkingSpot, Reservation, WaitlistEntry, IdempotencyRecord, DashboardStat, LotRollup, JobCheckpoint
 
 # Make all models available when importing from models package
 __all__ = [
@@ -16,14 +16,14 @@ __all__ = [
     'BaseModel',
     # Enums
     'UserStatus','RoleType','GenderEnum','ParkingLotStatus', 
-    'SpotStatus','ReservationStatus','PermissionType','GeographyStatus',
+    'SpotStatus','ReservationStatus','PermissionType','GeographyStatus','WaitlistStatus',
     # User models
     'User','Role','UserRole',
     # Permission models
     'Permission','RolePermission',
     # Geography models
-    'Continent','Country','State','City',
+    'Continent','Country','State','City','CityAncestor',
     # Parking models
-    'ParkingLot','ParkingSpot','Reservation'
+    'ParkingLot','ParkingSpot','Reservation','WaitlistEntry','IdempotencyRecord','DashboardStat','LotRollup','JobCheckpoint'
 ]
 
@@ -200,6 +200,7 @@ def create_sample_parking_data():
                 db.session.add(parking_lot)
                 db.session.flush()
                 # Create individual parking spots in this lot
+                available_count = 0
                 for i in range(1, lot_data['total_spots'] + 1):
                     if i == 1:
                         status = SpotStatus.OCCUPIED
@@ -209,12 +210,15 @@ def create_sample_parking_data():
                         status = SpotStatus.UNDER_MAINTENANCE
                     else:
                         status = SpotStatus.AVAILABLE
+                        available_count += 1
                     parking_spot = ParkingSpot(
                         spot_number=f"A{i:03d}",
                         parking_lot_id=parking_lot.id,
                         status=status
                     )
                     db.session.add(parking_spot)
+                parking_lot.available_spots = available_count
+                parking_lot.out_of_service_spots = 1 if lot_data['total_spots'] >= 3 else 0
     db.session.commit()
 
 def create_sample_users():
@@ -74,6 +74,7 @@ class SpotStatus(Enum):
     AVAILABLE = "available"
     OCCUPIED = "occupied"
     RESERVED = "reserved"
+    HELD = "held"  # Briefly kept for a user during checkout
     UNDER_MAINTENANCE = "under_maintenance"
     BANNED = "banned"
     
@@ -86,6 +87,17 @@ class ReservationStatus(Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
     PENDING_VACATE = "pending_vacate"
+    SCHEDULED = "scheduled"  # Advance booking for a future time slot
+    EXPIRED = "expired"  # Scheduled booking whose slot passed before it could start (no-show)
+    
+    def def_function(self):
+        return (self.value, self.value.replace('_', ' ').title())
+
+class WaitlistStatus(Enum):
+    # Waitlist entry status for full parking lots
+    WAITING = "waiting"
+    PROMOTED = "promoted"
+    CANCELLED = "cancelled"
     
     def def_function(self):
         return (self.value, self.value.replace('_', ' ').title())
\ No newline at end of file
@@ -128,4 +128,16 @@ class City(BaseModel):
         return base_dict
 
     def __repr__(self):
-        return f'<City {self.name}>'
\ No newline at end of file
+        return f'<City {self.name}>'
+
+class CityAncestor(db.Model):
+    __tablename__ = "city_ancestors"
+    # Closure of the geography tree over cities: one row per city and each of its
+    # ancestors, the city itself included (see app/services/geo_index.py)
+    
+    level = db.Column(db.String(10), primary_key=True)  # 'continent', 'country', 'state' or 'city'
+    ancestor_id = db.Column(db.Integer, primary_key=True)
+    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), primary_key=True, index=True)
+    
+    def __repr__(self):
+        return f'<CityAncestor {self.level} {self.ancestor_id} -> city {self.city_id}>'
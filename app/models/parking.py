@@ -1,10 +1,10 @@
 # Parking system models
 from app.extensions import db
 from app.models.base import BaseModel
-from app.models.enums import ParkingLotStatus, SpotStatus, ReservationStatus
+from app.models.enums import ParkingLotStatus, SpotStatus, ReservationStatus, WaitlistStatus
 from datetime import datetime
 from decimal import Decimal
-from sqlalchemy import Numeric
+from sqlalchemy import Numeric, func, update
 
 
 class ParkingLot(BaseModel):
@@ -12,12 +12,23 @@ class ParkingLot(BaseModel):
     # Basic information
     name = db.Column(db.String(200), nullable=False)
     address = db.Column(db.Text, nullable=False)
-    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), nullable=False)
+    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), nullable=False, index=True)
     
     # Capacity and pricing
     total_spots = db.Column(db.Integer, nullable=False, default=0)
     available_spots = db.Column(db.Integer, nullable=False, default=0)
+    # Spots under maintenance or banned, kept like available_spots; occupancy leaves them out
+    out_of_service_spots = db.Column(db.Integer, nullable=False, default=0)
     price_per_hour = db.Column(db.Numeric(10, 2), nullable=False, default=Decimal('10.00'))
+    # Price set by the admin; price_per_hour is this times the occupancy band (see app/services/pricing.py)
+    base_price_per_hour = db.Column(db.Numeric(10, 2), nullable=True)
+    
+    # Optional tariff on top of price_per_hour (see app/services/tariffs.py)
+    peak_price_per_hour = db.Column(db.Numeric(10, 2), nullable=True)
+    peak_hours = db.Column(db.String(100), nullable=True)  # weekday local hours, e.g. "8-10,17-20"
+    weekend_price_per_hour = db.Column(db.Numeric(10, 2), nullable=True)
+    first_hour_price = db.Column(db.Numeric(10, 2), nullable=True)
+    daily_cap = db.Column(db.Numeric(10, 2), nullable=True)
     
     # Status
     status = db.Column(db.Enum(ParkingLotStatus), default=ParkingLotStatus.ACTIVE, nullable=False)
@@ -26,7 +37,17 @@ class ParkingLot(BaseModel):
     city = db.relationship('City', back_populates='parking_lots')
     parking_spots = db.relationship('ParkingSpot', back_populates='parking_lot', cascade='all, delete-orphan')
      
-    # Update available spots count
+    @property
+    def base_price(self):
+        return self.base_price_per_hour if self.base_price_per_hour is not None else self.price_per_hour
+    
+    @property
+    def has_tariff(self):
+        return any(value is not None for value in (
+            self.peak_price_per_hour, self.weekend_price_per_hour, self.first_hour_price, self.daily_cap
+        ))
+    
+    # Recount available spots for this lot (slow path, prefer adjust_available_spots)
     def update_available_spots(self):
         try:
             available_count = ParkingSpot.query.filter_by(
@@ -42,7 +63,45 @@ class ParkingLot(BaseModel):
             db.session.rollback()
             raise e
 
-        
+    # Shift the available (and out-of-service) counters inside the caller's transaction (no commit)
+    @staticmethod
+    def adjust_available_spots(lot_id, delta, out_of_service=0):
+        if not delta and not out_of_service:
+            return
+        values = {'available_spots': ParkingLot.available_spots + delta}
+        if out_of_service:
+            values['out_of_service_spots'] = ParkingLot.out_of_service_spots + out_of_service
+        db.session.execute(
+            update(ParkingLot)
+            .where(ParkingLot.id == lot_id)
+            .values(**values)
+            # Only cached entries showing this lot go stale (see services/cache.py)
+            .execution_options(synchronize_session=False, cache_tags=(f'lot:{lot_id}',))
+        )
+
+    # Fix counter drift for every lot with one grouped query
+    @staticmethod
+    def reconcile_available_spots():
+        counts = {
+            lot_id: (available, out_of_service)
+            for lot_id, available, out_of_service in db.session.query(
+                ParkingSpot.parking_lot_id,
+                func.count(ParkingSpot.id).filter(ParkingSpot.status == SpotStatus.AVAILABLE),
+                func.count(ParkingSpot.id).filter(ParkingSpot.status.in_(ParkingSpot.OUT_OF_SERVICE))
+            ).filter(ParkingSpot.is_deleted == False).group_by(ParkingSpot.parking_lot_id)
+        }
+        drifted = []
+        for lot_id, available, out_of_service in db.session.query(
+            ParkingLot.id, ParkingLot.available_spots, ParkingLot.out_of_service_spots
+        ):
+            expected = counts.get(lot_id, (0, 0))
+            if (available, out_of_service) != expected:
+                drifted.append({'id': lot_id, 'available_spots': expected[0], 'out_of_service_spots': expected[1]})
+        if drifted:
+            db.session.execute(update(ParkingLot), drifted)
+        db.session.commit()
+        return drifted
+
     def to_dict(self):
         base_dict = super().to_dict()
         base_dict.update({
@@ -52,6 +111,14 @@ class ParkingLot(BaseModel):
             'total_spots': self.total_spots,
             'available_spots': self.available_spots,
             'price_per_hour': float(self.price_per_hour),
+            'base_price_per_hour': float(self.base_price),
+            'tariff': {
+                'peak_price_per_hour': float(self.peak_price_per_hour) if self.peak_price_per_hour is not None else None,
+                'peak_hours': self.peak_hours,
+                'weekend_price_per_hour': float(self.weekend_price_per_hour) if self.weekend_price_per_hour is not None else None,
+                'first_hour_price': float(self.first_hour_price) if self.first_hour_price is not None else None,
+                'daily_cap': float(self.daily_cap) if self.daily_cap is not None else None
+            } if self.has_tariff else None,
             'status': self.status.value,
             'spots': [
                 {'spot_number': spot.spot_number, 'status': spot.status.value}
@@ -71,12 +138,27 @@ class ParkingSpot(BaseModel):
     parking_lot_id = db.Column(db.Integer, db.ForeignKey('parking_lots.id'), nullable=False)
     status = db.Column(db.Enum(SpotStatus), default=SpotStatus.AVAILABLE.value, nullable=False)
     
+    # Checkout hold (only set while status is HELD)
+    held_until = db.Column(db.DateTime, nullable=True, index=True)
+    held_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    
+    # Optimistic locking: every UPDATE must match the version it read and bumps it
+    version = db.Column(db.Integer, nullable=False, default=1)
+    
     # Relationships
     parking_lot = db.relationship('ParkingLot', back_populates='parking_spots')
     reservations = db.relationship('Reservation', back_populates='parking_spot')
     
-    # Unique constraint
-    __table_args__ = (db.UniqueConstraint('spot_number', 'parking_lot_id'),)
+    # Unique constraint, plus an index for "free spots in this lot" lookups that also
+    # covers the per-lot status counts of the admin lot search
+    __table_args__ = (
+        db.UniqueConstraint('spot_number', 'parking_lot_id'),
+        db.Index('ix_parking_spots_lot_status', 'parking_lot_id', 'status', 'is_deleted'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+    
+    # Statuses that take a spot out of service (not bookable, not counted in occupancy)
+    OUT_OF_SERVICE = (SpotStatus.UNDER_MAINTENANCE, SpotStatus.BANNED)
     
     # Helper methods
     def is_available(self):
@@ -86,20 +168,29 @@ class ParkingSpot(BaseModel):
         if self.status != SpotStatus.AVAILABLE:
             raise ValueError("Cannot reserve a non-available spot.")
         try:
-            self.status = SpotStatus.RESERVED
+            self.set_status(SpotStatus.RESERVED)
             db.session.commit()
-            self.parking_lot.update_available_spots()
         except Exception as e:
             db.session.rollback()
             raise e
     
     def occupy(self):
-        self.status = SpotStatus.OCCUPIED
+        self.set_status(SpotStatus.OCCUPIED)
         db.session.commit()
     
     def free(self):
-        self.status = SpotStatus.AVAILABLE
+        self.set_status(SpotStatus.AVAILABLE)
         db.session.commit()
+
+    # Change status and keep the lot's counters in the same transaction
+    def set_status(self, new_status):
+        delta = (new_status == SpotStatus.AVAILABLE) - (self.status == SpotStatus.AVAILABLE)
+        out_of_service = (new_status in self.OUT_OF_SERVICE) - (self.status in self.OUT_OF_SERVICE)
+        self.status = new_status
+        if new_status != SpotStatus.HELD:
+            self.held_until = None
+            self.held_by_user_id = None
+        ParkingLot.adjust_available_spots(self.parking_lot_id, delta, out_of_service)
     
     @staticmethod
     def count_available():
@@ -132,7 +223,8 @@ class ParkingSpot(BaseModel):
         base_dict.update({
             'spot_number': self.spot_number,
             'parking_lot_name': self.parking_lot.name if self.parking_lot else None,
-            'status': self.status.value
+            'status': self.status.value,
+            'version': self.version
         })
         return base_dict
 
@@ -151,26 +243,49 @@ class Reservation(BaseModel):
     end_time = db.Column(db.DateTime, nullable=False)
     
     # Vehicle and cost
-    vehicle_number = db.Column(db.String(20), nullable=False)
+    vehicle_number = db.Column(db.String(20), nullable=False, index=True)
     total_cost = db.Column(Numeric(10, 2), nullable=False)    
+    # Lot's hourly rate when booked, billed instead of any later surge (NULL on older rows)
+    hourly_rate = db.Column(Numeric(10, 2), nullable=True)
 
     # Status
     status = db.Column(db.Enum(ReservationStatus), default=ReservationStatus.ACTIVE, nullable=False)
+    # False until a scheduled booking is activated; bookings that never started held no spot
+    started = db.Column(db.Boolean, default=True, nullable=False)
+    
+    # Optimistic locking, same as ParkingSpot
+    version = db.Column(db.Integer, nullable=False, default=1)
     
     # Relationships
     user = db.relationship('User', back_populates='reservations')
     parking_spot = db.relationship('ParkingSpot', back_populates='reservations')
     
+    # Range index for overlap checks on advance bookings; (status, end_time) serves
+    # revenue by day and the rollup windows, updated_at the incremental rollup refresh,
+    # (user_id, status, created_at) a user's recent history, and it also carries the
+    # columns of the user dashboard totals so those never read the table;
+    # (created_at, id) and (user_id, created_at, id) are the keyset pagination orders
+    __table_args__ = (
+        db.Index('ix_reservations_spot_status_start', 'parking_spot_id', 'status', 'start_time'),
+        db.Index('ix_reservations_status_end', 'status', 'end_time'),
+        db.Index('ix_reservations_updated_at', 'updated_at'),
+        db.Index('ix_reservations_user_status_created', 'user_id', 'status', 'created_at',
+                 'start_time', 'end_time', 'total_cost'),
+        db.Index('ix_reservations_created_id', 'created_at', 'id'),
+        db.Index('ix_reservations_user_created_id', 'user_id', 'created_at', 'id'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+    
     # Calculate total cost based on duration
-    def calculate_cost(self, hourly_rate):
+    def calculate_cost(self, hourly_rate, mode='vacate'):
+        from app.services.billing import billed_hours
         if not self.end_time or not self.start_time:
             raise ValueError("Start time and end time must be set")
         if self.end_time <= self.start_time:
             raise ValueError("End time must be after start time")
         
-        duration_hours = (self.end_time - self.start_time).total_seconds() / 3600
-        rounded_hours = math.ceil(duration_hours)
-        self.total_cost = Decimal(str(rounded_hours)) * hourly_rate
+        rounded_hours = billed_hours(self.start_time, self.end_time, mode)
+        self.total_cost = Decimal(str(rounded_hours)) * Decimal(str(hourly_rate))
 
     
     # Cancel the reservation
@@ -195,6 +310,17 @@ class Reservation(BaseModel):
     def get_duration_hours(self):
         return (self.end_time - self.start_time).total_seconds() / 3600
     
+    # Bookings, cost and hours parked per status for one user, in one grouped query
+    @staticmethod
+    def totals_by_status(user_id):
+        hours = (func.julianday(Reservation.end_time) - func.julianday(Reservation.start_time)) * 24
+        rows = db.session.query(
+            Reservation.status, func.count(Reservation.id),
+            func.coalesce(func.sum(Reservation.total_cost), 0), func.coalesce(func.sum(hours), 0)
+        ).filter(Reservation.user_id == user_id).group_by(Reservation.status).all()
+        return {status: {'count': count, 'cost': float(cost), 'hours': float(duration)}
+                for status, count, cost, duration in rows}
+    
     def to_dict(self):
         base_dict = super().to_dict()
         base_dict.update({
@@ -211,4 +337,128 @@ class Reservation(BaseModel):
         return base_dict
 
     def __repr__(self):
-        return f'<Reservation {self.vehicle_number}>'
\ No newline at end of file
+        return f'<Reservation {self.vehicle_number}>'
+
+class WaitlistEntry(BaseModel):
+    __tablename__ = "waitlist_entries"
+    
+    # Who is waiting for which lot
+    parking_lot_id = db.Column(db.Integer, db.ForeignKey('parking_lots.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    vehicle_number = db.Column(db.String(20), nullable=False)
+    
+    # Status and promotion details
+    status = db.Column(db.Enum(WaitlistStatus), default=WaitlistStatus.WAITING, nullable=False)
+    promoted_at = db.Column(db.DateTime, nullable=True)
+    held_spot_id = db.Column(db.Integer, db.ForeignKey('parking_spots.id'), nullable=True)
+    
+    # Relationships
+    parking_lot = db.relationship('ParkingLot')
+    held_spot = db.relationship('ParkingSpot')
+    
+    # FIFO order per lot: oldest waiting entry first
+    __table_args__ = (
+        db.Index('ix_waitlist_lot_status_id', 'parking_lot_id', 'status', 'id'),
+    )
+    
+    def to_dict(self):
+        base_dict = super().to_dict()
+        base_dict.update({
+            'parking_lot_id': self.parking_lot_id,
+            'user_id': self.user_id,
+            'vehicle_number': self.vehicle_number,
+            'status': self.status.value,
+            'promoted_at': self.promoted_at.isoformat() if self.promoted_at else None,
+            'held_spot_id': self.held_spot_id,
+            'held_spot_number': self.held_spot.spot_number if self.held_spot else None
+        })
+        return base_dict
+    
+    def __repr__(self):
+        return f'<WaitlistEntry lot={self.parking_lot_id} user={self.user_id}>'
+
+
+class IdempotencyRecord(db.Model):
+    __tablename__ = "idempotency_keys"
+    # Kept deliberately small: one row per (user, key) holding the stored response
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    # SHA-256 of method, endpoint, URL arguments and body; a reused key must match it
+    fingerprint = db.Column(db.String(64), nullable=True)
+    
+    # Stored response; status_code stays empty while the first request is still running
+    status_code = db.Column(db.SmallInteger, nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='unique_idempotency_key_per_user'),)
+    
+    def __repr__(self):
+        return f'<IdempotencyRecord {self.key}>'
+
+
+class DashboardStat(db.Model):
+    __tablename__ = "dashboard_stats"
+    # Materialized admin dashboard counters, one row per metric (see app/services/stats.py)
+    
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<DashboardStat {self.key}={self.value}>'
+
+
+class LotRollup(db.Model):
+    __tablename__ = "lot_rollups"
+    # Per-lot hourly and daily activity buckets for the trend charts (see app/services/rollups.py)
+    
+    parking_lot_id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(4), primary_key=True)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # UTC
+    
+    started = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(Numeric(12, 2), nullable=False, default=0)
+    # Most reservations holding a spot at the same time within the bucket
+    peak_occupancy = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Charts across all lots read a date range of one granularity
+    __table_args__ = (
+        db.Index('ix_lot_rollups_granularity_bucket', 'granularity', 'bucket_start'),
+    )
+    
+    def __repr__(self):
+        return f'<LotRollup lot={self.parking_lot_id} {self.granularity} {self.bucket_start}>'
+
+
+class JobCheckpoint(db.Model):
+    __tablename__ = "job_checkpoints"
+    # How far an incremental background job has processed its source rows
+    
+    name = db.Column(db.String(50), primary_key=True)
+    watermark = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    @classmethod
+    def get_watermark(cls, name):
+        checkpoint = db.session.get(cls, name)
+        return checkpoint.watermark if checkpoint else None
+    
+    @classmethod
+    def set_watermark(cls, name, watermark):
+        # Caller commits, together with the work the watermark covers
+        checkpoint = db.session.get(cls, name)
+        if checkpoint is None:
+            db.session.add(cls(name=name, watermark=watermark))
+        else:
+            checkpoint.watermark = watermark
+    
+    def __repr__(self):
+        return f'<JobCheckpoint {self.name} at {self.watermark}>'
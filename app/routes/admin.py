@@ -1,116 +1,66 @@
-from flask import Blueprint, render_template, redirect, request, url_for, flash, session, jsonify
+from flask import Blueprint, Response, render_template, redirect, request, url_for, flash, session, jsonify, stream_with_context, current_app
 from app.extensions import db
 from datetime import datetime
 from app.models import *
 from app.decorators import require_permission
-from sqlalchemy import func, or_
+from sqlalchemy import case, false, func, or_, select
+from sqlalchemy.orm import joinedload
 from decimal import Decimal
-from functools import wraps
 from app.models.geography import City
 from app.models.enums import SpotStatus, UserStatus, ParkingLotStatus
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from app.services.free_spots import free_spot_index
+from app.services.geo_tree import geography_tree
+from app.services import billing, checkout, exports, idempotency, keyset, rollups, search_index
+from app.services.cache import cache
+from app.services import stats as dashboard_stats
+from app.services.waitlist import promoter
+from app.services.tariffs import TariffError, parse_peak_hours, tariff_cache
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-def refresh_db_session(func):
-    """Refresh database session to clear cache - helps prevent stale data"""
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        db.session.expire_all()
-        return func(*args, **kwargs)
-    return wrapper
+def _latest_items():
+    """The five newest users, lots, spots and geography entries, as plain dicts for the cache"""
+    def geography(model, extra):
+        return [dict({'id': g.id, 'name': g.name}, **{name: getattr(g, name) for name in extra})
+                for g in model.query.order_by(model.created_at.desc()).limit(5).all()]
+    users = User.query.filter(User.username != 'admin').order_by(User.created_at.desc()).limit(5).all()
+    lots = ParkingLot.query.options(joinedload(ParkingLot.city)).order_by(ParkingLot.created_at.desc()).limit(5).all()
+    spots = ParkingSpot.query.options(joinedload(ParkingSpot.parking_lot)).order_by(ParkingSpot.created_at.desc()).limit(5).all()
+    return {
+        'users': [{'id': u.id, 'username': u.username, 'email': u.email,
+                   'status': {'value': u.status.value if u.status else ''}} for u in users],
+        'lots': [{'id': l.id, 'name': l.name, 'total_spots': l.total_spots,
+                  'city': {'name': l.city.name if l.city else ''}} for l in lots],
+        'spots': [{'id': s.id, 'spot_number': s.spot_number, 'status': {'value': s.status.value},
+                   'parking_lot': {'name': s.parking_lot.name if s.parking_lot else ''}} for s in spots],
+        'continents': geography(Continent, ['code']),
+        'countries': geography(Country, ['code']),
+        'states': geography(State, ['code']),
+        'cities': geography(City, ['pin_code']),
+    }
 
 @admin_bp.route('/dashboard')
 @require_permission(PermissionType.FULL_SYSTEM_ACCESS.value)
-@refresh_db_session
 def admin_dashboard():
     """Admin dashboard - shows system overview, revenue, and statistics"""
     try:
         print("Admin Dashboard: Loading admin dashboard")
-        today = datetime.now().date()
         
-        # Calculate total money earned (including cancelled reservations since users pay for time used)
-        today_revenue = db.session.query(func.sum(Reservation.total_cost)).filter(
-            func.date(Reservation.created_at) == today,
-            Reservation.status.in_([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED])
-        ).scalar() or 0
-
-        total_revenue = db.session.query(func.sum(Reservation.total_cost)).filter(
-            Reservation.status.in_([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED])
-        ).scalar() or 0
-
-        today_reservations = Reservation.query.filter(
-            func.date(Reservation.created_at) == today
-        ).count()
-
-        print(f"Admin Dashboard: Today's revenue ₹{float(today_revenue):.2f}, total revenue ₹{float(total_revenue):.2f}")
-
-        # Get recent parking activity
-        recent_reservations = Reservation.query.order_by(
-            Reservation.created_at.desc()
-        ).limit(10).all()
-
-        # Count all the geography data (continents, countries, states, cities)
-        total_continents = Continent.query.count()
-        total_countries = Country.query.count()
-        total_states = State.query.count()
-        total_cities = City.query.count()
-
-        # Count users and parking data
-        total_users = User.query.filter(User.username != 'admin').count()
-        total_parking_lots = ParkingLot.query.count()
-        total_parking_spots = ParkingSpot.query.filter_by(is_deleted=False).count()
-        total_reservations = Reservation.query.count()
-
-        # Count parking spot statuses (available, reserved, occupied)
-        available_spots = ParkingSpot.count_available()
-        reserved_spots = ParkingSpot.count_reserved()
-        occupied_spots = ParkingSpot.count_occupied()
-
-        # Calculate how full the parking system is (occupied + reserved)
-        occupancy_count = occupied_spots + reserved_spots
-        occupancy_rate = round((occupancy_count / total_parking_spots * 100), 2) if total_parking_spots > 0 else 0
-
-        # Dashboard statistics for display
-        stats = {
-            'total_continents': total_continents,
-            'total_countries': total_countries,
-            'total_states': total_states,
-            'total_cities': total_cities,
-            'total_users': total_users,
-            'total_parking_lots': total_parking_lots,
-            'total_parking_spots': total_parking_spots,
-            'total_reservations': total_reservations,
-            'occupied_spots': occupied_spots,
-            'available_spots': available_spots,
-            'reserved_spots': reserved_spots,
-            'today_reservations': today_reservations,
-            'today_revenue': float(today_revenue),
-            'total_revenue': float(total_revenue),
-            'occupancy_rate': occupancy_rate
-        }
-
-        print(f"Admin Dashboard: System has {total_users} users, {total_parking_lots} lots, {total_parking_spots} spots, {occupancy_rate}% occupancy")
-
-        # Get latest items for quick management
-        users = User.query.filter(User.username != 'admin').order_by(User.created_at.desc()).limit(5).all()
-        lots = ParkingLot.query.order_by(ParkingLot.created_at.desc()).limit(5).all()
-        spots = ParkingSpot.query.order_by(ParkingSpot.created_at.desc()).limit(5).all()
-        continents = Continent.query.order_by(Continent.created_at.desc()).limit(5).all()
-        countries = Country.query.order_by(Country.created_at.desc()).limit(5).all()
-        states = State.query.order_by(State.created_at.desc()).limit(5).all()
-        cities = City.query.order_by(City.created_at.desc()).limit(5).all()
+        # All counters and revenue come from the materialized stats table in one read
+        stats = dashboard_stats.snapshot()
 
-        return render_template('dashboards/admin_dashboard.html',
-                               stats=stats,
-                               recent_reservations=recent_reservations,
-                               users=users,
-                               lots=lots,
-                               spots=spots,
-                               continents=continents,
-                               countries=countries,
-                               states=states,
-                               cities=cities)
+        print(f"Admin Dashboard: Today's revenue ₹{stats['today_revenue']:.2f}, total revenue ₹{stats['total_revenue']:.2f}")
+
+        print(f"Admin Dashboard: System has {stats['total_users']} users, {stats['total_parking_lots']} lots, {stats['total_parking_spots']} spots, {stats['occupancy_rate']}% occupancy")
+
+        # Latest items for quick management, cached until one of them changes
+        latest = cache.fetch('dashboard:admin_latest', _latest_items,
+                             tags=('users', 'lots', 'spots', 'geography'),
+                             ttl=current_app.config['CACHE_DASHBOARD_TTL'])
+
+        return render_template('dashboards/admin_dashboard.html', stats=stats, **latest)
 
     except Exception as e:
         print(f"Admin Dashboard Error: {str(e)}")
@@ -121,17 +71,172 @@ def admin_dashboard():
 
 @admin_bp.route('/recent-reservations')
 @require_permission(PermissionType.FULL_SYSTEM_ACCESS.value)
-@refresh_db_session
 def recent_reservations():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    pagination = Reservation.query.order_by(Reservation.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    reservations = pagination.items
-    return render_template('admin/recent_reservations.html', reservations=reservations, pagination=pagination)
+    """All reservations newest first, paged by cursor so older pages cost the same as the first"""
+    query = Reservation.query.options(
+        joinedload(Reservation.user),
+        joinedload(Reservation.parking_spot).joinedload(ParkingSpot.parking_lot)
+    )
+    try:
+        page = keyset.newest_first(query, Reservation, 20,
+                                   after=request.args.get('cursor'), before=request.args.get('before'))
+    except keyset.CursorError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('admin.recent_reservations'))
+    total = dashboard_stats.snapshot()['total_reservations']
+    return render_template('admin/recent_reservations.html', reservations=page['items'], page=page, total=total)
+
+@admin_bp.route('/reservations/batch-exit', methods=['POST'])
+@require_permission(PermissionType.MANAGE_RESERVATIONS.value)
+def batch_exit():
+    """Gate exit burst - vacate or cancel many reservations by id or plate number"""
+    data = request.get_json(silent=True) or {}
+    try:
+        results = checkout.release_reservations(
+            reservation_ids=data.get('reservation_ids'),
+            vehicle_numbers=data.get('vehicle_numbers'),
+            mode=data.get('mode', 'vacate')
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except StaleDataError:
+        return jsonify({'success': False, 'error': 'Some reservations were changed by another request, retry the batch', 'conflict': True}), 409
+    except Exception as e:
+        print(f"Batch Exit Error: {str(e)}")
+        return jsonify({'success': False, 'error': f'Batch exit failed: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'processed': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success']),
+        'results': results
+    })
+
+@admin_bp.route('/waitlist/metrics')
+@require_permission(PermissionType.VIEW_ANALYTICS.value)
+def waitlist_metrics():
+    """Waitlist promotion throughput and queue latency"""
+    return jsonify({'success': True, 'metrics': promoter.metrics()})
+
+@admin_bp.route('/billing/audit')
+@require_permission(PermissionType.VIEW_ANALYTICS.value)
+def billing_audit():
+    """Re-bill finished reservations (optionally at another rate) and compare with what was charged"""
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = datetime.strptime(start, '%Y-%m-%d') if start else None
+        end = datetime.strptime(end, '%Y-%m-%d') if end else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+    result = billing.audit_reservations(
+        start=start, end=end,
+        hourly_rate=request.args.get('rate', type=float),
+        lot_id=request.args.get('lot_id', type=int)
+    )
+    return jsonify({'success': True, 'audit': result})
+
+def _stream_rows(table, conditions, filename):
+    """CSV/NDJSON download of `table`, streamed as it is read"""
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = exports.stream_rows(table, fmt, conditions)
+    except exports.ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    extension, mimetype = exports.TEXT_FORMATS[fmt]
+    print(f"Export: Streaming {table} as {fmt}")
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}{extension}'
+    })
+
+def _user_search(search):
+    """Username, email, first or last name contains `search` (case-insensitive)"""
+    search_lower = search.lower()
+    return or_(
+        func.lower(User.username).contains(search_lower),
+        func.lower(User.email).contains(search_lower),
+        func.lower(User.first_name).contains(search_lower),
+        func.lower(User.last_name).contains(search_lower)
+    )
+
+@admin_bp.route('/exports/reservations')
+@require_permission(PermissionType.VIEW_ANALYTICS.value)
+def export_reservations():
+    """Stream reservations with their spot, lot and city as one Parquet/Arrow file, or as CSV/NDJSON rows"""
+    fmt = request.args.get('format', 'parquet')
+    if fmt in exports.TEXT_FORMATS:
+        conditions = []
+        user_id = request.args.get('user_id', type=int)
+        lot_id = request.args.get('lot_id', type=int)
+        status = request.args.get('status')
+        if user_id:
+            conditions.append(Reservation.user_id == user_id)
+        if lot_id:
+            conditions.append(ParkingSpot.parking_lot_id == lot_id)
+        if status:
+            if status not in ReservationStatus._value2member_map_:
+                return jsonify({'success': False, 'error': f'Unknown reservation status: {status}'}), 400
+            conditions.append(Reservation.status == ReservationStatus(status))
+        return _stream_rows('reservations', conditions, 'reservations')
+
+    month = request.args.get('month')  # YYYY-MM of start_time
+    try:
+        since = request.args.get('since')  # updated_at watermark of the previous download
+        since = datetime.fromisoformat(since) if since else None
+        if month:
+            datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since must be an ISO timestamp and month YYYY-MM'}), 400
+    try:
+        watermark, chunks = exports.stream_reservations(fmt, since, month)
+    except exports.ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400 if fmt not in exports.FORMATS else 501
+    extension, mimetype = exports.FORMATS[fmt]
+    filename = f"reservations-{month or 'all'}{extension}"
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        # Pass back as `since` to fetch only what changed afterwards
+        'X-Export-Watermark': watermark.isoformat()
+    })
+
+@admin_bp.route('/exports/users')
+@require_permission(PermissionType.MANAGE_USERS.value)
+def export_users():
+    """Stream users (optionally matching ?search=) as CSV or NDJSON"""
+    conditions = [User.username != 'admin']
+    search = request.args.get('search', '', type=str)
+    if search:
+        conditions.append(_user_search(search))
+    return _stream_rows('users', conditions, 'users')
+
+@admin_bp.route('/exports/spots')
+@require_permission(PermissionType.VIEW_ANALYTICS.value)
+def export_spots():
+    """Stream parking spots (optionally ?lot_id= and ?status=) as CSV or NDJSON"""
+    conditions = []
+    lot_id = request.args.get('lot_id', type=int)
+    status = request.args.get('status')
+    if lot_id:
+        conditions.append(ParkingSpot.parking_lot_id == lot_id)
+    if status:
+        if status not in SpotStatus._value2member_map_:
+            return jsonify({'success': False, 'error': f'Unknown spot status: {status}'}), 400
+        conditions.append(ParkingSpot.status == SpotStatus(status))
+    return _stream_rows('spots', conditions, 'spots')
+
+@admin_bp.route('/idempotency/metrics')
+@require_permission(PermissionType.VIEW_ANALYTICS.value)
+def idempotency_metrics():
+    """Idempotency-Key replay hit rate and stored key volume"""
+    return jsonify({'success': True, 'metrics': idempotency.metrics()})
+
+@admin_bp.route('/cache/metrics')
+@require_permission(PermissionType.VIEW_ANALYTICS.value)
+def cache_metrics():
+    """Read-through cache hit rate, invalidations and size in this worker"""
+    return jsonify({'success': True, 'metrics': cache.metrics()})
 
 @admin_bp.route('/users')
 @require_permission(PermissionType.MANAGE_USERS.value)
-@refresh_db_session
 def manage_users():
     """Manage users - view, search, and manage user accounts"""
     page = request.args.get('page', 1, type=int)
@@ -140,33 +245,24 @@ def manage_users():
     
     print(f"Manage Users: Page {page}, search='{search}', show_all={show_all}")
     
+    # "Show all" streams every matching user as CSV instead of rendering them into one page
+    if show_all:
+        return redirect(url_for('admin.export_users', search=search, format='csv'))
+    
     # Start with all users except admin
     query = User.query.filter(User.username != 'admin')
     
     # Search by username, email, first name, or last name
     if search:
-        search_lower = search.lower()
-        query = query.filter(
-            or_(
-                func.lower(User.username).contains(search_lower),
-                func.lower(User.email).contains(search_lower),
-                func.lower(User.first_name).contains(search_lower),
-                func.lower(User.last_name).contains(search_lower)
-            )
-        )
+        query = query.filter(_user_search(search))
     
-    # Show all users or paginate
-    if show_all:
-        users = query.order_by(User.created_at.desc()).paginate(page=1, per_page=10000, error_out=False)
-    else:
-        users = query.order_by(User.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
+    users = query.order_by(User.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
     
     print(f"Manage Users: Found {users.total} users")
     return render_template('admin/users/manage.html', users=users)
 
 @admin_bp.route('/users/<int:user_id>')
 @require_permission(PermissionType.MANAGE_USERS.value)
-@refresh_db_session
 def view_user_details(user_id):
     """View detailed information about a specific user and their parking history"""
     print(f"View User Details: Loading details for user {user_id}")
@@ -177,7 +273,6 @@ def view_user_details(user_id):
 
 @admin_bp.route('/users/<int:user_id>/edit', methods=['GET', 'POST'])
 @require_permission(PermissionType.MANAGE_USERS.value)
-@refresh_db_session
 def edit_user(user_id):
     """Edit user information (username, email, name)"""
     user = User.query.get_or_404(user_id)
@@ -210,7 +305,6 @@ def edit_user(user_id):
 
 @admin_bp.route('/users/<int:user_id>/delete', methods=['POST'])
 @require_permission(PermissionType.MANAGE_USERS.value)
-@refresh_db_session
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
@@ -220,7 +314,6 @@ def delete_user(user_id):
 
 @admin_bp.route('/users/<int:user_id>/status', methods=['POST'])
 @require_permission(PermissionType.MANAGE_USERS.value)
-@refresh_db_session
 def change_user_status(user_id):
     user = User.query.get_or_404(user_id)
     new_status = request.form.get('new_status')
@@ -236,14 +329,12 @@ def change_user_status(user_id):
 
 @admin_bp.route('/lots')
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def list_lots():
     lots = ParkingLot.query.all()
     return render_template('admin/parking/lots.html', lots=lots)
 
 @admin_bp.route('/lots/create', methods=['GET', 'POST'])
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def create_parking_lot():
     if request.method == 'POST':
         data = request.form
@@ -262,14 +353,21 @@ def create_parking_lot():
             city_id=city_id,
             total_spots=total_spots,
             available_spots=total_spots,
-            price_per_hour=price_per_hour
+            price_per_hour=price_per_hour,
+            base_price_per_hour=price_per_hour
         )
+        try:
+            _apply_tariff(lot, data)
+        except (TariffError, ValueError) as e:
+            flash(f'Invalid tariff: {e}', 'danger')
+            return redirect(url_for('admin.create_parking_lot'))
         db.session.add(lot)
         db.session.flush()
         for i in range(1, total_spots + 1):
             spot = ParkingSpot(spot_number=f"{name}-{i:03d}", parking_lot_id=lot.id, status=SpotStatus.AVAILABLE)
             db.session.add(spot)
         db.session.commit()
+        free_spot_index.reload_lot(lot.id)
         flash('Parking lot created!', 'success')
         return redirect(url_for('admin.list_lots'))
     cities = City.query.all()
@@ -277,15 +375,30 @@ def create_parking_lot():
 
 @admin_bp.route('/lots/<int:lot_id>')
 @require_permission(PermissionType.VIEW_PARKING_DETAILS.value)
-@refresh_db_session
 def view_parking_lot_details(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
     spots = ParkingSpot.query.filter_by(parking_lot_id=lot.id).all()
     return render_template('admin/parking/lot_details.html', lot=lot, spots=spots)
 
+def _apply_tariff(lot, data):
+    """Copy the optional tariff fields of a lot form onto the lot (blank clears a field)"""
+    def price(field):
+        value = (data.get(field) or '').strip()
+        if not value:
+            return None
+        if float(value) < 0:
+            raise TariffError(f'{field.replace("_", " ").capitalize()} cannot be negative')
+        return float(value)
+    lot.peak_price_per_hour = price('peak_price_per_hour')
+    lot.weekend_price_per_hour = price('weekend_price_per_hour')
+    lot.first_hour_price = price('first_hour_price')
+    lot.daily_cap = price('daily_cap')
+    lot.peak_hours = (data.get('peak_hours') or '').strip() or None
+    if lot.peak_price_per_hour is not None and not parse_peak_hours(lot.peak_hours):
+        raise TariffError('Peak hours are required when a peak price is set')
+
 @admin_bp.route('/lots/<int:lot_id>/edit', methods=['GET', 'POST'])
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def edit_parking_lot(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
     if request.method == 'POST':
@@ -301,13 +414,23 @@ def edit_parking_lot(lot_id):
         lot.address = new_address
         lot.city_id = new_city_id
         lot.total_spots = int(data.get('total_spots', lot.total_spots))
-        lot.price_per_hour = float(data.get('price_per_hour', lot.price_per_hour))
+        # The form edits the base price; dynamic pricing re-applies the occupancy band on its next run
+        lot.base_price_per_hour = float(data.get('price_per_hour', lot.base_price))
+        lot.price_per_hour = lot.base_price_per_hour
+        try:
+            _apply_tariff(lot, data)
+        except (TariffError, ValueError) as e:
+            db.session.rollback()
+            flash(f'Invalid tariff: {e}', 'danger')
+            return redirect(url_for('admin.edit_parking_lot', lot_id=lot.id))
         status_str = data.get('status', lot.status)
         if isinstance(status_str, str):
             lot.status = ParkingLotStatus[status_str.upper()]
         else:
             lot.status = status_str
         db.session.commit()
+        # Pricing may have changed, drop the compiled tariff
+        tariff_cache.invalidate(lot.id)
         flash('Parking lot updated!', 'success')
         return redirect(url_for('admin.view_parking_lot_details', lot_id=lot.id))
     cities = City.query.all()
@@ -315,7 +438,6 @@ def edit_parking_lot(lot_id):
 
 @admin_bp.route('/lots/<int:lot_id>/delete', methods=['POST'])
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def delete_parking_lot(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
     # Only block deletion if any spot is reserved or occupied and not deleted
@@ -328,16 +450,21 @@ def delete_parking_lot(lot_id):
         print(f"[DEBUG] Cannot delete lot {lot.id}. Blocking spots: {[s.id for s in blocking_spots]}")
         flash('Cannot delete lot with reserved or occupied spots!', 'danger')
         return redirect(url_for('admin.view_parking_lot_details', lot_id=lot.id))
-    # Delete all spots in this lot (hard delete)
+    # Delete all spots in this lot (hard delete), a bulk delete so the stats are adjusted by hand
+    dashboard_stats.record_spots_removed(dict(
+        db.session.query(ParkingSpot.status, func.count(ParkingSpot.id))
+        .filter(ParkingSpot.parking_lot_id == lot.id, ParkingSpot.is_deleted == False)
+        .group_by(ParkingSpot.status).all()
+    ))
     ParkingSpot.query.filter_by(parking_lot_id=lot.id).delete()
     db.session.delete(lot)
     db.session.commit()
+    free_spot_index.drop_lot(lot_id)
     flash('Parking lot deleted!', 'success')
     return redirect(url_for('admin.list_lots'))
 
 @admin_bp.route('/parking/lots/search')
 @require_permission(PermissionType.VIEW_PARKING_DETAILS.value)
-@refresh_db_session
 def search_parking_lots():
     # Advanced search for parking lots 
     search = request.args.get('search', '', type=str)
@@ -345,57 +472,87 @@ def search_parking_lots():
     min_spots = request.args.get('min_spots', 0, type=int)
     max_spots = request.args.get('max_spots', 0, type=int)
     status = request.args.get('status', '', type=str)  # available, full, partial
+    sort = request.args.get('sort', 'relevance' if search or location else 'name', type=str)  # relevance, name, occupancy, total_spots
+    order = request.args.get('order', 'asc', type=str)
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
     
-    query = ParkingLot.query
-    
-    if search:
-        search_lower = search.lower()
-        query = query.filter(or_(
-            func.lower(ParkingLot.name).contains(search_lower),
-            func.lower(ParkingLot.description).contains(search_lower)
-        ))
-    
-    if location:
-        query = query.filter(func.lower(ParkingLot.location).contains(location.lower()))
+    # Text and size filters narrow the lots before any spot is counted; the text
+    # goes to the full-text index (search: any field, location: address, city, state)
+    conditions = []
+    matches = search_index.matching(search, location)
+    if matches is not None:
+        conditions.append(ParkingLot.id.in_(select(matches.c.lot_id)))
+    elif search or location:
+        # Only punctuation was typed, nothing can match
+        conditions.append(false())
     
     if min_spots > 0:
-        query = query.filter(ParkingLot.total_spots >= min_spots)
+        conditions.append(ParkingLot.total_spots >= min_spots)
     
     if max_spots > 0:
-        query = query.filter(ParkingLot.total_spots <= max_spots)
+        conditions.append(ParkingLot.total_spots <= max_spots)
+    
+    # Spot counts of the matching lots in one grouped pass over the (lot, status) index
+    counts = db.session.query(
+        ParkingSpot.parking_lot_id.label('lot_id'),
+        func.count().label('total'),
+        func.sum(case((ParkingSpot.status == SpotStatus.AVAILABLE, 1), else_=0)).label('available'),
+        func.sum(case((ParkingSpot.status == SpotStatus.OCCUPIED, 1), else_=0)).label('occupied'),
+        func.sum(case((ParkingSpot.status == SpotStatus.RESERVED, 1), else_=0)).label('reserved')
+    ).filter(ParkingSpot.is_deleted == False)
+    if conditions:
+        counts = counts.filter(ParkingSpot.parking_lot_id.in_(
+            db.session.query(ParkingLot.id).join(City, ParkingLot.city_id == City.id).filter(*conditions)
+        ))
+    counts = counts.group_by(ParkingSpot.parking_lot_id).subquery()
+    total = func.coalesce(counts.c.total, 0)
+    available = func.coalesce(counts.c.available, 0)
+    occupied = func.coalesce(counts.c.occupied, 0)
+    reserved = func.coalesce(counts.c.reserved, 0)
+    occupancy_rate = case((total > 0, (occupied + reserved) * 100.0 / total), else_=0)
     
-    parking_lots = query.all()
+    # count() over () returns the number of matches with the page, so the counts run once
+    query = db.session.query(
+        ParkingLot, City.name, total, available, occupied, reserved, occupancy_rate, func.count().over()
+    ).join(City, ParkingLot.city_id == City.id).outerjoin(counts, counts.c.lot_id == ParkingLot.id).filter(*conditions)
     
     # Filter by availability status if specified
-    if status:
-        filtered_lots = []
-        for lot in parking_lots:
-            available_spots = lot.parking_spots.filter_by(status='available').count()
-            total_spots = lot.parking_spots.count()
-            
-            if status == 'available' and available_spots > 0:
-                filtered_lots.append(lot)
-            elif status == 'full' and available_spots == 0:
-                filtered_lots.append(lot)
-            elif status == 'partial' and 0 < available_spots < total_spots:
-                filtered_lots.append(lot)
-        
-        parking_lots = filtered_lots
+    if status == 'available':
+        query = query.filter(available > 0)
+    elif status == 'full':
+        query = query.filter(available == 0)
+    elif status == 'partial':
+        query = query.filter(available > 0, available < total)
+    
+    if sort == 'relevance' and matches is not None:
+        query = query.join(matches, matches.c.lot_id == ParkingLot.id)
+    sort_columns = {'occupancy': occupancy_rate, 'total_spots': ParkingLot.total_spots}
+    if matches is not None:
+        sort_columns['relevance'] = matches.c.rank
+    sort_column = sort_columns.get(sort, ParkingLot.name)
+    sort_column = sort_column.desc() if order == 'desc' else sort_column.asc()
+    pagination = query.order_by(sort_column, ParkingLot.id).paginate(
+        page=page, per_page=per_page, error_out=False, count=False
+    )
+    if pagination.items:
+        pagination.total = pagination.items[0][-1]
+    else:
+        # Past the last page (or nothing matched)
+        pagination.total = query.order_by(None).count() if page > 1 else 0
     
     # Prepare results with statistics
     results = []
-    for lot in parking_lots:
-        total_spots = lot.parking_spots.count()
-        occupied = lot.parking_spots.filter_by(status='occupied').count()
-        available = lot.parking_spots.filter_by(status='available').count()
-        
+    for lot, city_name, total_spots, available_count, occupied_count, reserved_count, rate, _ in pagination.items:
         results.append({
             'lot': lot,
+            'city': city_name,
             'stats': {
                 'total_spots': total_spots,
-                'occupied': occupied,
-                'available': available,
-                'occupancy_rate': round((occupied / total_spots * 100), 2) if total_spots > 0 else 0
+                'occupied': occupied_count,
+                'reserved': reserved_count,
+                'available': available_count,
+                'occupancy_rate': round(rate, 2)
             }
         })
     
@@ -405,9 +562,9 @@ def search_parking_lots():
             lot_dict = {
                 'id': result['lot'].id,
                 'name': result['lot'].name,
-                'location': result['lot'].location,
-                'description': result['lot'].description,
-                'total_spots': result['lot'].total_spots
+                'address': result['lot'].address,
+                'city': result['city'],
+                'status': result['lot'].status.value
             }
             lot_dict.update(result['stats'])
             results_json.append(lot_dict)
@@ -420,30 +577,40 @@ def search_parking_lots():
                 'location': location,
                 'min_spots': min_spots,
                 'max_spots': max_spots,
-                'status': status
+                'status': status,
+                'sort': sort,
+                'order': order
+            },
+            'pagination': {
+                'page': pagination.page,
+                'per_page': per_page,
+                'total': pagination.total,
+                'pages': pagination.pages
             }
         })
     
     return render_template('admin/parking/search_lots.html', 
                           results=results,
+                          pagination=pagination,
                           search=search,
                           location=location,
                           min_spots=min_spots,
                           max_spots=max_spots,
-                          status=status)
+                          status=status,
+                          sort=sort,
+                          order=order,
+                          per_page=per_page)
 
 # PARKING SPOT ROUTES
 
 @admin_bp.route('/spots')
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def list_spots():
     spots = ParkingSpot.query.all()
     return render_template('admin/parking/spots.html', spots=spots)
 
 @admin_bp.route('/spots/<int:spot_id>')
 @require_permission(PermissionType.VIEW_PARKING_DETAILS.value)
-@refresh_db_session
 def view_parking_spot_details(spot_id):
     spot = ParkingSpot.query.get_or_404(spot_id)
     reservations = Reservation.query.filter_by(parking_spot_id=spot_id).order_by(Reservation.created_at.desc()).all()
@@ -451,7 +618,6 @@ def view_parking_spot_details(spot_id):
 
 @admin_bp.route('/spots/<int:spot_id>/edit', methods=['GET', 'POST'])
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def edit_parking_spot(spot_id):
     spot = ParkingSpot.query.get_or_404(spot_id)
     if request.method == 'POST':
@@ -465,79 +631,101 @@ def edit_parking_spot(spot_id):
 
 @admin_bp.route('/spots/<int:spot_id>/delete', methods=['POST'])
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def delete_parking_spot(spot_id):
     spot = ParkingSpot.query.get_or_404(spot_id)
     if spot.status in ['occupied', 'reserved']:
         flash('Cannot delete occupied or reserved spot!', 'danger')
         return redirect(url_for('admin.view_parking_spot_details', spot_id=spot.id))
+    lot_id = spot.parking_lot_id
+    ParkingLot.adjust_available_spots(
+        lot_id, -(spot.status == SpotStatus.AVAILABLE), -(spot.status in ParkingSpot.OUT_OF_SERVICE)
+    )
     db.session.delete(spot)
     db.session.commit()
+    free_spot_index.mark_taken(lot_id, spot_id)
     flash('Spot deleted!', 'success')
     return redirect(url_for('admin.list_spots'))
 
 @admin_bp.route('/parking/spots/search')
 @require_permission(PermissionType.VIEW_PARKING_DETAILS.value)
-@refresh_db_session
 def search_parking_spots():
     #  Advanced search for parking spots 
     search = request.args.get('search', '', type=str)
     status = request.args.get('status', '', type=str)
     lot_id = request.args.get('lot_id', 0, type=int)
     availability = request.args.get('availability', '', type=str)  # available, occupied, reserved, under_maintenance, banned
-    query = ParkingSpot.query
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    wants_json = request.headers.get('Content-Type') == 'application/json' or request.args.get('format') == 'json'
+    
+    query = ParkingSpot.query.options(joinedload(ParkingSpot.parking_lot))
     if search:
         query = query.filter(func.lower(ParkingSpot.spot_number).contains(search.lower()))
-    if status:
-        query = query.filter_by(status=status)
+    for value in (status, availability):
+        if not value:
+            continue
+        if value not in SpotStatus._value2member_map_:
+            if wants_json:
+                return jsonify({'success': False, 'error': f'Unknown spot status: {value}'}), 400
+            flash(f'Unknown spot status: {value}', 'warning')
+            continue
+        query = query.filter(ParkingSpot.status == SpotStatus(value))
     if lot_id > 0:
         query = query.filter_by(parking_lot_id=lot_id)
-    if availability:
-        query = query.filter_by(status=availability)
-    parking_spots = query.all()
+    pagination = query.order_by(ParkingSpot.parking_lot_id, ParkingSpot.spot_number).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+    spot_ids = [spot.id for spot in pagination.items]
+    
+    # Statistics for the whole page in two queries, whatever the page size: one grouped
+    # aggregate (revenue includes cancelled reservations since users pay for time used)
+    # and the active reservations joined with their users
+    totals, current = {}, {}
+    if spot_ids:
+        totals = {row.parking_spot_id: row for row in db.session.query(
+            Reservation.parking_spot_id,
+            func.count(Reservation.id).label('total_reservations'),
+            func.sum(case(
+                (Reservation.status.in_([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED]), Reservation.total_cost),
+                else_=0
+            )).label('revenue')
+        ).filter(Reservation.parking_spot_id.in_(spot_ids)).group_by(Reservation.parking_spot_id)}
+        current = {row.parking_spot_id: row for row in db.session.query(
+            Reservation.parking_spot_id, Reservation.id, Reservation.start_time, Reservation.end_time,
+            User.first_name, User.last_name
+        ).join(User, Reservation.user_id == User.id).filter(
+            Reservation.parking_spot_id.in_(spot_ids),
+            Reservation.status == ReservationStatus.ACTIVE
+        )}
     
-    # Prepare results with statistics
     results = []
-    for spot in parking_spots:
-        # Get current reservation if exists
-        current_reservation = None
-        if spot.status in ['occupied', 'reserved']:
-            current_reservation = Reservation.query.filter_by(
-                parking_spot_id=spot.id,
-                status=ReservationStatus.ACTIVE
-            ).first()
-        
-        # Get spot revenue - include cancelled reservations since users pay for time used
-        spot_revenue = db.session.query(func.sum(Reservation.total_cost)).filter_by(
-            parking_spot_id=spot.id
-        ).filter(
-            Reservation.status.in_([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED])
-        ).scalar() or 0
-        
+    for spot in pagination.items:
+        total = totals.get(spot.id)
+        reservation = current.get(spot.id)
         results.append({
             'spot': spot,
             'stats': {
-                'total_reservations': Reservation.query.filter_by(parking_spot_id=spot.id).count(),
-                'revenue': float(spot_revenue),
+                'total_reservations': total.total_reservations if total else 0,
+                'revenue': float(total.revenue or 0) if total else 0.0,
                 'current_reservation': {
-                    'id': current_reservation.id,
-                    'user_name': current_reservation.user.name if current_reservation and current_reservation.user else None,
-                    'start_time': current_reservation.start_time.isoformat() if current_reservation else None,
-                    'end_time': current_reservation.end_time.isoformat() if current_reservation else None
-                } if current_reservation else None
+                    'id': reservation.id,
+                    'user_name': f"{reservation.first_name} {reservation.last_name}",
+                    'start_time': reservation.start_time.isoformat(),
+                    'end_time': reservation.end_time.isoformat()
+                } if reservation else None
             }
         })
     
     # Get all parking lots for filter dropdown
-    parking_lots = ParkingLot.query.all()
+    parking_lots = db.session.query(ParkingLot.id, ParkingLot.name).order_by(ParkingLot.name).all()
     
-    if request.headers.get('Content-Type') == 'application/json' or request.args.get('format') == 'json':
+    if wants_json:
         results_json = []
         for result in results:
             spot_dict = {
                 'id': result['spot'].id,
                 'spot_number': result['spot'].spot_number,
-                'status': result['spot'].status,
+                'status': result['spot'].status.value,
                 'parking_lot_id': result['spot'].parking_lot_id,
                 'parking_lot_name': result['spot'].parking_lot.name if result['spot'].parking_lot else None
             }
@@ -553,20 +741,27 @@ def search_parking_spots():
                 'status': status,
                 'lot_id': lot_id,
                 'availability': availability
+            },
+            'pagination': {
+                'page': pagination.page,
+                'per_page': per_page,
+                'total': pagination.total,
+                'pages': pagination.pages
             }
         })
     
     return render_template('admin/parking/search_spots.html',
                           results=results,
+                          pagination=pagination,
                           parking_lots=parking_lots,
                           search=search,
                           status=status,
                           lot_id=lot_id,
-                          availability=availability)
+                          availability=availability,
+                          per_page=per_page)
 
 @admin_bp.route('/spots/search')
 @require_permission(PermissionType.VIEW_PARKING_DETAILS.value)
-@refresh_db_session
 def search_spots():
     search = request.args.get('search', '', type=str)
     status = request.args.get('status', '', type=str)
@@ -583,7 +778,6 @@ def search_spots():
 
 @admin_bp.route('/parking/spots/<int:spot_id>/update-status', methods=['POST'])
 @require_permission(PermissionType.MANAGE_PARKING.value)
-@refresh_db_session
 def update_spot_status(spot_id):
     # Quick update parking spot status 
     try:
@@ -594,6 +788,7 @@ def update_spot_status(spot_id):
         else:
             data = request.form.to_dict()
         new_status = data.get('status')
+        expected_version = data.get('version')
         valid_statuses = ['available', 'occupied', 'reserved', 'under_maintenance', 'banned']
         if new_status not in valid_statuses:
             error_msg = 'Invalid status provided.'
@@ -614,11 +809,15 @@ def update_spot_status(spot_id):
                     return jsonify({'success': False, 'error': error_msg}), 400
                 flash(error_msg, 'danger')
                 return redirect(url_for('admin.view_parking_spot_details', spot_id=spot_id))
+        # The client may send the version it last saw; refuse to overwrite a newer change
+        if expected_version not in (None, '') and int(expected_version) != parking_spot.version:
+            return _spot_conflict(parking_spot)
         # Update status
         old_status = parking_spot.status
-        parking_spot.status = SpotStatus[new_status.upper()]
         parking_spot.updated_at = datetime.utcnow()
+        parking_spot.set_status(SpotStatus[new_status.upper()])
         db.session.commit()
+        free_spot_index.set_status(parking_spot.parking_lot_id, parking_spot.id, parking_spot.status)
         # Only flash a single success message
         flash('Parking spot status updated successfully.', 'success')
         if request.content_type == 'application/json':
@@ -629,9 +828,14 @@ def update_spot_status(spot_id):
                     'id': parking_spot.id,
                     'spot_number': parking_spot.spot_number,
                     'status': parking_spot.status.value,
-                    'old_status': old_status.value if hasattr(old_status, "value") else old_status
+                    'old_status': old_status.value if hasattr(old_status, "value") else old_status,
+                    'version': parking_spot.version
                 }
             })
+    except StaleDataError:
+        # A booking or another admin changed the spot between our read and write
+        db.session.rollback()
+        return _spot_conflict(db.session.get(ParkingSpot, spot_id))
     except Exception as e:
         db.session.rollback()
         error_msg = f'Error updating parking spot status: {str(e)}'
@@ -640,20 +844,35 @@ def update_spot_status(spot_id):
         flash(error_msg, 'danger')
     return redirect(url_for('admin.view_parking_spot_details', spot_id=spot_id))
 
+def _spot_conflict(parking_spot):
+    """409 response carrying the spot's current state so the client can retry"""
+    error_msg = 'Parking spot was changed by someone else. Reload and try again.'
+    if request.content_type == 'application/json':
+        return jsonify({
+            'success': False, 'error': error_msg, 'conflict': True,
+            'parking_spot': {
+                'id': parking_spot.id,
+                'status': parking_spot.status.value,
+                'version': parking_spot.version
+            }
+        }), 409
+    flash(error_msg, 'warning')
+    return redirect(url_for('admin.view_parking_spot_details', spot_id=parking_spot.id))
+
 # --- Geography Management (Admin CRUD) ---
+def _parent_choices():
+    """Parent dropdowns of the geography forms, from the in-process geography tree"""
+    tree = geography_tree.current()
+    return {'continents': tree.continents, 'countries': tree.countries, 'states': tree.states}
+
 @admin_bp.route('/geography', methods=['GET'])
 @require_permission(PermissionType.FULL_SYSTEM_ACCESS.value)
-@refresh_db_session
 def manage_geography():
-    continents = Continent.query.all()
-    countries = Country.query.all()
-    states = State.query.all()
-    cities = City.query.all()
-    return render_template('admin/geography/manage.html', continents=continents, countries=countries, states=states, cities=cities)
+    tree = geography_tree.current()
+    return render_template('admin/geography/manage.html', continents=tree.continents, countries=tree.countries, states=tree.states, cities=tree.cities)
 
 @admin_bp.route('/geography/create', methods=['GET', 'POST'])
 @require_permission(PermissionType.FULL_SYSTEM_ACCESS.value)
-@refresh_db_session
 def create_geography():
     if request.method == 'POST':
         data = request.form
@@ -756,14 +975,10 @@ def create_geography():
             traceback.print_exc()
             flash(f'Error creating {entity}: {str(e)}', 'danger')
             return redirect(url_for('admin.create_geography'))
-    continents = Continent.query.all()
-    countries = Country.query.all()
-    states = State.query.all()
-    return render_template('admin/geography/create.html', continents=continents, countries=countries, states=states)
+    return render_template('admin/geography/create.html', **_parent_choices())
 
 @admin_bp.route('/geography/<entity>/<int:entity_id>/edit', methods=['GET', 'POST'])
 @require_permission(PermissionType.FULL_SYSTEM_ACCESS.value)
-@refresh_db_session
 def edit_geography(entity, entity_id):
     model_map = {'continent': Continent, 'country': Country, 'state': State, 'city': City}
     obj = model_map[entity].query.get_or_404(entity_id)
@@ -779,25 +994,25 @@ def edit_geography(entity, entity_id):
             duplicate_all = Continent.query.filter(Continent.name == new_name, Continent.code == new_code, Continent.status == GeographyStatus.ACTIVE, Continent.id != obj.id).first()
             if duplicate_all:
                 flash('An identical continent already exists.', 'danger')
-                return render_template('admin/geography/edit.html', entity=entity, obj=obj, continents=Continent.query.all(), countries=Country.query.all(), states=State.query.all())
+                return render_template('admin/geography/edit.html', entity=entity, obj=obj, **_parent_choices())
         elif entity == 'country':
             parent_id = int(new_parent_id)
             duplicate_all = Country.query.filter(Country.name == new_name, Country.code == new_code, Country.continent_id == parent_id, Country.status == GeographyStatus.ACTIVE, Country.id != obj.id).first()
             if duplicate_all:
                 flash('An identical country already exists.', 'danger')
-                return render_template('admin/geography/edit.html', entity=entity, obj=obj, continents=Continent.query.all(), countries=Country.query.all(), states=State.query.all())
+                return render_template('admin/geography/edit.html', entity=entity, obj=obj, **_parent_choices())
         elif entity == 'state':
             parent_id = new_parent_id or obj.country_id
             duplicate_all = State.query.filter(State.name == new_name, State.code == new_code, State.country_id == parent_id, State.status == GeographyStatus.ACTIVE, State.id != obj.id).first()
             if duplicate_all:
                 flash('An identical state already exists.', 'danger')
-                return render_template('admin/geography/edit.html', entity=entity, obj=obj, continents=Continent.query.all(), countries=Country.query.all(), states=State.query.all())
+                return render_template('admin/geography/edit.html', entity=entity, obj=obj, **_parent_choices())
         elif entity == 'city':
             parent_id = new_parent_id or obj.state_id
             duplicate_all = City.query.filter(City.name == new_name, City.code == new_code, City.state_id == parent_id, City.pin_code == new_pin_code, City.status == GeographyStatus.ACTIVE, City.id != obj.id).first()
             if duplicate_all:
                 flash('An identical city already exists.', 'danger')
-                return render_template('admin/geography/edit.html', entity=entity, obj=obj, continents=Continent.query.all(), countries=Country.query.all(), states=State.query.all())
+                return render_template('admin/geography/edit.html', entity=entity, obj=obj, **_parent_choices())
 
         # If no duplicates, update the object
         obj.name = new_name
@@ -817,19 +1032,15 @@ def edit_geography(entity, entity_id):
         except IntegrityError as e:
             db.session.rollback()
             flash('A record with this name or code already exists. Please use a different value.', 'danger')
-            return render_template('admin/geography/edit.html', entity=entity, obj=obj, continents=Continent.query.all(), countries=Country.query.all(), states=State.query.all())
+            return render_template('admin/geography/edit.html', entity=entity, obj=obj, **_parent_choices())
         except Exception as e:
             db.session.rollback()
             flash(f'Error updating {entity}: {str(e)}', 'danger')
-            return render_template('admin/geography/edit.html', entity=entity, obj=obj, continents=Continent.query.all(), countries=Country.query.all(), states=State.query.all())
-    continents = Continent.query.all()
-    countries = Country.query.all()
-    states = State.query.all()
-    return render_template('admin/geography/edit.html', entity=entity, obj=obj, continents=continents, countries=countries, states=states)
+            return render_template('admin/geography/edit.html', entity=entity, obj=obj, **_parent_choices())
+    return render_template('admin/geography/edit.html', entity=entity, obj=obj, **_parent_choices())
 
 @admin_bp.route('/geography/<entity>/<int:entity_id>/delete', methods=['POST'])
 @require_permission(PermissionType.FULL_SYSTEM_ACCESS.value)
-@refresh_db_session
 def delete_geography(entity, entity_id):
     model_map = {'continent': Continent, 'country': Country, 'state': State, 'city': City}
     obj = model_map[entity].query.get_or_404(entity_id)
@@ -873,65 +1084,34 @@ def user_create_geography():
         db.session.commit()
         flash(f'{entity.capitalize()} created!', 'success')
         return redirect(url_for('user_geo.user_create_geography'))
-    continents = Continent.query.all()
-    countries = Country.query.all()
-    states = State.query.all()
-    return render_template('user/geography/create.html', continents=continents, countries=countries, states=states)
+    return render_template('user/geography/create.html', **_parent_choices())
 
 # Register user_geo_bp in your app factory or __init__.py
 # ... existing code ...
 
 @admin_bp.route('/charts')
 @require_permission(PermissionType.VIEW_ANALYTICS.value)
-@refresh_db_session
 def admin_charts():
     try:
-        today = datetime.now().date()
-        today_revenue = db.session.query(func.sum(Reservation.total_cost)).filter(
-            func.date(Reservation.created_at) == today,
-            Reservation.status.in_([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED])
-        ).scalar() or 0
-        total_revenue = db.session.query(func.sum(Reservation.total_cost)).filter(
-            Reservation.status.in_([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED])
-        ).scalar() or 0
-        today_reservations = Reservation.query.filter(
-            func.date(Reservation.created_at) == today
-        ).count()
-        total_continents = Continent.query.count()
-        total_countries = Country.query.count()
-        total_states = State.query.count()
-        total_cities = City.query.count()
-        total_users = User.query.filter(User.username != 'admin').count()
-        total_parking_lots = ParkingLot.query.count()
-        total_parking_spots = ParkingSpot.query.filter_by(is_deleted=False).count()
-        total_reservations = Reservation.query.count()
-        available_spots = ParkingSpot.count_available()
-        reserved_spots = ParkingSpot.count_reserved()
-        occupied_spots = ParkingSpot.count_occupied()
-        occupancy_count = reserved_spots + occupied_spots
-        stats = {
-            'total_continents': total_continents,
-            'total_countries': total_countries,
-            'total_states': total_states,
-            'total_cities': total_cities,
-            'total_users': total_users,
-            'total_parking_lots': total_parking_lots,
-            'total_parking_spots': total_parking_spots,
-            'total_reservations': total_reservations,
-            'occupied_spots': occupied_spots,
-            'available_spots': available_spots,
-            'reserved_spots': reserved_spots,
-            'today_reservations': today_reservations,
-            'today_revenue': float(today_revenue),
-            'total_revenue': float(total_revenue),
-            'occupancy_rate': round((occupancy_count / total_parking_spots * 100), 2)
-                              if total_parking_spots > 0 else 0
-        }
+        stats = dashboard_stats.snapshot()
         return render_template('admin/charts.html', stats=stats)
     except Exception as e:
         flash(f"Error loading charts: {str(e)}", "error")
         return render_template('admin/charts.html', stats={})
 
+@admin_bp.route('/charts/trend')
+@require_permission(PermissionType.VIEW_ANALYTICS.value)
+def admin_charts_trend():
+    """Reservation, revenue and occupancy trend per day (or hour), from the rollups only"""
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'hour'):
+        return jsonify({'success': False, 'error': 'granularity must be day or hour'}), 400
+    days = request.args.get('days', 90 if granularity == 'day' else 2, type=int)
+    if not 1 <= days <= (366 if granularity == 'day' else 31):
+        return jsonify({'success': False, 'error': 'days is out of range'}), 400
+    series = rollups.trend(days, request.args.get('lot_id', type=int), granularity)
+    return jsonify({'success': True, 'granularity': granularity, 'trend': series})
+
 
 
 
@@ -1,13 +1,20 @@
-from flask import Blueprint, render_template, redirect, request, url_for, flash, session, jsonify
+from flask import Blueprint, Response, render_template, redirect, request, url_for, flash, session, jsonify, current_app, stream_with_context
 from app.extensions import db
 from datetime import datetime
 from app.models import *
-from app.decorators import require_permission
-from sqlalchemy import func
+from app.decorators import require_permission, idempotent
+from sqlalchemy import false, func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
 from decimal import Decimal
 from app.models.enums import PermissionType, ParkingLotStatus, SpotStatus
 from app.models.parking import ParkingSpot, Reservation
-from app.models.geography import Country, State, City
+from app.models.geography import City
+from app.services import allocation, billing, checkout, exports, geo_index, holds, keyset, scheduling, search_index, waitlist
+from app.services import stats as dashboard_stats
+from app.services.cache import cache, lot_tag
+from app.services.free_spots import free_spot_index
+from app.services.geo_tree import geography_tree
 
 user_bp = Blueprint('user', __name__, url_prefix='/user')
 
@@ -27,20 +34,34 @@ def user_dashboard():
     print(f"User Dashboard: Loading dashboard for user ID {user_id}")
     
     user = User.query.get(user_id)
-    reservations = Reservation.query.filter_by(user_id=user_id).order_by(Reservation.created_at.desc()).all()
     
-    # Sort reservations by status (active, completed, cancelled)
-    active_reservations = [r for r in reservations if r.status == ReservationStatus.ACTIVE]
-    completed_reservations = [r for r in reservations if r.status == ReservationStatus.COMPLETED]
-    cancelled_reservations = [r for r in reservations if r.status == ReservationStatus.CANCELLED]
-    
-    print(f"User Dashboard: Found {len(active_reservations)} active, {len(completed_reservations)} completed, {len(cancelled_reservations)} cancelled reservations")
+    # Totals come from one grouped query, whatever the length of the history
+    totals = Reservation.totals_by_status(user_id)
+    def total_for(status, field):
+        return totals.get(status, {}).get(field, 0)
+    completed_count = total_for(ReservationStatus.COMPLETED, 'count')
+    cancelled_count = total_for(ReservationStatus.CANCELLED, 'count')
+    
+    # Active reservations with their spot and lot, and only the most recent finished ones
+    with_lot = joinedload(Reservation.parking_spot).joinedload(ParkingSpot.parking_lot)
+    active_reservations = Reservation.query.options(with_lot).filter_by(
+        user_id=user_id, status=ReservationStatus.ACTIVE
+    ).order_by(Reservation.created_at.desc()).all()
+    history_size = current_app.config['USER_DASHBOARD_HISTORY']
+    def recent(status):
+        return Reservation.query.options(with_lot).filter_by(
+            user_id=user_id, status=status
+        ).order_by(Reservation.created_at.desc()).limit(history_size).all()
+    completed_reservations = recent(ReservationStatus.COMPLETED)
+    cancelled_reservations = recent(ReservationStatus.CANCELLED)
+    
+    print(f"User Dashboard: Found {len(active_reservations)} active, {completed_count} completed, {cancelled_count} cancelled reservations")
     
     # Calculate money statistics
-    total_spent = sum(float(r.total_cost) for r in completed_reservations if r.total_cost)
-    total_spent_including_cancelled = sum(float(r.total_cost) for r in completed_reservations + cancelled_reservations if r.total_cost)
-    total_time = sum((r.end_time - r.start_time).total_seconds() / 3600 for r in completed_reservations if r.end_time and r.start_time)
-    total_bookings = len(reservations)
+    total_spent = total_for(ReservationStatus.COMPLETED, 'cost')
+    total_spent_including_cancelled = total_spent + total_for(ReservationStatus.CANCELLED, 'cost')
+    total_time = total_for(ReservationStatus.COMPLETED, 'hours')
+    total_bookings = sum(total['count'] for total in totals.values())
     
     print(f"User Dashboard: Total spent ₹{total_spent:.2f}, including cancelled ₹{total_spent_including_cancelled:.2f}")
     
@@ -51,7 +72,10 @@ def user_dashboard():
         if r.start_time:
             # Calculate how long they've been parked
             duration = (now - r.start_time).total_seconds() / 3600
-            rate = float(r.parking_spot.parking_lot.price_per_hour) if r.parking_spot and r.parking_spot.parking_lot else 0
+            if r.hourly_rate is not None:
+                rate = float(r.hourly_rate)
+            else:
+                rate = float(r.parking_spot.parking_lot.price_per_hour) if r.parking_spot and r.parking_spot.parking_lot else 0
             r.estimated_cost = duration * rate
             active_spending += r.estimated_cost
         else:
@@ -59,23 +83,17 @@ def user_dashboard():
     
     print(f"User Dashboard: Current active spending ₹{active_spending:.2f}")
     
-    lots = ParkingLot.query.all()
-    spots = ParkingSpot.query.filter_by(status=SpotStatus.AVAILABLE).all()
-
-    # Occupancy rate for user dashboard (same as admin)
-    total_spots = ParkingSpot.query.filter_by(is_deleted=False).count()
-    reserved_spots = ParkingSpot.count_reserved()
-    occupied_spots = ParkingSpot.count_occupied()
-    occupancy_count = reserved_spots + occupied_spots
-    occupancy_rate = round((occupancy_count / total_spots * 100), 2) if total_spots > 0 else 0
+    # Occupancy rate for user dashboard (same as admin), from the materialized counters and shared by every visitor
+    occupancy_rate = cache.fetch('dashboard:occupancy', lambda: dashboard_stats.snapshot()['occupancy_rate'],
+                                 tags=('spots',), ttl=current_app.config['CACHE_DASHBOARD_TTL'])
 
     return render_template('dashboards/user_dashboard.html',
                            user=user,
                            active_reservations=active_reservations,
                            completed_reservations=completed_reservations,
                            cancelled_reservations=cancelled_reservations,
-                           lots=lots,
-                           spots=spots,
+                           completed_count=completed_count,
+                           cancelled_count=cancelled_count,
                            total_spent=total_spent,
                            total_spent_including_cancelled=total_spent_including_cancelled,
                            total_time=total_time,
@@ -85,10 +103,20 @@ def user_dashboard():
                            occupancy_rate=occupancy_rate
                            )
 
+def _within_location(query, continent_id=None, country_id=None, state_id=None, city_id=None):
+    """Filter a lot query by its most specific location given"""
+    if city_id:
+        return query.filter(ParkingLot.city_id == city_id)
+    for level, node_id in (('state', state_id), ('country', country_id), ('continent', continent_id)):
+        if node_id:
+            return geo_index.within(query, level, node_id)
+    return query
+
 @user_bp.route('/search_lots', methods=['POST'])
 def search_lots():
-    """Search for parking lots by location (country, state, city)"""
+    """Search for parking lots by location (continent, country, state, city)"""
     data = request.get_json() or request.form
+    continent_id = data.get('continent')
     country_id = data.get('country')
     state_id = data.get('state')
     city_id = data.get('city')
@@ -96,29 +124,21 @@ def search_lots():
     page = int(data.get('page', 1))
     per_page = int(data.get('per_page', 10))
 
-    print(f"Lot Search: Searching with country={country_id}, state={state_id}, city={city_id}, name='{lot_name}'")
+    print(f"Lot Search: Searching with continent={continent_id}, country={country_id}, state={state_id}, city={city_id}, name='{lot_name}'")
 
     # Start with only active parking lots
-    query = ParkingLot.query.filter(ParkingLot.status == ParkingLotStatus.ACTIVE)
+    query = ParkingLot.query.options(joinedload(ParkingLot.city)).filter(ParkingLot.status == ParkingLotStatus.ACTIVE)
 
-    # Apply location filters (city, state, or country)
-    if city_id:
-        query = query.filter(ParkingLot.city_id == city_id)
-    elif state_id:
-        # Get all cities in this state
-        city_ids = [c.id for c in City.query.filter_by(state_id=state_id).all()]
-        if city_ids:
-            query = query.filter(ParkingLot.city_id.in_(city_ids))
-    elif country_id:
-        # Get all states in this country, then all cities in those states
-        state_ids = [s.id for s in State.query.filter_by(country_id=country_id).all()]
-        city_ids = [c.id for c in City.query.filter(City.state_id.in_(state_ids)).all()]
-        if city_ids:
-            query = query.filter(ParkingLot.city_id.in_(city_ids))
-
-    # Search by lot name if provided
-    if lot_name:
-        query = query.filter(ParkingLot.name.ilike(f"%{lot_name}%"))
+    # Apply location filters (city, state, country or continent)
+    query = _within_location(query, continent_id, country_id, state_id, city_id)
+
+    # Search by name, address, city or state (word prefixes), best matches first
+    matches = search_index.matching(lot_name)
+    if matches is not None:
+        query = query.join(matches, matches.c.lot_id == ParkingLot.id).order_by(matches.c.rank, ParkingLot.id)
+    elif lot_name:
+        # Only punctuation was typed, nothing can match
+        query = query.filter(false())
 
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
     lots = pagination.items
@@ -127,14 +147,14 @@ def search_lots():
 
     result = []
     for lot in lots:
-        city = City.query.get(lot.city_id)
         result.append({
             'id': lot.id,
             'name': lot.name,
             'address': lot.address,
-            'city_name': city.name if city else '',
+            'city_name': lot.city.name if lot.city else '',
             'available_spots': lot.available_spots,
             'price_per_hour': float(lot.price_per_hour),
+            'base_price_per_hour': float(lot.base_price),
         })
 
     return jsonify({'lots': result, 'total': pagination.total, 'pages': pagination.pages, 'page': page})
@@ -162,24 +182,22 @@ def update_reservation_status():
     try:
         if new_status == 'occupied':
             # Mark spot as occupied (car is parked)
-            spot.status = SpotStatus.OCCUPIED
+            spot.set_status(SpotStatus.OCCUPIED)
             db.session.commit()
+            free_spot_index.mark_taken(lot.id, spot.id)
             print(f"Reservation Status: Spot {spot.spot_number} marked as occupied")
             return jsonify({'success': True, 'message': 'Spot marked as occupied'})
             
         elif new_status == 'released':
             # Release the spot and calculate final bill
-            spot.status = SpotStatus.AVAILABLE
+            spot.set_status(SpotStatus.AVAILABLE)
             reservation.end_time = now
             
-            # Calculate parking duration and cost
-            duration_hours = (reservation.end_time - reservation.start_time).total_seconds() / 3600
-            rounded_hours = int(duration_hours) + (1 if duration_hours % 1 > 0 else 0)
-            reservation.total_cost = rounded_hours * float(lot.price_per_hour)
+            reservation.total_cost = billing.lot_cost(lot, reservation.start_time, now, hourly_rate=reservation.hourly_rate)
             reservation.status = ReservationStatus.COMPLETED
             
             db.session.commit()
-            lot.update_available_spots()
+            free_spot_index.mark_free(lot.id, spot.id)
             
             print(f"Reservation Status: Spot {spot.spot_number} released, cost ₹{reservation.total_cost:.2f}")
             return jsonify({'success': True, 'message': 'Spot released', 'bill': reservation.total_cost})
@@ -187,31 +205,40 @@ def update_reservation_status():
         else:
             return jsonify({'success': False, 'message': 'Invalid status'}), 400
             
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Reservation was changed by another request, reload and try again', 'conflict': True}), 409
     except Exception as e:
         db.session.rollback()
         print(f"Reservation Status Error: {str(e)}")
         return jsonify({'success': False, 'message': f'Failed to update status: {str(e)}'}), 500
 
+def _history_query(user_id):
+    """A user's reservations with their spot and lot loaded in the same query"""
+    return Reservation.query.options(
+        joinedload(Reservation.parking_spot).joinedload(ParkingSpot.parking_lot)
+    ).filter(Reservation.user_id == user_id)
+
 @user_bp.route('/user_reservations', methods=['GET'])
 def user_reservations():
-    """Get user's complete reservation history"""
+    """Get user's reservation history, newest first, a page at a time (pass back next_cursor as ?cursor=)"""
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
     print(f"User Reservations: Loading history for user {user_id}")
     
-    reservations = Reservation.query.filter_by(user_id=user_id).order_by(Reservation.created_at.desc()).all()
-    data = []
-    total_time = 0
-    total_spent = 0
+    try:
+        page = keyset.newest_first(_history_query(user_id), Reservation, per_page, after=request.args.get('cursor'))
+    except keyset.CursorError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
-    for r in reservations:
+    data = []
+    for r in page['items']:
         duration = 0
         if r.status == ReservationStatus.COMPLETED and r.end_time and r.start_time:
             duration = (r.end_time - r.start_time).total_seconds() / 3600
-            total_time += duration
-            total_spent += float(r.total_cost)
         data.append({
             'id': r.id,
             'lot': r.parking_spot.parking_lot.name if r.parking_spot and r.parking_spot.parking_lot else None,
@@ -223,38 +250,47 @@ def user_reservations():
             'duration_hours': duration
         })
     
+    # The summary covers the whole history, from one grouped query
+    totals = Reservation.totals_by_status(user_id)
+    completed = totals.get(ReservationStatus.COMPLETED, {})
     summary = {
-        'total_bookings': len(reservations),
-        'total_time': total_time,
-        'total_spent': total_spent
+        'total_bookings': sum(total['count'] for total in totals.values()),
+        'total_time': completed.get('hours', 0),
+        'total_spent': completed.get('cost', 0)
     }
     
-    print(f"User Reservations: Found {len(reservations)} reservations, total spent ₹{total_spent:.2f}")
-    return jsonify({'reservations': data, 'summary': summary})
+    print(f"User Reservations: Returning {len(data)} of {summary['total_bookings']} reservations, total spent ₹{summary['total_spent']:.2f}")
+    return jsonify({'reservations': data, 'summary': summary, 'next_cursor': page['next_cursor']})
 
 @user_bp.route('/user_reservations_paginated', methods=['GET'])
 def user_reservations_paginated():
-    """Get user reservations with pagination (for large lists)"""
+    """Get user reservations a page at a time: ?cursor=<next_cursor> for older, ?before=<prev_cursor> for newer"""
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
     status = request.args.get('status')
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 5))
+    per_page = min(max(request.args.get('per_page', 5, type=int), 1), 100)
+    # Counting is optional; it comes from the per-status totals, not a COUNT(*) of the page query
+    include_total = request.args.get('include_total', 0, type=int)
     
-    print(f"User Reservations Paginated: User {user_id}, status={status}, page={page}")
+    print(f"User Reservations Paginated: User {user_id}, status={status}, cursor={request.args.get('cursor')}")
     
-    query = Reservation.query.filter_by(user_id=user_id)
+    query = _history_query(user_id)
     if status:
+        if status not in ReservationStatus._value2member_map_:
+            return jsonify({'success': False, 'message': f'Unknown reservation status: {status}'}), 400
+        status = ReservationStatus(status)
         query = query.filter(Reservation.status == status)
-    query = query.order_by(Reservation.created_at.desc())
     
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    reservations = pagination.items
-    data = []
+    try:
+        page = keyset.newest_first(query, Reservation, per_page,
+                                   after=request.args.get('cursor'), before=request.args.get('before'))
+    except keyset.CursorError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
-    for r in reservations:
+    data = []
+    for r in page['items']:
         duration = 0
         if r.status == ReservationStatus.COMPLETED and r.end_time and r.start_time:
             duration = (r.end_time - r.start_time).total_seconds() / 3600
@@ -269,11 +305,35 @@ def user_reservations_paginated():
             'duration_hours': duration
         })
     
+    total = None
+    if include_total:
+        totals = Reservation.totals_by_status(user_id)
+        total = totals.get(status, {}).get('count', 0) if status else sum(t['count'] for t in totals.values())
+    
     return jsonify({
         'reservations': data,
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'page': page
+        'next_cursor': page['next_cursor'],
+        'prev_cursor': page['prev_cursor'],
+        'total': total
+    })
+
+@user_bp.route('/reservations/export', methods=['GET'])
+def export_reservations():
+    """Download the user's whole reservation history as CSV or NDJSON, streamed as it is read"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = exports.stream_rows('reservations', fmt, [Reservation.user_id == user_id])
+    except exports.ExportError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    print(f"User Reservations Export: Streaming history of user {user_id} as {fmt}")
+    extension, mimetype = exports.TEXT_FORMATS[fmt]
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=my-reservations{extension}'
     })
 
 @user_bp.route('/profile', methods=['GET', 'POST'])
@@ -300,63 +360,67 @@ def edit_profile():
     
     return render_template('user/edit_profile.html', user=user)
 
+def _lot_tags(lots):
+    """Cache tags of a lot listing: any lot write, and each listed lot's availability"""
+    return ['lots', 'geography'] + [lot_tag(lot['id']) for lot in lots]
+
+def _lot_listing(query):
+    """Listing rows for a lot query, read as plain columns with the city name joined in"""
+    rows = query.join(City, City.id == ParkingLot.city_id).with_entities(
+        ParkingLot.id, ParkingLot.name, ParkingLot.address, ParkingLot.available_spots,
+        ParkingLot.price_per_hour, ParkingLot.base_price_per_hour, City.name.label('city_name')
+    ).all()
+    return [{
+        'id': row.id,
+        'name': row.name,
+        'address': row.address,
+        'available_spots': row.available_spots,
+        'price_per_hour': float(row.price_per_hour),
+        'base_price_per_hour': float(row.base_price_per_hour if row.base_price_per_hour is not None else row.price_per_hour),
+        'city_name': row.city_name
+    } for row in rows]
+
+def _geography_options(level, parent_id=None):
+    """A dropdown list from the geography tree; 304 Not Modified when the client's copy is current"""
+    body, etag = geography_tree.current().options(level, parent_id)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Clients keep the list but ask again each time, and get a 304 until geography changes
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @user_bp.route('/get_continents', methods=['GET'])
 def get_continents():
     """Get all continents for dropdown selection"""
-    continents = Continent.query.all()
-    return jsonify([{'id': c.id, 'name': c.name} for c in continents])
+    return _geography_options('continents')
 
 @user_bp.route('/get_countries', methods=['GET'])
 def get_countries():
     """Get countries by continent for dropdown selection"""
-    continent_id = request.args.get('continent_id')
-    query = Country.query
-    if continent_id:
-        query = query.filter_by(continent_id=continent_id)
-    countries = query.all()
-    return jsonify([{'id': c.id, 'name': c.name} for c in countries])
+    return _geography_options('countries', request.args.get('continent_id', type=int))
 
 @user_bp.route('/get_states', methods=['GET'])
 def get_states():
     """Get states by country for dropdown selection"""
-    country_id = request.args.get('country_id')
-    query = State.query
-    if country_id:
-        query = query.filter_by(country_id=country_id)
-    states = query.all()
-    return jsonify([{'id': s.id, 'name': s.name} for s in states])
+    return _geography_options('states', request.args.get('country_id', type=int))
 
 @user_bp.route('/get_cities', methods=['GET'])
 def get_cities():
     """Get cities by state for dropdown selection"""
-    state_id = request.args.get('state_id')
-    query = City.query
-    if state_id:
-        query = query.filter_by(state_id=state_id)
-    cities = query.all()
-    return jsonify([{'id': c.id, 'name': c.name} for c in cities])
+    return _geography_options('cities', request.args.get('state_id', type=int))
 
 @user_bp.route('/get_lots', methods=['GET'])
 def get_lots():
     """Get parking lots by city for dropdown selection"""
     city_id = request.args.get('city_id')
-    query = ParkingLot.query.filter_by(status=ParkingLotStatus.ACTIVE)
-    if city_id:
-        query = query.filter_by(city_id=city_id)
-    lots = query.all()
     
-    result = []
-    for l in lots:
-        city = City.query.get(l.city_id)
-        result.append({
-            'id': l.id,
-            'name': l.name,
-            'address': l.address,
-            'available_spots': l.available_spots,
-            'price_per_hour': float(l.price_per_hour),
-            'city_name': city.name if city else ''
-        })
-    return jsonify(result)
+    def compute():
+        query = ParkingLot.query.filter_by(status=ParkingLotStatus.ACTIVE)
+        if city_id:
+            query = query.filter_by(city_id=city_id)
+        return _lot_listing(query)
+    
+    return jsonify(cache.fetch(f'lots:city:{city_id or "all"}', compute, tags=_lot_tags))
 
 @user_bp.route('/lot/<int:lot_id>')
 def lot_details(lot_id):
@@ -369,54 +433,38 @@ def lot_details(lot_id):
 @user_bp.route('/book-reservation')
 def book_reservation():
     """Show the booking reservation page"""
-    countries = Country.query.all()
+    countries = geography_tree.current().countries
     return render_template('user/book_reservation.html', countries=countries)
 
 @user_bp.route('/api/states')
 def api_get_states():
     """API endpoint: Get states by country ID"""
     country_id = request.args.get('country_id', type=int)
-    states = State.query.filter_by(country_id=country_id).all() if country_id else []
-    return jsonify([{'id': s.id, 'name': s.name} for s in states])
+    if not country_id:
+        return jsonify([])
+    return _geography_options('states', country_id)
 
 @user_bp.route('/api/cities')
 def api_get_cities():
     """API endpoint: Get cities by state ID"""
     state_id = request.args.get('state_id', type=int)
-    cities = City.query.filter_by(state_id=state_id).all() if state_id else []
-    return jsonify([{'id': c.id, 'name': c.name} for c in cities])
+    if not state_id:
+        return jsonify([])
+    return _geography_options('cities', state_id)
 
 @user_bp.route('/api/lots')
 def api_get_lots():
     """API endpoint: Get parking lots with location filters"""
+    continent_id = request.args.get('continent_id', type=int)
     country_id = request.args.get('country_id', type=int)
     state_id = request.args.get('state_id', type=int)
     city_id = request.args.get('city_id', type=int)
     
-    query = ParkingLot.query
-    if city_id:
-        query = query.filter_by(city_id=city_id)
-    elif state_id:
-        city_ids = [c.id for c in City.query.filter_by(state_id=state_id).all()]
-        query = query.filter(ParkingLot.city_id.in_(city_ids))
-    elif country_id:
-        state_ids = [s.id for s in State.query.filter_by(country_id=country_id).all()]
-        city_ids = [c.id for c in City.query.filter(City.state_id.in_(state_ids)).all()]
-        query = query.filter(ParkingLot.city_id.in_(city_ids))
-    
-    lots = query.all()
-    result = []
-    for lot in lots:
-        city = City.query.get(lot.city_id)
-        result.append({
-            'id': lot.id,
-            'name': lot.name,
-            'address': lot.address,
-            'price_per_hour': float(lot.price_per_hour),
-            'available_spots': lot.available_spots,
-            'city_name': city.name if city else ''
-        })
-    return jsonify(result)
+    def compute():
+        return _lot_listing(_within_location(ParkingLot.query, continent_id, country_id, state_id, city_id))
+    
+    key = f'lots:filter:{continent_id}:{country_id}:{state_id}:{city_id}'
+    return jsonify(cache.fetch(key, compute, tags=_lot_tags))
 
 @user_bp.route('/api/lot-spots/<int:lot_id>')
 def api_lot_spots(lot_id):
@@ -425,6 +473,7 @@ def api_lot_spots(lot_id):
     return jsonify([spot.to_dict() for spot in spots])
 
 @user_bp.route('/book-spot/<int:spot_id>', methods=['POST'])
+@idempotent
 def book_spot(spot_id):
     """Book a specific parking spot"""
     user_id = session.get('user_id')
@@ -432,74 +481,250 @@ def book_spot(spot_id):
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
     print(f"Book Spot: User {user_id} attempting to book spot {spot_id}")
+    return _book(user_id, spot_id=spot_id)
+
+@user_bp.route('/hold-spot/<int:spot_id>', methods=['POST'])
+def hold_spot(spot_id):
+    """Hold a spot while the user finishes checkout (calling again extends the hold)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
-    spot = ParkingSpot.query.get_or_404(spot_id)
+    try:
+        held_until = holds.hold_spot(spot_id, user_id)
+    except allocation.SpotTakenError as e:
+        return jsonify({'success': False, 'message': str(e), 'conflict': True}), 409
+    except allocation.NotFoundError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except allocation.AllocationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    print(f"Hold Spot: User {user_id} holding spot {spot_id} until {held_until}")
+    return jsonify({'success': True, 'spot_id': spot_id, 'held_until': held_until.isoformat()})
+
+@user_bp.route('/release-hold/<int:spot_id>', methods=['POST'])
+def release_hold(spot_id):
+    """Give up a checkout hold before it expires"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    if not holds.release_hold(spot_id, user_id):
+        return jsonify({'success': False, 'message': 'You are not holding this spot'}), 404
+    return jsonify({'success': True, 'spot_id': spot_id})
+
+@user_bp.route('/book-lot/<int:lot_id>', methods=['POST'])
+@idempotent
+def book_any_spot(lot_id):
+    """Book whichever spot is free in a parking lot"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    print(f"Book Lot: User {user_id} attempting to book any spot in lot {lot_id}")
+    return _book(user_id, lot_id=lot_id)
+
+def _book(user_id, spot_id=None, lot_id=None):
+    """Run the allocation engine and turn its result into a JSON response"""
+    data = request.get_json(silent=True) or {}
+    vehicle_number = data.get('vehicle_number')
+    
+    try:
+        reservation = allocation.book_spot(user_id, vehicle_number, spot_id=spot_id, lot_id=lot_id)
+    except allocation.SpotTakenError as e:
+        # Lost the race - the client should pick another spot
+        return jsonify({'success': False, 'message': str(e), 'conflict': True}), 409
+    except allocation.LotFullError as e:
+        # Nothing left - offer the waitlist instead of letting the client poll
+        return jsonify({
+            'success': False, 'message': str(e), 'conflict': True,
+            'waitlist_url': url_for('user.join_waitlist', lot_id=lot_id)
+        }), 409
+    except allocation.NotFoundError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except allocation.AllocationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Book Spot Error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Booking failed: {str(e)}'}), 500
+    
+    spot = reservation.parking_spot
     lot = spot.parking_lot
+    print(f"Book Spot: Successfully booked spot {spot.spot_number} in lot {lot.name} for user {user_id}")
+    
+    return jsonify({
+        'success': True,
+        'message': 'Spot booked successfully',
+        'reservation_id': reservation.id,
+        'spot_id': spot.id,
+        'spot_number': spot.spot_number,
+        'lot_name': lot.name,
+        'vehicle_number': reservation.vehicle_number,
+        'start_time': reservation.start_time.strftime('%Y-%m-%d %H:%M'),
+        'price_per_hour': float(lot.price_per_hour),
+        'base_price_per_hour': float(lot.base_price),
+        'redirect_url': url_for('user.user_dashboard')
+    })
+
+@user_bp.route('/waitlist/<int:lot_id>', methods=['POST'])
+def join_waitlist(lot_id):
+    """Join a full lot's waitlist; the next freed spot is held for the first waiter"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        entry, position = waitlist.join_waitlist(lot_id, user_id, data.get('vehicle_number'))
+    except allocation.NotFoundError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except allocation.AllocationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    print(f"Waitlist: User {user_id} joined lot {lot_id} at position {position}")
+    return jsonify({'success': True, 'entry_id': entry.id, 'position': position})
+
+@user_bp.route('/waitlist/<int:lot_id>', methods=['GET'])
+def waitlist_status(lot_id):
+    """Current waitlist entry for this lot (position, or the spot held after promotion)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    entry = WaitlistEntry.query.filter_by(parking_lot_id=lot_id, user_id=user_id).order_by(WaitlistEntry.id.desc()).first()
+    if entry is None:
+        return jsonify({'success': False, 'message': 'You are not on this waitlist'}), 404
+    result = entry.to_dict()
+    result['position'] = waitlist.queue_position(entry)
+    return jsonify({'success': True, 'entry': result})
+
+@user_bp.route('/waitlist/<int:lot_id>/leave', methods=['POST'])
+def leave_waitlist(lot_id):
+    """Leave a lot's waitlist"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    if not waitlist.leave_waitlist(lot_id, user_id):
+        return jsonify({'success': False, 'message': 'You are not on this waitlist'}), 404
+    return jsonify({'success': True})
+
+@user_bp.route('/book-bulk', methods=['POST'])
+def book_bulk():
+    """Fleet booking - reserve many spots in one transaction (all or nothing)
+
+    JSON body: {"lot_id": 5, "count": 50, "vehicle_numbers": [...]}
+    or {"lots": [{"lot_id": 5, "count": 30}, ...], "vehicle_numbers": [...]}.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    vehicle_numbers = data.get('vehicle_numbers') or []
+    try:
+        if 'lots' in data:
+            lot_counts = [(int(item['lot_id']), int(item['count'])) for item in data['lots']]
+        else:
+            lot_counts = [(int(data['lot_id']), int(data.get('count', len(vehicle_numbers))))]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Give a lot_id and count, or a list of lots'}), 400
     
-    # Check if parking lot is active and available
-    if lot.status != ParkingLotStatus.ACTIVE:
-        return jsonify({'success': False, 'message': f'Lot is {lot.status.value}'}), 400
+    if not lot_counts or any(count <= 0 for _, count in lot_counts):
+        return jsonify({'success': False, 'message': 'Each lot must request at least one spot'}), 400
+    if len({lot_id for lot_id, _ in lot_counts}) != len(lot_counts):
+        return jsonify({'success': False, 'message': 'Each lot may appear only once'}), 400
     
-    # Check if spot is available for booking
-    if spot.status != SpotStatus.AVAILABLE:
-        return jsonify({'success': False, 'message': f'Spot is {spot.status.value}'}), 400
+    total = sum(count for _, count in lot_counts)
+    max_spots = current_app.config['BULK_BOOKING_MAX_SPOTS']
+    if total > max_spots:
+        return jsonify({'success': False, 'message': f'At most {max_spots} spots can be booked at once'}), 400
     
-    # Check if user already has an active reservation for this spot
-    existing_reservation = Reservation.query.filter_by(
-        user_id=user_id,
-        parking_spot_id=spot_id,
-        status=ReservationStatus.ACTIVE
-    ).first()
+    print(f"Bulk Booking: User {user_id} requesting {total} spots across {len(lot_counts)} lot(s)")
     
-    if existing_reservation:
-        return jsonify({'success': False, 'message': 'You already have an active reservation for this spot'}), 400
+    try:
+        booked = allocation.book_bulk(user_id, lot_counts, vehicle_numbers)
+    except allocation.LotFullError as e:
+        return jsonify({'success': False, 'message': str(e), 'conflict': True}), 409
+    except allocation.NotFoundError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except allocation.AllocationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Bulk Booking Error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Booking failed: {str(e)}'}), 500
     
-    # Get vehicle number from request
-    vehicle_number = request.json.get('vehicle_number')
-    if not vehicle_number:
-        return jsonify({'success': False, 'message': 'Vehicle number is required'}), 400
+    print(f"Bulk Booking: Booked {len(booked)} spots for user {user_id}")
+    return jsonify({
+        'success': True,
+        'message': f'{len(booked)} spots booked successfully',
+        'reservations': [
+            {'reservation_id': reservation_id, 'spot_id': spot_id, 'lot_id': lot_id, 'vehicle_number': vehicle_number}
+            for reservation_id, spot_id, lot_id, vehicle_number in booked
+        ]
+    })
+
+def _parse_window(data):
+    """Read an ISO start/end pair (UTC) from request data"""
+    try:
+        return datetime.fromisoformat(data.get('start_time')), datetime.fromisoformat(data.get('end_time'))
+    except (TypeError, ValueError):
+        raise allocation.AllocationError('start_time and end_time must be ISO datetimes')
+
+@user_bp.route('/schedule-reservation', methods=['POST'])
+def schedule_reservation():
+    """Book a spot (spot_id) or any spot of a lot (lot_id) for a future time slot"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
+    data = request.get_json(silent=True) or {}
     try:
-        # Create new reservation
-        reservation = Reservation(
-            user_id=user_id,
-            parking_spot_id=spot_id,
-            start_time=datetime.utcnow(),
-            end_time=datetime.utcnow(),  # Will be updated when vacated
-            vehicle_number=vehicle_number,
-            total_cost=0,
-            status=ReservationStatus.ACTIVE
+        start, end = _parse_window(data)
+        reservation = scheduling.schedule_reservation(
+            user_id, data.get('vehicle_number'), start, end,
+            spot_id=data.get('spot_id'),
+            lot_id=data.get('lot_id')
         )
-        
-        # Mark spot as reserved
-        spot.status = SpotStatus.RESERVED
-        
-        db.session.add(reservation)
-        db.session.commit()
-        
-        # Update available spots count in the lot
-        lot.update_available_spots()
-        
-        print(f"Book Spot: Successfully booked spot {spot.spot_number} in lot {lot.name} for user {user_id}")
-        
-        return jsonify({
-            'success': True,
-            'message': 'Spot booked successfully',
-            'reservation_id': reservation.id,
-            'spot_number': spot.spot_number,
-            'lot_name': lot.name,
-            'vehicle_number': vehicle_number,
-            'start_time': reservation.start_time.strftime('%Y-%m-%d %H:%M'),
-            'price_per_hour': float(lot.price_per_hour),
-            'redirect_url': url_for('user.user_dashboard')
-        })
-        
+    except (allocation.SpotTakenError, allocation.LotFullError) as e:
+        return jsonify({'success': False, 'message': str(e), 'conflict': True}), 409
+    except allocation.NotFoundError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except allocation.AllocationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
-        print(f"Book Spot Error: {str(e)}")
+        print(f"Schedule Reservation Error: {str(e)}")
         return jsonify({'success': False, 'message': f'Booking failed: {str(e)}'}), 500
+    
+    spot = reservation.parking_spot
+    print(f"Schedule Reservation: User {user_id} booked spot {spot.spot_number} from {start} to {end}")
+    return jsonify({
+        'success': True,
+        'message': 'Spot booked for the requested time slot',
+        'reservation_id': reservation.id,
+        'spot_id': spot.id,
+        'spot_number': spot.spot_number,
+        'lot_name': spot.parking_lot.name,
+        'start_time': reservation.start_time.isoformat(),
+        'end_time': reservation.end_time.isoformat()
+    })
+
+@user_bp.route('/api/lot-availability/<int:lot_id>')
+def api_lot_availability(lot_id):
+    """API endpoint: Spots of a lot that are free for a future time window"""
+    try:
+        start, end = _parse_window(request.args)
+        scheduling.validate_window(start, end)
+    except allocation.AllocationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    spot_ids = scheduling.free_spots_for_window(lot_id, start, end)
+    return jsonify({'success': True, 'lot_id': lot_id, 'free_count': len(spot_ids), 'spot_ids': spot_ids})
 
 @user_bp.route('/vacate-reservation/<int:reservation_id>', methods=['POST'])
+@idempotent
 def vacate_reservation(reservation_id):
     """Vacate a parking spot (complete the reservation and calculate final cost)"""
     user_id = session.get('user_id')
@@ -520,22 +745,18 @@ def vacate_reservation(reservation_id):
         lot = spot.parking_lot
         now = datetime.utcnow()
         
-        # Calculate parking duration and cost
-        duration_hours = (now - reservation.start_time).total_seconds() / 3600
-        rounded_hours = int(duration_hours) + (1 if duration_hours % 1 > 0 else 0)
-        reservation.total_cost = rounded_hours * float(lot.price_per_hour)
+        # Bill every started hour
+        reservation.total_cost = billing.lot_cost(lot, reservation.start_time, now, hourly_rate=reservation.hourly_rate)
         
         # Update reservation as completed
         reservation.end_time = now
         reservation.status = ReservationStatus.COMPLETED
     
-        # Free the parking spot
-        spot.status = SpotStatus.AVAILABLE
+        # Free the parking spot (also bumps the lot's available counter)
+        spot.set_status(SpotStatus.AVAILABLE)
     
         db.session.commit()
-        
-        # Update available spots count
-        lot.update_available_spots()
+        free_spot_index.mark_free(lot.id, spot.id)
         
         print(f"Vacate Reservation: Spot {spot.spot_number} vacated, final cost ₹{reservation.total_cost:.2f}")
         
@@ -545,14 +766,18 @@ def vacate_reservation(reservation_id):
             'total_cost': float(reservation.total_cost)
         })
         
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Reservation was changed by another request, reload and try again', 'conflict': True}), 409
     except Exception as e:
         db.session.rollback()
         print(f"Vacate Reservation Error: {str(e)}")
         return jsonify({'success': False, 'message': f'Failed to vacate: {str(e)}'}), 500
 
 @user_bp.route('/cancel-reservation/<int:reservation_id>', methods=['POST'])
+@idempotent
 def cancel_reservation(reservation_id):
-    """Cancel a parking reservation (user pays for time used)"""
+    """Cancel a parking reservation (user pays for time used; scheduled ones are free to cancel)"""
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
@@ -563,6 +788,18 @@ def cancel_reservation(reservation_id):
     if reservation.user_id != user_id:
         return jsonify({'success': False, 'message': 'Not your reservation'}), 403
     
+    if reservation.status == ReservationStatus.SCHEDULED:
+        # Not started yet: nothing to charge and the spot was never taken
+        try:
+            reservation.status = ReservationStatus.CANCELLED
+            reservation.total_cost = 0
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Reservation was changed by another request, reload and try again', 'conflict': True}), 409
+        print(f"Cancel Reservation: Scheduled reservation {reservation_id} cancelled free of charge")
+        return jsonify({'success': True, 'message': 'Scheduled reservation cancelled. No charge.', 'total_cost': 0.0})
+    
     if reservation.status != ReservationStatus.ACTIVE:
         return jsonify({'success': False, 'message': 'Reservation is not active'}), 400
     
@@ -571,22 +808,18 @@ def cancel_reservation(reservation_id):
         lot = spot.parking_lot
         now = datetime.utcnow()
         
-        # Calculate cost for time used (minimum 1 hour charge)
-        duration_hours = (now - reservation.start_time).total_seconds() / 3600
-        charged_hours = max(1, int(duration_hours) + (1 if duration_hours % 1 > 0 else 0))
-        reservation.total_cost = charged_hours * float(lot.price_per_hour)
+        # Bill time used (minimum 1 hour charge)
+        reservation.total_cost = billing.lot_cost(lot, reservation.start_time, now, mode='cancel', hourly_rate=reservation.hourly_rate)
         
         # Update reservation as cancelled
         reservation.end_time = now
         reservation.status = ReservationStatus.CANCELLED
         
-        # Free the parking spot
-        spot.status = SpotStatus.AVAILABLE
+        # Free the parking spot (also bumps the lot's available counter)
+        spot.set_status(SpotStatus.AVAILABLE)
         
         db.session.commit()
-        
-        # Update available spots count
-        lot.update_available_spots()
+        free_spot_index.mark_free(lot.id, spot.id)
         
         print(f"Cancel Reservation: Reservation {reservation_id} cancelled, charged ₹{reservation.total_cost:.2f}")
         
@@ -596,8 +829,44 @@ def cancel_reservation(reservation_id):
             'total_cost': float(reservation.total_cost)
         })
         
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Reservation was changed by another request, reload and try again', 'conflict': True}), 409
     except Exception as e:
         db.session.rollback()
         print(f"Cancel Reservation Error: {str(e)}")
         return jsonify({'success': False, 'message': f'Failed to cancel: {str(e)}'}), 500
-                           
\ No newline at end of file
+                           
+
+@user_bp.route('/batch-exit', methods=['POST'])
+def batch_exit():
+    """Vacate or cancel many of the user's reservations at once
+
+    JSON body: {"mode": "vacate" | "cancel", "reservation_ids": [...], "vehicle_numbers": [...]}.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        results = checkout.release_reservations(
+            reservation_ids=data.get('reservation_ids'),
+            vehicle_numbers=data.get('vehicle_numbers'),
+            mode=data.get('mode', 'vacate'),
+            user_id=user_id
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except StaleDataError:
+        return jsonify({'success': False, 'message': 'Some reservations were changed by another request, retry the batch', 'conflict': True}), 409
+    except Exception as e:
+        print(f"Batch Exit Error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Batch exit failed: {str(e)}'}), 500
+    
+    return jsonify({
+        'success': True,
+        'processed': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success']),
+        'results': results
+    })
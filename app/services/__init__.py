@@ -0,0 +1 @@
+# Services package - business logic shared by the route blueprints
@@ -0,0 +1,328 @@
+# Spot allocation engine - claims parking spots with a single conditional write
+#
+# A spot with a scheduled booking is kept free for it: walk-in claims skip
+# spots whose booking starts within ADVANCE_BOOKING_LEAD_MINUTES (or is due
+# and still waiting to be placed), and activating a booking skips spots
+# booked by someone else during its window.
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import exists, insert, select, update
+from app.extensions import db
+from app.models.enums import ParkingLotStatus, SpotStatus, ReservationStatus
+from app.models.parking import ParkingLot, ParkingSpot, Reservation
+from app.services.free_spots import free_spot_index
+from app.services.stats import record_reservations_created, record_spot_transition
+
+
+class AllocationError(Exception):
+    """Base error for bookings that could not be allocated"""
+
+
+class SpotTakenError(AllocationError):
+    """Another request claimed the spot first (lost the race)"""
+
+
+class LotFullError(AllocationError):
+    """No free spot is left in the requested lot"""
+
+
+class NotFoundError(AllocationError):
+    """The requested spot or lot does not exist"""
+
+
+def walk_in_until(now=None):
+    """How long a walk-in needs a spot to be free of bookings"""
+    now = now or datetime.utcnow()
+    return now + timedelta(minutes=current_app.config['ADVANCE_BOOKING_LEAD_MINUTES'])
+
+
+def not_booked(now, until, booking_id=None):
+    """SQL condition on ParkingSpot: no scheduled booking (other than `booking_id`) holds it in [now, until)"""
+    conditions = [
+        Reservation.parking_spot_id == ParkingSpot.id,
+        Reservation.status == ReservationStatus.SCHEDULED,
+        Reservation.start_time < until,
+        Reservation.end_time > now
+    ]
+    if booking_id is not None:
+        conditions.append(Reservation.id != booking_id)
+    return ~exists().where(*conditions)
+
+
+def claim_spot(spot_id, until=None, booking_id=None):
+    """Flip one spot from AVAILABLE to RESERVED. Returns True if this call won it.
+
+    The spot must be free of other bookings until `until` (a walk-in's lead
+    time by default); `booking_id` is the booking being placed, if any.
+    """
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(ParkingSpot)
+        .where(
+            ParkingSpot.id == spot_id,
+            ParkingSpot.status == SpotStatus.AVAILABLE,
+            ParkingSpot.is_deleted == False,
+            not_booked(now, until or walk_in_until(now), booking_id)
+        )
+        .values(status=SpotStatus.RESERVED, updated_at=datetime.utcnow(), version=ParkingSpot.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    record_spot_transition(SpotStatus.AVAILABLE, SpotStatus.RESERVED)
+    return True
+
+
+def claim_held_spot(spot_id, user_id):
+    """Turn the user's own unexpired hold into a reservation claim (no commit).
+
+    The lot's available counter already dropped when the hold was taken, so
+    callers must not adjust it again. Returns True if the user held the spot.
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(ParkingSpot)
+        .where(
+            ParkingSpot.id == spot_id,
+            ParkingSpot.status == SpotStatus.HELD,
+            ParkingSpot.held_by_user_id == user_id,
+            ParkingSpot.held_until > now
+        )
+        .values(status=SpotStatus.RESERVED, held_until=None, held_by_user_id=None, updated_at=now,
+                version=ParkingSpot.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    if claimed:
+        record_spot_transition(SpotStatus.HELD, SpotStatus.RESERVED)
+    return claimed
+
+
+def claim_any_spot(lot_id, max_attempts=5, until=None, booking_id=None):
+    """Claim a free spot of a lot (see claim_spot). Returns the spot id, or None when the lot is full."""
+    now = datetime.utcnow()
+    until = until or walk_in_until(now)
+    free = (
+        ParkingSpot.parking_lot_id == lot_id,
+        ParkingSpot.status == SpotStatus.AVAILABLE,
+        ParkingSpot.is_deleted == False,
+        not_booked(now, until, booking_id)
+    )
+    # Fast path: hand out spots from the in-memory index, no scan needed
+    while True:
+        spot_id = free_spot_index.take(lot_id)
+        if spot_id is None:
+            break
+        if claim_spot(spot_id, until, booking_id):
+            return spot_id
+        # Stale entry (another worker took it, or it is booked soon), it is
+        # already dropped from the index; the database path below reloads it
+
+    # Index has nothing for this lot: ask the database directly
+    for _ in range(max_attempts):
+        candidate = (
+            select(ParkingSpot.id)
+            .where(*free)
+            .order_by(ParkingSpot.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        # Pick and claim in one statement; the status re-check keeps it safe
+        # on databases where the subquery can see a spot another writer is taking
+        spot_id = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id == candidate, ParkingSpot.status == SpotStatus.AVAILABLE)
+            .values(status=SpotStatus.RESERVED, updated_at=datetime.utcnow(), version=ParkingSpot.version + 1)
+            .returning(ParkingSpot.id)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if spot_id is not None:
+            record_spot_transition(SpotStatus.AVAILABLE, SpotStatus.RESERVED)
+            # The index missed free spots (freed by another worker), resync this lot
+            # leaving out spots kept for a booking
+            free_spot_index.reload_lot(lot_id, *free[3:])
+            return spot_id
+        # Nothing claimed: either the lot is full or we lost a race, check which
+        still_free = db.session.execute(select(ParkingSpot.id).where(*free).limit(1)).first()
+        if still_free is None:
+            return None
+    return None
+
+
+def book_spot(user_id, vehicle_number, spot_id=None, lot_id=None):
+    """Reserve a specific spot, or any free spot of a lot, and create the reservation.
+
+    Raises SpotTakenError / LotFullError when the spot could not be claimed
+    and AllocationError for requests that can never succeed.
+    """
+    if not vehicle_number:
+        raise AllocationError('Vehicle number is required')
+    if spot_id is None and lot_id is None:
+        raise AllocationError('A spot or a lot must be given')
+
+    if spot_id is not None:
+        spot = db.session.get(ParkingSpot, spot_id)
+        if spot is None or spot.is_deleted:
+            raise NotFoundError('Spot not found')
+        lot = spot.parking_lot
+    else:
+        lot = db.session.get(ParkingLot, lot_id)
+        if lot is None or lot.is_deleted:
+            raise NotFoundError('Lot not found')
+
+    if lot.status != ParkingLotStatus.ACTIVE:
+        raise AllocationError(f'Lot is {lot.status.value}')
+
+    claimed = None
+    try:
+        if spot_id is not None:
+            free_spot_index.mark_taken(lot.id, spot_id)
+            if claim_held_spot(spot_id, user_id):
+                # Counter was already adjusted when the hold was taken
+                pass
+            elif claim_spot(spot_id):
+                claimed = spot_id
+                ParkingLot.adjust_available_spots(lot.id, -1)
+            else:
+                db.session.rollback()
+                raise SpotTakenError('Spot is no longer available')
+        else:
+            spot_id = claim_any_spot(lot.id)
+            if spot_id is None:
+                db.session.rollback()
+                raise LotFullError('No free spots left in this lot')
+            claimed = spot_id
+            ParkingLot.adjust_available_spots(lot.id, -1)
+
+        now = datetime.utcnow()
+        reservation = Reservation(
+            user_id=user_id,
+            parking_spot_id=spot_id,
+            start_time=now,
+            end_time=now,  # Will be updated when vacated
+            vehicle_number=vehicle_number,
+            total_cost=0,
+            hourly_rate=lot.price_per_hour,
+            status=ReservationStatus.ACTIVE
+        )
+        db.session.add(reservation)
+        db.session.commit()
+    except AllocationError:
+        raise
+    except Exception:
+        db.session.rollback()
+        # The claim was rolled back, so the spot is free again
+        if claimed is not None:
+            free_spot_index.mark_free(lot.id, claimed)
+        raise
+
+    return reservation
+
+
+def claim_spots(lot_id, count):
+    """Claim up to `count` free spots of a lot with one set-based UPDATE. Returns the claimed ids."""
+    if count <= 0:
+        # LIMIT with a negative count means no limit in SQLite
+        raise AllocationError('Spot count must be positive')
+    now = datetime.utcnow()
+    candidates = (
+        select(ParkingSpot.id)
+        .where(
+            ParkingSpot.parking_lot_id == lot_id,
+            ParkingSpot.status == SpotStatus.AVAILABLE,
+            ParkingSpot.is_deleted == False,
+            not_booked(now, walk_in_until(now))
+        )
+        .order_by(ParkingSpot.id)
+        .limit(count)
+    )
+    claimed = list(db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id.in_(candidates), ParkingSpot.status == SpotStatus.AVAILABLE)
+        .values(status=SpotStatus.RESERVED, updated_at=datetime.utcnow(), version=ParkingSpot.version + 1)
+        .returning(ParkingSpot.id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    record_spot_transition(SpotStatus.AVAILABLE, SpotStatus.RESERVED, len(claimed))
+    return claimed
+
+
+def book_bulk(user_id, lot_counts, vehicle_numbers):
+    """Reserve many spots in one transaction, all or nothing.
+
+    `lot_counts` is a list of (lot_id, count) pairs and `vehicle_numbers`
+    holds one plate per requested spot, assigned in order. Returns the
+    created reservations as (reservation_id, spot_id, lot_id, vehicle_number).
+    """
+    if not lot_counts:
+        raise AllocationError('At least one spot must be requested')
+    if any(count <= 0 for _, count in lot_counts):
+        raise AllocationError('Each lot must request at least one spot')
+    lot_ids = [lot_id for lot_id, _ in lot_counts]
+    if len(set(lot_ids)) != len(lot_ids):
+        raise AllocationError('Each lot may appear only once')
+    total = sum(count for _, count in lot_counts)
+    if len(vehicle_numbers) != total:
+        raise AllocationError(f'Expected {total} vehicle numbers, got {len(vehicle_numbers)}')
+    if any(not v for v in vehicle_numbers):
+        raise AllocationError('Vehicle numbers cannot be empty')
+
+    lots = {
+        lot.id: lot for lot in ParkingLot.query.filter(
+            ParkingLot.id.in_(lot_ids), ParkingLot.is_deleted == False
+        )
+    }
+    for lot_id in lot_ids:
+        if lot_id not in lots:
+            raise NotFoundError(f'Lot {lot_id} not found')
+        if lots[lot_id].status != ParkingLotStatus.ACTIVE:
+            raise AllocationError(f'Lot {lots[lot_id].name} is {lots[lot_id].status.value}')
+
+    claimed = []
+    try:
+        for lot_id, count in lot_counts:
+            spot_ids = claim_spots(lot_id, count)
+            if len(spot_ids) < count:
+                db.session.rollback()
+                raise LotFullError(
+                    f'Only {len(spot_ids)} of {count} spots are free in lot {lots[lot_id].name}'
+                )
+            ParkingLot.adjust_available_spots(lot_id, -count)
+            claimed.extend((spot_id, lot_id) for spot_id in spot_ids)
+        if len(claimed) != len(vehicle_numbers):
+            db.session.rollback()
+            raise AllocationError(f'Claimed {len(claimed)} spots for {len(vehicle_numbers)} vehicles')
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                'user_id': user_id,
+                'parking_spot_id': spot_id,
+                'start_time': now,
+                'end_time': now,  # Will be updated when vacated
+                'vehicle_number': vehicle_number,
+                'total_cost': 0,
+                'hourly_rate': lots[lot_id].price_per_hour,
+                'status': ReservationStatus.ACTIVE,
+                'created_at': now,
+                'updated_at': now,
+                'is_deleted': False
+            }
+            for (spot_id, lot_id), vehicle_number in zip(claimed, vehicle_numbers)
+        ]
+        reservation_ids = list(db.session.scalars(
+            insert(Reservation).returning(Reservation.id, sort_by_parameter_order=True), rows
+        ))
+        record_reservations_created(len(rows), now)
+        db.session.commit()
+    except AllocationError:
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for spot_id, lot_id in claimed:
+        free_spot_index.mark_taken(lot_id, spot_id)
+    return [
+        (reservation_id, spot_id, lot_id, vehicle_number)
+        for reservation_id, (spot_id, lot_id), vehicle_number in zip(reservation_ids, claimed, vehicle_numbers)
+    ]
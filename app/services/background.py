@@ -0,0 +1,38 @@
+# Background workers - periodic jobs that run off the request thread
+import threading
+
+
+class PeriodicTask:
+    """Run `job()` every `interval` seconds in a daemon thread, inside an app context"""
+
+    def __init__(self, name, interval, job):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, app, interval=None):
+        if self._thread and self._thread.is_alive():
+            return
+        if interval:
+            self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(app,), name=self.name, daemon=True)
+        self._thread.start()
+        print(f"Background: Started {self.name} (every {self.interval}s)")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self, app):
+        from app.extensions import db
+        while not self._stop.wait(self.interval):
+            with app.app_context():
+                try:
+                    self.job()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Background Error: {self.name} failed: {str(e)}")
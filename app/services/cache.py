@@ -0,0 +1,356 @@
+# Read-through cache for dashboards, listings and geography dropdowns
+#
+# `cache.fetch(key, compute, tags=...)` returns the stored value or computes and
+# stores it. Every entry has a TTL and a set of tags ("lot:5", "lots",
+# "geography", ...); the LRU bound caps the number of entries.
+#
+# Writes invalidate by tag when their transaction commits: mapper events cover
+# ORM writes, and set-based UPDATE/DELETE/INSERT statements are tagged by the
+# model they target (or by a `cache_tags` execution option for finer tags, as
+# in ParkingLot.adjust_available_spots). A value computed while one of its tags
+# was being invalidated is not stored, so a slow reader cannot put stale data
+# back.
+#
+# CACHE_BACKEND picks "memory" (per process), "sqlite" (a local file shared by
+# every worker on the host, so invalidations reach all of them) or "none".
+# Values must be JSON-serializable so both backends behave alike, and callers
+# must not mutate what they get back.
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models.geography import Continent, Country, State, City
+from app.models.parking import ParkingLot, ParkingSpot
+from app.models.user import User
+
+# Tags fired by any write to a model, besides the per-row tags below
+MODEL_TAGS = {
+    ParkingLot: ('lots',),
+    ParkingSpot: ('spots',),
+    Continent: ('geography',),
+    Country: ('geography',),
+    State: ('geography',),
+    City: ('geography',),
+    User: ('users',),
+}
+
+
+def lot_tag(lot_id):
+    return f'lot:{lot_id}'
+
+
+class MemoryBackend:
+    """Per-process LRU of (expires_at, tags, value) entries"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+        self._invalidated_at = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.time():
+                self._drop(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[2]
+
+    def set(self, key, value, ttl, tags, computed_since):
+        """Store unless a tag was invalidated after `computed_since`; returns (stored, evicted)"""
+        with self._lock:
+            if any(self._invalidated_at.get(tag, 0) >= computed_since for tag in tags):
+                return False, 0
+            self._drop(key)
+            self._entries[key] = (time.time() + ttl, tags, value)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                evicted += 1
+            return True, evicted
+
+    def invalidate(self, tags):
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                self._invalidated_at[tag] = now
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._drop(key)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def size(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+class SQLiteBackend:
+    """LRU in a local SQLite file shared by every worker process on the host"""
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+        'expires_at REAL NOT NULL, used_at REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS ix_cache_entries_used_at ON cache_entries (used_at)',
+        'CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT NOT NULL, key TEXT NOT NULL, '
+        'PRIMARY KEY (tag, key)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS ix_cache_tags_key ON cache_tags (key)',
+        'CREATE TABLE IF NOT EXISTS cache_invalidations (tag TEXT PRIMARY KEY, invalidated_at REAL NOT NULL)',
+    ]
+    # Recency is only rewritten when this stale, so hot reads do not all write
+    TOUCH_SECONDS = 1.0
+    # The size bound is checked every this many stores
+    EVICT_EVERY = 100
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._stores = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT value, expires_at, used_at FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or row[1] <= now:
+            return False, None
+        if now - row[2] > self.TOUCH_SECONDS:
+            connection.execute('UPDATE cache_entries SET used_at = ? WHERE key = ?', (now, key))
+        return True, json.loads(row[0])
+
+    def set(self, key, value, ttl, tags, computed_since):
+        connection = self._connection()
+        now = time.time()
+        payload = json.dumps(value)
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if tags:
+                stale = connection.execute(
+                    f"SELECT 1 FROM cache_invalidations WHERE tag IN ({','.join('?' * len(tags))}) "
+                    'AND invalidated_at >= ? LIMIT 1', (*tags, computed_since)
+                ).fetchone()
+                if stale:
+                    return False, 0
+            connection.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)',
+                (key, payload, now + ttl, now)
+            )
+            connection.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            connection.executemany('INSERT INTO cache_tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in tags])
+        self._stores += 1
+        return True, self._evict(now) if self._stores % self.EVICT_EVERY == 0 else 0
+
+    def _evict(self, now):
+        """Drop expired entries, then the least recently used beyond the bound"""
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            expired = connection.execute('DELETE FROM cache_entries WHERE expires_at <= ?', (now,)).rowcount
+            over = connection.execute('SELECT count(*) FROM cache_entries').fetchone()[0] - self.max_entries
+            evicted = 0
+            if over > 0:
+                evicted = connection.execute(
+                    'DELETE FROM cache_entries WHERE key IN '
+                    '(SELECT key FROM cache_entries ORDER BY used_at LIMIT ?)', (over,)
+                ).rowcount
+            if expired or evicted:
+                connection.execute('DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)')
+        return evicted
+
+    def invalidate(self, tags):
+        connection = self._connection()
+        now = time.time()
+        placeholders = ','.join('?' * len(tags))
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache_invalidations (tag, invalidated_at) VALUES (?, ?)',
+                [(tag, now) for tag in tags]
+            )
+            keys = [key for key, in connection.execute(
+                f'SELECT DISTINCT key FROM cache_tags WHERE tag IN ({placeholders})', tuple(tags)
+            )]
+            for offset in range(0, len(keys), 500):
+                batch = keys[offset:offset + 500]
+                marks = ','.join('?' * len(batch))
+                connection.execute(f'DELETE FROM cache_entries WHERE key IN ({marks})', batch)
+                connection.execute(f'DELETE FROM cache_tags WHERE key IN ({marks})', batch)
+        return len(keys)
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM cache_entries')
+            connection.execute('DELETE FROM cache_tags')
+
+    def size(self):
+        return self._connection().execute('SELECT count(*) FROM cache_entries').fetchone()[0]
+
+
+class Cache:
+    """Read-through cache with TTL, LRU bound and tag invalidation (see the module comment)"""
+
+    def __init__(self):
+        self.backend = None
+        self.default_ttl = 60
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'stale_skips': 0, 'invalidations': 0,
+                          'invalidated_entries': 0, 'evictions': 0}
+
+    def init_app(self, app):
+        kind = app.config['CACHE_BACKEND']
+        if kind == 'memory':
+            self.backend = MemoryBackend(app.config['CACHE_MAX_ENTRIES'])
+        elif kind == 'sqlite':
+            self.backend = SQLiteBackend(app.config['CACHE_SQLITE_PATH'], app.config['CACHE_MAX_ENTRIES'])
+        elif kind == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND '{kind}', expected memory, sqlite or none")
+        self.default_ttl = app.config['CACHE_DEFAULT_TTL']
+        print(f"Cache: Using {kind} backend")
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def fetch(self, key, compute, tags=(), ttl=None):
+        """Cached value of `key`, or `compute()` stored under `tags`.
+
+        `tags` may also be a function of the computed value, for entries whose
+        tags depend on what they hold (e.g. the lots in a listing).
+        """
+        if self.backend is None:
+            return compute()
+        hit, value = self.backend.get(key)
+        if hit:
+            self._count('hits')
+            return value
+        self._count('misses')
+        started = time.time()
+        value = compute()
+        entry_tags = tuple(tags(value) if callable(tags) else tags)
+        stored, evicted = self.backend.set(key, value, ttl or self.default_ttl, entry_tags, started)
+        self._count('stores' if stored else 'stale_skips')
+        if evicted:
+            self._count('evictions', evicted)
+        return value
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of `tags` right away"""
+        if self.backend is None or not tags:
+            return 0
+        removed = self.backend.invalidate(tuple(set(tags)))
+        self._count('invalidations')
+        self._count('invalidated_entries', removed)
+        return removed
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def metrics(self):
+        """Hit rate and entry counts of this process"""
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = round(counters['hits'] / lookups, 4) if lookups else 0
+        counters['entries'] = self.backend.size() if self.backend is not None else 0
+        counters['backend'] = type(self.backend).__name__ if self.backend is not None else None
+        return counters
+
+
+cache = Cache()
+
+
+def invalidate_on_commit(session, *tags):
+    """Invalidate `tags` once `session` commits (dropped if it rolls back)"""
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+
+def _row_tags(target):
+    if isinstance(target, ParkingLot):
+        return (lot_tag(target.id),)
+    if isinstance(target, ParkingSpot):
+        return (lot_tag(target.parking_lot_id),)
+    return ()
+
+
+def _on_row_write(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        invalidate_on_commit(session, *MODEL_TAGS[type(target)], *_row_tags(target))
+
+
+for _model in MODEL_TAGS:
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _on_row_write)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _on_bulk_write(state):
+    """Set-based writes bypass mapper events; tag them by option or by target model"""
+    if not (state.is_update or state.is_delete or state.is_insert):
+        return
+    tags = state.execution_options.get('cache_tags')
+    if tags is None:
+        mapper = state.bind_mapper
+        tags = MODEL_TAGS.get(mapper.class_, ()) if mapper is not None else ()
+    if tags:
+        invalidate_on_commit(state.session, *tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def _fire_pending(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        cache.invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,144 @@
+# Batch exit processing - vacate or cancel many reservations in one pass
+from datetime import datetime
+from collections import Counter
+from sqlalchemy import update
+from sqlalchemy.orm.exc import StaleDataError
+from app.extensions import db
+from app.models.enums import SpotStatus, ReservationStatus
+from app.models.parking import ParkingLot, ParkingSpot, Reservation
+from app.services.billing import lot_cost
+from app.services.free_spots import free_spot_index
+from app.services.stats import record_revenue, record_spot_transition
+
+EXIT_MODES = {
+    'vacate': ReservationStatus.COMPLETED,
+    'cancel': ReservationStatus.CANCELLED,
+}
+
+
+def _apply(updates, spot_statuses, now):
+    """Write one group of exits: reservations, freed spots, counters. Returns the freed (spot, lot) pairs."""
+    db.session.execute(
+        update(Reservation),
+        [{k: u[k] for k in ('id', 'version', 'end_time', 'status', 'total_cost', 'updated_at')} for u in updates]
+    )
+    # Scheduled bookings never took their spot; out-of-service spots stay out of service
+    spot_ids = [u['spot_id'] for u in updates if u['spot_id'] is not None]
+    freed = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id.in_(spot_ids), ParkingSpot.status.notin_((SpotStatus.AVAILABLE, *ParkingSpot.OUT_OF_SERVICE)))
+        .values(status=SpotStatus.AVAILABLE, updated_at=now, version=ParkingSpot.version + 1)
+        .returning(ParkingSpot.id, ParkingSpot.parking_lot_id)
+        .execution_options(synchronize_session=False)
+    ).all() if spot_ids else []
+    # Each affected lot gets one counter update
+    for lot_id, count in Counter(lot_id for _, lot_id in freed).items():
+        ParkingLot.adjust_available_spots(lot_id, count)
+    for status, count in Counter(spot_statuses[spot_id] for spot_id, _ in freed).items():
+        record_spot_transition(status, SpotStatus.AVAILABLE, count)
+    return freed
+
+
+def release_reservations(reservation_ids=None, vehicle_numbers=None, mode='vacate', user_id=None):
+    """Vacate or cancel a burst of reservations.
+
+    Reservations are matched by id or by plate number (active ones only; a
+    plate with several active reservations releases all of them) and, when
+    `user_id` is given, must belong to that user. Cancelling a scheduled
+    reservation is free and leaves its spot alone. Items that cannot be
+    released are reported individually and do not stop the rest. Returns one
+    result dict per requested item, in request order, and one per reservation
+    for a plate that matched several.
+    """
+    if mode not in EXIT_MODES:
+        raise ValueError(f"Invalid mode '{mode}', expected one of {', '.join(EXIT_MODES)}")
+    reservation_ids = [int(r) for r in reservation_ids or []]
+    vehicle_numbers = [v for v in vehicle_numbers or [] if v]
+
+    # One query loads every candidate together with its spot's lot
+    query = db.session.query(
+        Reservation.id, Reservation.user_id, Reservation.vehicle_number, Reservation.status,
+        Reservation.version, Reservation.start_time, Reservation.end_time, Reservation.hourly_rate,
+        Reservation.parking_spot_id,
+        ParkingSpot.parking_lot_id, ParkingSpot.status.label('spot_status')
+    ).join(ParkingSpot, Reservation.parking_spot_id == ParkingSpot.id)
+    rows = []
+    if reservation_ids:
+        rows += query.filter(Reservation.id.in_(reservation_ids)).all()
+    if vehicle_numbers:
+        plate_query = query.filter(
+            Reservation.vehicle_number.in_(vehicle_numbers),
+            Reservation.status == ReservationStatus.ACTIVE
+        )
+        if user_id is not None:
+            plate_query = plate_query.filter(Reservation.user_id == user_id)
+        rows += plate_query.order_by(Reservation.start_time, Reservation.id).all()
+    by_id = {row.id: row for row in rows}
+    by_plate = {}
+    for row in by_id.values():
+        if row.status == ReservationStatus.ACTIVE and row.vehicle_number in vehicle_numbers:
+            by_plate.setdefault(row.vehicle_number, []).append(row)
+    # Lots for pricing, in one more query
+    lots = {
+        lot.id: lot for lot in ParkingLot.query.filter(ParkingLot.id.in_({row.parking_lot_id for row in rows}))
+    } if rows else {}
+
+    now = datetime.utcnow()
+    new_status = EXIT_MODES[mode]
+    results = []
+    updates = []
+    seen = set()
+    items = [(('reservation_id', rid), by_id.get(rid)) for rid in reservation_ids]
+    for plate in vehicle_numbers:
+        items += [(('vehicle_number', plate), row) for row in by_plate.get(plate) or [None]]
+    for key, row in items:
+        result = {key[0]: key[1]}
+        if row is None or (user_id is not None and row.user_id != user_id):
+            result.update(success=False, message='Reservation not found')
+        elif not (row.status == ReservationStatus.ACTIVE or
+                  (mode == 'cancel' and row.status == ReservationStatus.SCHEDULED)):
+            result.update(success=False, message='Reservation is not active')
+        elif row.id in seen:
+            result.update(success=False, message='Duplicate item in this batch')
+        else:
+            seen.add(row.id)
+            started = row.status == ReservationStatus.ACTIVE
+            total_cost = lot_cost(lots[row.parking_lot_id], row.start_time, now, mode, row.hourly_rate) if started else 0.0
+            updates.append({
+                'id': row.id, 'version': row.version, 'end_time': now if started else row.end_time,
+                'status': new_status, 'total_cost': total_cost, 'updated_at': now,
+                'spot_id': row.parking_spot_id if started else None, 'lot_id': row.parking_lot_id,
+                'result': result
+            })
+            result.update(success=True, reservation_id=row.id, total_cost=total_cost)
+        results.append(result)
+
+    freed = []
+    if updates:
+        spot_statuses = {row.parking_spot_id: row.spot_status for row in rows}
+        try:
+            try:
+                # Whole batch in one savepoint; if any row changed since it was read, redo it item by item
+                with db.session.begin_nested():
+                    freed = _apply(updates, spot_statuses, now)
+            except StaleDataError:
+                applied = []
+                for u in updates:
+                    try:
+                        with db.session.begin_nested():
+                            freed += _apply([u], spot_statuses, now)
+                        applied.append(u)
+                    except StaleDataError:
+                        u['result'].update(success=False, message='Reservation was changed by another request')
+                        u['result'].pop('total_cost')
+                updates = applied
+            record_revenue(sum(u['total_cost'] for u in updates), now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for spot_id, lot_id in freed:
+            free_spot_index.mark_free(lot_id, spot_id)
+
+    print(f"Batch Exit: {mode} processed {len(updates)} of {len(results)} item(s)")
+    return results
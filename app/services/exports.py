@@ -0,0 +1,365 @@
+# Exports for offline analytics
+#
+# Columnar: reservations joined with their spot, lot and city are read in
+# keyset chunks ordered by (updated_at, id), so only one chunk is ever in
+# memory, and written as Parquet or Arrow IPC files partitioned by the month
+# the stay started (month=YYYY-MM/part-<run>.parquet). An incremental export
+# continues from the updated_at watermark of the previous run and writes only
+# the rows changed since; a reservation can therefore appear in several runs
+# and readers keep the row with the newest updated_at per reservation_id.
+#
+# pyarrow is imported on first use, so the rest of the app runs without it.
+#
+# Rows: users, reservations or spots streamed as CSV or NDJSON, read in chunks
+# keyed on id so a download of any size holds one chunk at a time.
+import csv
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from enum import Enum
+from flask import current_app
+from sqlalchemy import Float, String, and_, or_, select, type_coerce
+from app.extensions import db
+from app.models.geography import City
+from app.models.enums import ReservationStatus
+from app.models.parking import JobCheckpoint, ParkingLot, ParkingSpot, Reservation
+from app.models.user import User
+
+CHECKPOINT = 'reservation_export'
+FORMATS = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+
+# (output column, source column)
+COLUMNS = [
+    ('reservation_id', Reservation.id),
+    ('user_id', Reservation.user_id),
+    ('parking_spot_id', Reservation.parking_spot_id),
+    ('spot_number', ParkingSpot.spot_number),
+    ('parking_lot_id', ParkingLot.id),
+    ('lot_name', ParkingLot.name),
+    ('city_id', City.id),
+    ('city_name', City.name),
+    ('vehicle_number', Reservation.vehicle_number),
+    ('start_time', Reservation.start_time),
+    ('end_time', Reservation.end_time),
+    ('status', Reservation.status),
+    ('total_cost', Reservation.total_cost),
+    ('created_at', Reservation.created_at),
+    ('updated_at', Reservation.updated_at),
+    ('is_deleted', Reservation.is_deleted),
+]
+# Read as raw values and converted by Arrow in bulk, as in billing.audit_reservations
+RAW = {
+    'start_time': String, 'end_time': String, 'created_at': String, 'updated_at': String,
+    'status': String, 'total_cost': Float,
+}
+STATUS_VALUES = {status.name: status.value for status in ReservationStatus}
+
+
+class ExportError(Exception):
+    """The export cannot run (e.g. pyarrow is not installed)"""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError("Parquet/Arrow export needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _schema(pa):
+    types = {
+        'spot_number': pa.string(), 'lot_name': pa.string(), 'city_name': pa.string(),
+        'vehicle_number': pa.string(), 'status': pa.string(), 'total_cost': pa.decimal128(10, 2),
+        'is_deleted': pa.bool_(),
+        'start_time': pa.timestamp('us'), 'end_time': pa.timestamp('us'),
+        'created_at': pa.timestamp('us'), 'updated_at': pa.timestamp('us'),
+    }
+    return pa.schema([(name, types.get(name, pa.int64())) for name, _ in COLUMNS])
+
+
+def _chunks(since=None, until=None, month=None, chunk_size=50000):
+    """Rows changed in (since, until], `chunk_size` at a time in (updated_at, id) order"""
+    query = select(*[
+        (type_coerce(column, RAW[name]) if name in RAW else column).label(name) for name, column in COLUMNS
+    ]).join(
+        ParkingSpot, Reservation.parking_spot_id == ParkingSpot.id
+    ).join(ParkingLot, ParkingSpot.parking_lot_id == ParkingLot.id).join(City, ParkingLot.city_id == City.id)
+    if since is not None:
+        query = query.where(Reservation.updated_at > since)
+    if until is not None:
+        query = query.where(Reservation.updated_at <= until)
+    if month is not None:
+        first = datetime.strptime(month, '%Y-%m')
+        following = (first + timedelta(days=32)).replace(day=1)
+        query = query.where(Reservation.start_time >= first, Reservation.start_time < following)
+
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.where(or_(
+                Reservation.updated_at > last[0],
+                and_(Reservation.updated_at == last[0], Reservation.id > last[1])
+            ))
+        rows = db.session.execute(page.order_by(Reservation.updated_at, Reservation.id).limit(chunk_size)).all()
+        if not rows:
+            return
+        last = (datetime.fromisoformat(rows[-1].updated_at), rows[-1].reservation_id)
+        yield rows
+        # Let the chunk go before the next one is fetched
+        del rows
+
+
+def _batch(pa, schema, rows):
+    arrays = []
+    for values, field in zip(zip(*rows), schema):
+        if field.name == 'status':
+            arrays.append(pa.array([STATUS_VALUES[name] for name in values], pa.string()))
+        elif field.name in RAW:
+            raw = pa.float64() if RAW[field.name] is Float else pa.string()
+            arrays.append(pa.array(values, raw).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _open_writer(pa, fmt, sink, schema):
+    if fmt == 'parquet':
+        return pa.parquet.ParquetWriter(sink, schema)
+    return pa.ipc.new_file(sink, schema)
+
+
+def _cutoff():
+    # Writers stamp updated_at before they commit; stay a little behind them
+    return datetime.utcnow() - timedelta(seconds=current_app.config['EXPORT_LAG_SECONDS'])
+
+
+def export_reservations(directory, fmt='parquet', full=False, chunk_size=None):
+    """Write reservations changed since the last export into month partitions under `directory`.
+
+    `full` ignores the watermark and exports everything. Files are written
+    under a temporary name and renamed once complete. Returns a summary.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown export format '{fmt}', expected one of {', '.join(FORMATS)}")
+    pa = _pyarrow()
+    schema = _schema(pa)
+    chunk_size = chunk_size or current_app.config['EXPORT_CHUNK_SIZE']
+    since = None if full else JobCheckpoint.get_watermark(CHECKPOINT)
+    until = _cutoff()
+    extension = FORMATS[fmt][0]
+    run = until.strftime('%Y%m%dT%H%M%S%f')
+
+    writers = {}
+    rows_written = 0
+    try:
+        for rows in _chunks(since, until, chunk_size=chunk_size):
+            batch = _batch(pa, schema, rows)
+            months = pa.compute.strftime(batch.column('start_time'), '%Y-%m')
+            for month in months.unique().to_pylist():
+                if month not in writers:
+                    path = os.path.join(directory, f'month={month}', f'part-{run}{extension}')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writers[month] = (path, _open_writer(pa, fmt, path + '.tmp', schema))
+                writers[month][1].write_batch(batch.filter(pa.compute.equal(months, month)))
+            rows_written += len(rows)
+            del rows, batch, months
+    except Exception:
+        for path, writer in writers.values():
+            writer.close()
+            os.remove(path + '.tmp')
+        raise
+
+    for path, writer in writers.values():
+        writer.close()
+        os.replace(path + '.tmp', path)
+    JobCheckpoint.set_watermark(CHECKPOINT, until)
+    db.session.commit()
+    print(f"Reservation Export: Wrote {rows_written} row(s) to {len(writers)} month partition(s) in {directory}")
+    return {
+        'rows': rows_written,
+        'since': since.isoformat() if since else None,
+        'watermark': until.isoformat(),
+        'files': sorted(path for path, _ in writers.values()),
+    }
+
+
+class _Spool:
+    """Write-only file object whose contents are handed out as they are written"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_reservations(fmt='parquet', since=None, month=None, chunk_size=None):
+    """One export file as an iterator of bytes, emitted chunk by chunk.
+
+    Returns (watermark, iterator); rows changed after the watermark are left
+    for the next export. Raises ExportError up front if the export cannot run.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown export format '{fmt}', expected one of {', '.join(FORMATS)}")
+    pa = _pyarrow()
+    schema = _schema(pa)
+    chunk_size = chunk_size or current_app.config['EXPORT_CHUNK_SIZE']
+    until = _cutoff()
+
+    def generate():
+        spool = _Spool()
+        writer = _open_writer(pa, fmt, spool, schema)
+        for rows in _chunks(since, until, month, chunk_size):
+            writer.write_batch(_batch(pa, schema, rows))
+            del rows
+            yield spool.take()
+        writer.close()
+        yield spool.take()
+
+    return until, generate()
+
+
+TEXT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'ndjson': ('.ndjson', 'application/x-ndjson'),
+}
+
+# table: (keyset column, [(output column, source column)], joins)
+TABLES = {
+    'users': (User.id, [
+        ('id', User.id), ('username', User.username), ('email', User.email), ('phone', User.phone),
+        ('first_name', User.first_name), ('last_name', User.last_name), ('gender', User.gender),
+        ('status', User.status), ('created_at', User.created_at), ('updated_at', User.updated_at),
+    ], []),
+    'reservations': (Reservation.id, [
+        ('id', Reservation.id), ('user_id', Reservation.user_id), ('parking_spot_id', Reservation.parking_spot_id),
+        ('spot_number', ParkingSpot.spot_number), ('parking_lot_id', ParkingLot.id), ('lot_name', ParkingLot.name),
+        ('vehicle_number', Reservation.vehicle_number), ('start_time', Reservation.start_time),
+        ('end_time', Reservation.end_time), ('status', Reservation.status), ('total_cost', Reservation.total_cost),
+        ('created_at', Reservation.created_at), ('updated_at', Reservation.updated_at),
+    ], [
+        (ParkingSpot, Reservation.parking_spot_id == ParkingSpot.id),
+        (ParkingLot, ParkingSpot.parking_lot_id == ParkingLot.id),
+    ]),
+    'spots': (ParkingSpot.id, [
+        ('id', ParkingSpot.id), ('spot_number', ParkingSpot.spot_number), ('parking_lot_id', ParkingLot.id),
+        ('lot_name', ParkingLot.name), ('status', ParkingSpot.status), ('held_until', ParkingSpot.held_until),
+        ('created_at', ParkingSpot.created_at), ('updated_at', ParkingSpot.updated_at),
+    ], [
+        (ParkingLot, ParkingSpot.parking_lot_id == ParkingLot.id),
+    ]),
+}
+
+
+def _converters(columns):
+    """Per column, a function making its value CSV/JSON friendly (None where it already is)"""
+    converters = []
+    for _, column in columns:
+        python_type = column.type.python_type
+        if issubclass(python_type, Enum):
+            converters.append(lambda value: value.value if value is not None else None)
+        elif python_type is datetime:
+            converters.append(lambda value: value.isoformat() if value is not None else None)
+        elif python_type is Decimal:
+            converters.append(lambda value: float(value) if value is not None else None)
+        else:
+            converters.append(None)
+    return converters
+
+
+def _plain(rows, converters):
+    converting = [(index, convert) for index, convert in enumerate(converters) if convert]
+    for row in rows:
+        row = list(row)
+        for index, convert in converting:
+            row[index] = convert(row[index])
+        yield row
+
+
+def _keyset(query, key, chunk_size, first_chunk_size=100):
+    """Rows of `query` in `key` order, read `chunk_size` at a time after the last key seen.
+
+    The first read is small so a download starts without waiting for a full chunk.
+    """
+    last = None
+    size = min(first_chunk_size, chunk_size)
+    while True:
+        page = query if last is None else query.where(key > last)
+        rows = db.session.execute(page.order_by(key).limit(size)).all()
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield rows
+        del rows
+        size = chunk_size
+
+
+def stream_rows(table, fmt='csv', conditions=(), chunk_size=None):
+    """Live rows of `table` matching `conditions` as an iterator of CSV or NDJSON text chunks.
+
+    The CSV header goes out before the first read, so the download starts at
+    once. Raises ExportError up front for an unknown table or format.
+    """
+    if table not in TABLES:
+        raise ExportError(f"Unknown export table '{table}', expected one of {', '.join(TABLES)}")
+    if fmt not in TEXT_FORMATS:
+        raise ExportError(f"Unknown export format '{fmt}', expected one of {', '.join(TEXT_FORMATS)}")
+    key, columns, joins = TABLES[table]
+    chunk_size = chunk_size or current_app.config['EXPORT_STREAM_CHUNK_SIZE']
+    names = [name for name, _ in columns]
+    converters = _converters(columns)
+    # The key leads so the last key of a chunk is row[0]
+    query = select(*[column for _, column in columns])
+    for target, on in joins:
+        query = query.join(target, on)
+    query = query.where(key.class_.is_deleted == False, *conditions)
+
+    def generate():
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+            yield buffer.getvalue()
+        for rows in _keyset(query, key, chunk_size):
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(_plain(rows, converters))
+                chunk = buffer.getvalue()
+            else:
+                chunk = ''.join(json.dumps(dict(zip(names, row))) + '\n' for row in _plain(rows, converters))
+            del rows
+            yield chunk
+
+    return generate()
@@ -0,0 +1,89 @@
+# In-memory per-lot index of free parking spots
+#
+# The database stays the source of truth: every spot handed out here is still
+# claimed with a conditional UPDATE, so a stale entry only costs one retry.
+import threading
+from app.extensions import db
+from app.models.enums import SpotStatus
+from app.models.parking import ParkingSpot
+
+
+class FreeSpotIndex:
+    """Free spot ids per lot, answering "give me a free spot" and "how many are free" in O(1)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = {}
+        self._listeners = []
+        self.ready = False
+
+    def on_free(self, callback):
+        """Call `callback(lot_id, spot_id)` whenever a spot becomes free (must be cheap)"""
+        self._listeners.append(callback)
+
+    def build(self, app):
+        """Load every available spot in one query (run once at startup)"""
+        with app.app_context():
+            rows = db.session.query(ParkingSpot.id, ParkingSpot.parking_lot_id).filter(
+                ParkingSpot.status == SpotStatus.AVAILABLE,
+                ParkingSpot.is_deleted == False
+            ).all()
+        free = {}
+        for spot_id, lot_id in rows:
+            free.setdefault(lot_id, set()).add(spot_id)
+        with self._lock:
+            self._free = free
+            self.ready = True
+        print(f"Free Spot Index: Indexed {len(rows)} free spots across {len(free)} lots")
+
+    def reload_lot(self, lot_id, *conditions):
+        """Re-read the free spots of one lot (matching any extra `conditions`) from the database"""
+        ids = {
+            spot_id for (spot_id,) in db.session.query(ParkingSpot.id).filter(
+                ParkingSpot.parking_lot_id == lot_id,
+                ParkingSpot.status == SpotStatus.AVAILABLE,
+                ParkingSpot.is_deleted == False,
+                *conditions
+            )
+        }
+        with self._lock:
+            self._free[lot_id] = ids
+        return len(ids)
+
+    def take(self, lot_id):
+        """Remove and return any free spot id of the lot, or None if none is known"""
+        with self._lock:
+            spots = self._free.get(lot_id)
+            if not spots:
+                return None
+            return spots.pop()
+
+    def count(self, lot_id):
+        with self._lock:
+            return len(self._free.get(lot_id, ()))
+
+    def mark_free(self, lot_id, spot_id):
+        with self._lock:
+            self._free.setdefault(lot_id, set()).add(spot_id)
+        for callback in self._listeners:
+            callback(lot_id, spot_id)
+
+    def mark_taken(self, lot_id, spot_id):
+        with self._lock:
+            spots = self._free.get(lot_id)
+            if spots:
+                spots.discard(spot_id)
+
+    def set_status(self, lot_id, spot_id, status):
+        """Keep the index in line with a spot's new status"""
+        if status == SpotStatus.AVAILABLE:
+            self.mark_free(lot_id, spot_id)
+        else:
+            self.mark_taken(lot_id, spot_id)
+
+    def drop_lot(self, lot_id):
+        with self._lock:
+            self._free.pop(lot_id, None)
+
+
+free_spot_index = FreeSpotIndex()
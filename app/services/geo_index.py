@@ -0,0 +1,98 @@
+# Geography ancestor index for "all lots under a continent/country/state" filters
+#
+# city_ancestors is a closure table over cities: for every city one row per
+# level of its path up the tree (the city itself, its state, country and
+# continent). A filter at any level is then one indexed join from
+# parking_lots on city_id, instead of collecting state ids and then city ids
+# into an IN list. Mapper events keep the rows current inside the writing
+# transaction: a new city adds its path, moving a city, state or country to
+# another parent rewrites the paths of every city below it, and a deleted
+# node takes its cities' rows with it. rebuild() recomputes the whole table
+# (databases that predate it, or rows written outside the app).
+from sqlalchemy import delete, event, func, insert, inspect, literal, select, union_all
+from app.extensions import db
+from app.models.geography import Continent, Country, State, City, CityAncestor
+from app.models.parking import ParkingLot
+
+# The column holding each level's id on a cities-states-countries join
+ANCESTOR_COLUMNS = {
+    'city': City.id,
+    'state': City.state_id,
+    'country': State.country_id,
+    'continent': Country.continent_id,
+}
+
+LEVELS = {Continent: 'continent', Country: 'country', State: 'state', City: 'city'}
+
+# The foreign key that moves a node to another parent
+PARENT_KEYS = {Country: 'continent_id', State: 'country_id', City: 'state_id'}
+
+COLUMNS = ['level', 'ancestor_id', 'city_id']
+
+
+def _paths(*conditions):
+    """(level, ancestor_id, city_id) rows for every city matching `conditions`"""
+    tree = City.__table__.join(State.__table__, City.state_id == State.id).join(
+        Country.__table__, State.country_id == Country.id
+    )
+    return union_all(*(
+        select(literal(level), ancestor, City.id).select_from(tree).where(*conditions)
+        for level, ancestor in ANCESTOR_COLUMNS.items()
+    ))
+
+
+def _below(level, node_id):
+    return select(CityAncestor.city_id).where(CityAncestor.level == level, CityAncestor.ancestor_id == node_id)
+
+
+def _refresh(connection, level, node_id):
+    """Rewrite the paths of every city at or below one node"""
+    connection.execute(delete(CityAncestor).where(CityAncestor.city_id.in_(_below(level, node_id))))
+    connection.execute(insert(CityAncestor).from_select(COLUMNS, _paths(ANCESTOR_COLUMNS[level] == node_id)))
+
+
+def _forget(connection, level, node_id):
+    connection.execute(delete(CityAncestor).where(CityAncestor.city_id.in_(_below(level, node_id))))
+
+
+@event.listens_for(City, 'after_insert')
+def _city_inserted(mapper, connection, target):
+    _refresh(connection, 'city', target.id)
+
+
+def _moved(mapper, connection, target):
+    if inspect(target).attrs[PARENT_KEYS[type(target)]].history.has_changes():
+        _refresh(connection, LEVELS[type(target)], target.id)
+
+
+def _deleted(mapper, connection, target):
+    _forget(connection, LEVELS[type(target)], target.id)
+
+
+for _model in LEVELS:
+    if _model in PARENT_KEYS:
+        event.listen(_model, 'after_update', _moved)
+    event.listen(_model, 'after_delete', _deleted)
+
+
+def within(query, level, node_id):
+    """Restrict a ParkingLot query to the lots under one continent, country, state or city"""
+    return query.join(CityAncestor, CityAncestor.city_id == ParkingLot.city_id).filter(
+        CityAncestor.level == level, CityAncestor.ancestor_id == node_id
+    )
+
+
+def rebuild():
+    """Recompute the paths of every city; returns the number of rows written"""
+    db.session.execute(delete(CityAncestor))
+    db.session.execute(insert(CityAncestor).from_select(COLUMNS, _paths()))
+    db.session.commit()
+    return db.session.query(func.count()).select_from(CityAncestor).scalar()
+
+
+def build(app):
+    """Fill the index at startup when it does not cover every city"""
+    with app.app_context():
+        indexed = db.session.query(func.count()).select_from(CityAncestor).filter(CityAncestor.level == 'city').scalar()
+        if indexed != db.session.query(func.count(City.id)).scalar():
+            print(f"Geography Index: Rebuilt with {rebuild()} ancestor rows")
@@ -0,0 +1,100 @@
+# Immutable in-process snapshot of the geography tree
+#
+# Continents, countries, states and cities change a few times a year but fill
+# every location dropdown and the geography admin pages. GeographyTree reads
+# the four tables once and precomputes the JSON body of every dropdown list
+# with a strong ETag (a hash of that body). A tree is never modified after it
+# is built, so requests share it without locking and a rebuild swaps in a
+# new one.
+#
+# The tree is rebuilt when the geography version changes. The version is a
+# token kept in the read-through cache under the "geography" tag, so any
+# committed geography write drops it and the next read builds a fresh tree:
+# at once in the writing worker, and in the others too with the sqlite cache
+# backend (the memory backend leaves them on the old tree for up to
+# CACHE_GEOGRAPHY_TTL). With CACHE_BACKEND=none every read rebuilds. ETags
+# depend on content only, so a rebuild that finds the same data keeps
+# answering 304 Not Modified.
+import hashlib
+import json
+import threading
+import uuid
+from collections import namedtuple
+from flask import current_app
+from app.extensions import db
+from app.models.geography import Continent, Country, State, City
+from app.services.cache import cache
+
+Node = namedtuple('Node', 'id name code parent_id')
+
+# Level name -> model and the column pointing at its parent
+LEVELS = {
+    'continents': (Continent, None),
+    'countries': (Country, Country.continent_id),
+    'states': (State, State.country_id),
+    'cities': (City, City.state_id),
+}
+
+VERSION_KEY = 'geography:version'
+
+
+def _options(nodes):
+    """(JSON body, ETag) of one dropdown list"""
+    body = json.dumps([{'id': node.id, 'name': node.name} for node in nodes], separators=(',', ':')).encode()
+    return body, hashlib.sha256(body).hexdigest()[:32]
+
+
+class GeographyTree:
+    """All four geography levels as tuples of Nodes, plus every dropdown body"""
+
+    def __init__(self, token, levels):
+        self.token = token
+        self.continents, self.countries, self.states, self.cities = (levels[name] for name in LEVELS)
+        self._options = {}
+        for name, nodes in levels.items():
+            self._options[(name, None)] = _options(nodes)
+            children = {}
+            for node in nodes:
+                children.setdefault(node.parent_id, []).append(node)
+            for parent_id, group in children.items():
+                if parent_id is not None:
+                    self._options[(name, parent_id)] = _options(group)
+        self._empty = _options(())
+
+    def options(self, level, parent_id=None):
+        """(body, etag) of a level's list, all of it or the children of one parent"""
+        return self._options.get((level, parent_id), self._empty)
+
+
+def _build(token):
+    levels = {}
+    for name, (model, parent) in LEVELS.items():
+        columns = [model.id, model.name, model.code, parent if parent is not None else db.literal(None)]
+        rows = db.session.query(*columns).order_by(model.id).all()
+        levels[name] = tuple(Node(*row) for row in rows)
+    return GeographyTree(token, levels)
+
+
+class GeographyTreeCache:
+    """Hands out the current GeographyTree, rebuilding it after geography writes"""
+
+    def __init__(self):
+        self._tree = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def current(self):
+        token = cache.fetch(VERSION_KEY, lambda: uuid.uuid4().hex, tags=('geography',),
+                            ttl=current_app.config['CACHE_GEOGRAPHY_TTL'])
+        tree = self._tree
+        if tree is not None and tree.token == token:
+            return tree
+        with self._lock:
+            tree = self._tree
+            if tree is None or tree.token != token:
+                tree = self._tree = _build(token)
+                self.builds += 1
+        return tree
+
+
+geography_tree = GeographyTreeCache()
@@ -0,0 +1,170 @@
+# Short-lived spot holds - keep a spot for a user while they finish checkout
+#
+# A hold flips the spot to HELD with an expiry time. Only the holder can turn
+# it into a booking; everyone else sees it as taken. Expired holds are released
+# in batches by a sweeper that walks the held_until index, never the whole table.
+from datetime import datetime, timedelta
+from flask import current_app
+from collections import Counter
+from sqlalchemy import select, update
+from app.extensions import db
+from app.models.enums import ParkingLotStatus, SpotStatus
+from app.models.parking import ParkingLot, ParkingSpot
+from app.services.allocation import AllocationError, NotFoundError, SpotTakenError, not_booked, walk_in_until
+from app.services.background import PeriodicTask
+from app.services.free_spots import free_spot_index
+from app.services.stats import record_spot_transition
+
+
+def hold_spot(spot_id, user_id, ttl_seconds=None):
+    """Hold an available spot for `user_id`. Returns the expiry time.
+
+    Holding a spot the user already holds just extends the hold.
+    """
+    spot = db.session.get(ParkingSpot, spot_id)
+    if spot is None or spot.is_deleted:
+        raise NotFoundError('Spot not found')
+    if spot.parking_lot.status != ParkingLotStatus.ACTIVE:
+        raise AllocationError(f'Lot is {spot.parking_lot.status.value}')
+
+    ttl = ttl_seconds or current_app.config['SPOT_HOLD_TTL_SECONDS']
+    now = datetime.utcnow()
+    held_until = now + timedelta(seconds=ttl)
+    lot_id = spot.parking_lot_id
+
+    # Extend our own hold, otherwise take the spot if it is still free
+    extended = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == spot_id, ParkingSpot.status == SpotStatus.HELD,
+               ParkingSpot.held_by_user_id == user_id)
+        .values(held_until=held_until, updated_at=now, version=ParkingSpot.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not extended:
+        claimed = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id == spot_id, ParkingSpot.status == SpotStatus.AVAILABLE,
+                   ParkingSpot.is_deleted == False, not_booked(now, walk_in_until(now)))
+            .values(status=SpotStatus.HELD, held_until=held_until, held_by_user_id=user_id, updated_at=now,
+                    version=ParkingSpot.version + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            raise SpotTakenError('Spot is no longer available')
+        ParkingLot.adjust_available_spots(lot_id, -1)
+        record_spot_transition(SpotStatus.AVAILABLE, SpotStatus.HELD)
+    db.session.commit()
+    free_spot_index.mark_taken(lot_id, spot_id)
+    return held_until
+
+
+def hold_any_spot(lot_id, user_id, ttl_seconds=None):
+    """Hold whichever spot of the lot is free. Returns (spot_id, held_until) or None when full.
+
+    Commits on success; used to hand a freed spot to the next waitlisted user.
+    """
+    ttl = ttl_seconds or current_app.config['SPOT_HOLD_TTL_SECONDS']
+    now = datetime.utcnow()
+    held_until = now + timedelta(seconds=ttl)
+    # A hold turns into a walk-in, so spots kept for a booking are skipped
+    unbooked = not_booked(now, walk_in_until(now))
+    hold_values = dict(
+        status=SpotStatus.HELD, held_until=held_until, held_by_user_id=user_id, updated_at=now,
+        version=ParkingSpot.version + 1
+    )
+
+    spot_id = None
+    # Try the in-memory index first, then fall back to the database
+    while spot_id is None:
+        candidate = free_spot_index.take(lot_id)
+        if candidate is None:
+            break
+        if db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id == candidate, ParkingSpot.status == SpotStatus.AVAILABLE, unbooked)
+            .values(**hold_values)
+            .execution_options(synchronize_session=False)
+        ).rowcount:
+            spot_id = candidate
+    if spot_id is None:
+        candidate = (
+            select(ParkingSpot.id)
+            .where(ParkingSpot.parking_lot_id == lot_id, ParkingSpot.status == SpotStatus.AVAILABLE,
+                   ParkingSpot.is_deleted == False, unbooked)
+            .order_by(ParkingSpot.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        spot_id = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id == candidate, ParkingSpot.status == SpotStatus.AVAILABLE)
+            .values(**hold_values)
+            .returning(ParkingSpot.id)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+    if spot_id is None:
+        db.session.rollback()
+        return None
+    ParkingLot.adjust_available_spots(lot_id, -1)
+    record_spot_transition(SpotStatus.AVAILABLE, SpotStatus.HELD)
+    db.session.commit()
+    return spot_id, held_until
+
+
+def release_hold(spot_id, user_id):
+    """Give up a hold early. Returns True if the user held the spot."""
+    row = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == spot_id, ParkingSpot.status == SpotStatus.HELD,
+               ParkingSpot.held_by_user_id == user_id)
+        .values(status=SpotStatus.AVAILABLE, held_until=None, held_by_user_id=None, updated_at=datetime.utcnow(),
+                version=ParkingSpot.version + 1)
+        .returning(ParkingSpot.parking_lot_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        db.session.rollback()
+        return False
+    ParkingLot.adjust_available_spots(row.parking_lot_id, 1)
+    record_spot_transition(SpotStatus.HELD, SpotStatus.AVAILABLE)
+    db.session.commit()
+    free_spot_index.mark_free(row.parking_lot_id, spot_id)
+    return True
+
+
+def sweep_expired_holds(batch_size=None, now=None):
+    """Release expired holds in batches. Returns how many spots were freed."""
+    batch_size = batch_size or current_app.config['SPOT_HOLD_SWEEP_BATCH']
+    now = now or datetime.utcnow()
+    released = 0
+    while True:
+        expired = (
+            select(ParkingSpot.id)
+            .where(ParkingSpot.held_until < now, ParkingSpot.status == SpotStatus.HELD)
+            .order_by(ParkingSpot.held_until)
+            .limit(batch_size)
+        )
+        freed = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(expired), ParkingSpot.status == SpotStatus.HELD)
+            .values(status=SpotStatus.AVAILABLE, held_until=None, held_by_user_id=None, updated_at=now,
+                    version=ParkingSpot.version + 1)
+            .returning(ParkingSpot.id, ParkingSpot.parking_lot_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for lot_id, count in Counter(lot_id for _, lot_id in freed).items():
+            ParkingLot.adjust_available_spots(lot_id, count)
+        record_spot_transition(SpotStatus.HELD, SpotStatus.AVAILABLE, len(freed))
+        db.session.commit()
+        for spot_id, lot_id in freed:
+            free_spot_index.mark_free(lot_id, spot_id)
+        released += len(freed)
+        if len(freed) < batch_size:
+            break
+    if released:
+        print(f"Hold Sweeper: Released {released} expired hold(s)")
+    return released
+
+
+hold_sweeper = PeriodicTask('hold-sweeper', 30, sweep_expired_holds)
@@ -0,0 +1,130 @@
+# Idempotency-Key support - replay stored responses for retried requests
+#
+# The first request with a key inserts a placeholder row (unique per user and
+# key), runs, and stores its response. Retries get the stored response back
+# without touching spot or reservation rows. A key is tied to a fingerprint of
+# the request (method, endpoint, URL arguments and canonical body), so reusing
+# it for a different request is refused instead of replaying the wrong answer. Rows expire after
+# IDEMPOTENCY_TTL_SECONDS and are purged in batches by a background task.
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models.parking import IdempotencyRecord
+from app.services.background import PeriodicTask
+
+IN_PROGRESS = 'in_progress'
+MISMATCH = 'mismatch'
+
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'in_progress': 0, 'stored': 0, 'purged': 0}
+
+
+def _count(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def fingerprint(method, endpoint, view_args, body):
+    """SHA-256 of everything that makes two keyed requests the same request"""
+    canonical = json.dumps([method, endpoint, view_args or {}, body], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def begin(user_id, key, endpoint, request_fingerprint=None):
+    """Start handling a keyed request.
+
+    Returns the stored record for a replay, IN_PROGRESS when the first request
+    with this key is still running, MISMATCH when the key was used for another
+    endpoint or request body, or None when the caller should run the request (a placeholder
+    row now reserves the key).
+    """
+    now = datetime.utcnow()
+    record = IdempotencyRecord.query.filter(
+        IdempotencyRecord.user_id == user_id,
+        IdempotencyRecord.key == key,
+        IdempotencyRecord.expires_at > now
+    ).first()
+    if record is None:
+        # Clear out an expired row with the same key before reserving it again
+        db.session.execute(delete(IdempotencyRecord).where(
+            IdempotencyRecord.user_id == user_id, IdempotencyRecord.key == key
+        ))
+        ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_TTL_SECONDS'])
+        db.session.add(IdempotencyRecord(
+            user_id=user_id, key=key, endpoint=endpoint, fingerprint=request_fingerprint,
+            created_at=now, expires_at=now + ttl
+        ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request with the same key got there first
+            db.session.rollback()
+            _count('in_progress')
+            return IN_PROGRESS
+        _count('misses')
+        return None
+    if record.endpoint != endpoint or record.fingerprint != request_fingerprint:
+        return MISMATCH
+    if record.status_code is None:
+        _count('in_progress')
+        return IN_PROGRESS
+    _count('hits')
+    return record
+
+
+def finish(user_id, key, status_code, body):
+    """Store the response for a keyed request (server errors release the key instead)"""
+    # The handler has committed its own work by now; start from a clean transaction
+    db.session.rollback()
+    record = IdempotencyRecord.query.filter_by(user_id=user_id, key=key).first()
+    if record is None:
+        return
+    if status_code >= 500:
+        db.session.delete(record)
+    else:
+        record.status_code = status_code
+        record.body = body
+        _count('stored')
+    db.session.commit()
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired keys in batches. Returns how many rows were removed."""
+    removed = 0
+    while True:
+        expired = select(IdempotencyRecord.id).where(
+            IdempotencyRecord.expires_at <= datetime.utcnow()
+        ).limit(batch_size)
+        deleted = db.session.execute(
+            delete(IdempotencyRecord).where(IdempotencyRecord.id.in_(expired))
+        ).rowcount
+        db.session.commit()
+        removed += deleted
+        if deleted < batch_size:
+            break
+    if removed:
+        _count('purged', removed)
+        print(f"Idempotency: Purged {removed} expired key(s)")
+    return removed
+
+
+def metrics():
+    """Replay hit rate and how much the key table is holding"""
+    rows, body_bytes = db.session.query(
+        func.count(IdempotencyRecord.id), func.coalesce(func.sum(func.length(IdempotencyRecord.body)), 0)
+    ).one()
+    with _lock:
+        counters = dict(_counters)
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_rate'] = round(counters['hits'] / lookups, 4) if lookups else 0
+    counters['stored_rows'] = rows
+    counters['stored_body_bytes'] = int(body_bytes)
+    return counters
+
+
+idempotency_purger = PeriodicTask('idempotency-purger', 300, purge_expired)
@@ -0,0 +1,60 @@
+# Keyset (cursor) pagination over (created_at, id), newest first
+#
+# A page is read with WHERE (created_at, id) < (cursor) ORDER BY created_at
+# DESC, id DESC LIMIT n+1 on a (.., created_at, id) index, so page 1000 costs
+# the same as page 1 - unlike OFFSET, which reads and throws away every row
+# before the page. Cursors are opaque to clients: base64 of the boundary row's
+# created_at and id. One extra row is read to tell whether another page exists.
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+class CursorError(ValueError):
+    """The cursor was not issued by this server (or was mangled on the way)"""
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, row_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise CursorError('Invalid pagination cursor')
+
+
+def newest_first(query, model, per_page, after=None, before=None):
+    """One page of `query`, newest first.
+
+    `after` continues with the rows older than that cursor, `before` goes
+    back to the rows just newer than it. Returns the items and the cursors of
+    the neighbouring pages (None where there is none).
+    """
+    created_at, row_id = model.created_at, model.id
+    # A row-value comparison, not the equivalent OR: SQLite only turns the
+    # former into an index range when the boundary is a bound parameter
+    key = tuple_(created_at, row_id)
+    if before:
+        boundary = decode_cursor(before)
+        rows = query.filter(key > tuple_(*boundary)).order_by(created_at.asc(), row_id.asc()).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_newer, has_older = more, True
+    else:
+        if after:
+            boundary = decode_cursor(after)
+            query = query.filter(key < tuple_(*boundary))
+        rows = query.order_by(created_at.desc(), row_id.desc()).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = rows[:per_page]
+        has_newer, has_older = bool(after), more
+    return {
+        'items': items,
+        'next_cursor': encode_cursor(items[-1].created_at, items[-1].id) if items and has_older else None,
+        'prev_cursor': encode_cursor(items[0].created_at, items[0].id) if items and has_newer else None,
+    }
@@ -0,0 +1,99 @@
+# Occupancy-driven dynamic pricing
+#
+# Each lot's price_per_hour follows its occupancy through configured bands
+# (e.g. +20% above 80% full) applied to base_price_per_hour, the price the
+# admin set. Occupancy comes from the incrementally maintained
+# available_spots counter over the lot's bookable spots (spots under
+# maintenance or banned are left out, via the out_of_service_spots counter
+# kept next to it), so a pricing run is one read of the lots table and one
+# UPDATE of the lots whose band changed.
+#
+# The UPDATE only lands where price_per_hour still holds the value that was
+# read, so an admin editing a lot's price mid-run wins and that lot is picked
+# up again on the next run. base_price_per_hour is never written back from the
+# read; lots that predate it get it filled from their current price in SQL.
+#
+# A reservation keeps the hourly rate of the moment it was booked and is
+# billed at that rate, so a later surge never reaches a car already parked.
+# Lots with a tariff (peak, weekend, first-hour or daily-cap pricing) are
+# priced by the tariff alone and stay at their base price.
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from flask import current_app
+from sqlalchemy import case, tuple_, update
+from app.extensions import db
+from app.models.enums import ParkingLotStatus
+from app.models.parking import ParkingLot
+from app.services.background import PeriodicTask
+
+
+def occupancy(total_spots, available_spots, out_of_service=0):
+    """Share of the lot's bookable spots that is taken (reserved, occupied or held)"""
+    bookable = total_spots - out_of_service
+    if bookable <= 0:
+        return 0.0
+    return min(max((bookable - available_spots) / bookable, 0.0), 1.0)
+
+
+def multiplier_for(rate, bands=None):
+    """Price multiplier of the highest band whose threshold the occupancy reaches"""
+    bands = bands if bands is not None else current_app.config['DYNAMIC_PRICING_BANDS']
+    for threshold, multiplier in sorted(bands, reverse=True):
+        if rate >= threshold:
+            return Decimal(str(multiplier))
+    return Decimal('1')
+
+
+def reprice_lots(lot_ids=None):
+    """Move every lot's price to its occupancy band. Returns the changed lots."""
+    query = db.session.query(
+        ParkingLot.id, ParkingLot.total_spots, ParkingLot.available_spots, ParkingLot.out_of_service_spots,
+        ParkingLot.price_per_hour, ParkingLot.base_price_per_hour,
+        (ParkingLot.peak_price_per_hour.isnot(None) | ParkingLot.weekend_price_per_hour.isnot(None) |
+         ParkingLot.first_hour_price.isnot(None) | ParkingLot.daily_cap.isnot(None)).label('has_tariff')
+    ).filter(ParkingLot.is_deleted == False, ParkingLot.status == ParkingLotStatus.ACTIVE)
+    if lot_ids is not None:
+        query = query.filter(ParkingLot.id.in_(lot_ids))
+
+    bands = current_app.config['DYNAMIC_PRICING_BANDS']
+    now = datetime.utcnow()
+    changes = []
+    for lot_id, total, available, out_of_service, price, base, has_tariff in query:
+        base = base if base is not None else price
+        if has_tariff:
+            # The tariff sets the price; a surge would only scale its off-peak part
+            target = base
+        else:
+            rate = occupancy(total, available, out_of_service)
+            target = (base * multiplier_for(rate, bands)).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        if target != price:
+            changes.append({'id': lot_id, 'price_per_hour': target, 'base_price_per_hour': base, 'read_price': price})
+    if changes:
+        ids = [change['id'] for change in changes]
+        db.session.execute(
+            update(ParkingLot)
+            .where(ParkingLot.id.in_(ids), ParkingLot.base_price_per_hour.is_(None))
+            .values(base_price_per_hour=ParkingLot.price_per_hour)
+            .execution_options(synchronize_session=False)
+        )
+        # Lots whose price changed since the read keep the new price
+        repriced = set(db.session.scalars(
+            update(ParkingLot)
+            .where(tuple_(ParkingLot.id, ParkingLot.price_per_hour).in_(
+                [(change['id'], change['read_price']) for change in changes]
+            ))
+            .values(
+                price_per_hour=case({change['id']: change['price_per_hour'] for change in changes}, value=ParkingLot.id),
+                updated_at=now
+            )
+            .returning(ParkingLot.id)
+            .execution_options(synchronize_session=False)
+        ))
+        changes = [change for change in changes if change['id'] in repriced]
+    db.session.commit()
+    if changes:
+        print(f"Dynamic Pricing: Repriced {len(changes)} lot(s)")
+    return changes
+
+
+pricing_task = PeriodicTask('dynamic-pricing', 60, reprice_lots)
@@ -0,0 +1,301 @@
+# Per-lot hourly and daily rollups for the admin trend charts
+#
+# lot_rollups holds, for every lot and UTC hour (and day), the reservations that
+# started, completed or were cancelled in it, the revenue they brought in and
+# the peak number of reservations holding a spot at once. Scheduled bookings
+# that were cancelled or expired before they started never held a spot and
+# are left out. A bucket is always
+# rebuilt from the reservations overlapping it, so rebuilding is idempotent:
+# the periodic refresh rebuilds the lot-days touched by reservations changed
+# since its watermark, and backfill rebuilds history a few days at a time.
+# Charts read only this table, never the reservations.
+from datetime import datetime, time, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import Float, String, and_, delete, func, insert, or_, select, type_coerce
+from app.extensions import db
+from app.models.enums import ReservationStatus
+from app.models.parking import JobCheckpoint, LotRollup, ParkingSpot, Reservation
+from app.services.background import PeriodicTask
+
+CHECKPOINT = 'lot_rollups'
+FINISHED = (ReservationStatus.COMPLETED, ReservationStatus.CANCELLED)
+# Still holding their spot; they count as occupying it until now
+OPEN = (ReservationStatus.ACTIVE, ReservationStatus.PENDING_VACATE)
+HOUR = np.timedelta64(1, 'h')
+
+
+def _midnight(day):
+    return datetime.combine(day, time.min)
+
+
+def _query():
+    """Raw column values of reservations with their lot, as in billing.audit_reservations"""
+    return select(
+        ParkingSpot.parking_lot_id,
+        type_coerce(Reservation.start_time, String),
+        type_coerce(Reservation.end_time, String),
+        type_coerce(Reservation.status, String),
+        type_coerce(Reservation.total_cost, Float)
+    ).join(ParkingSpot, Reservation.parking_spot_id == ParkingSpot.id)
+
+
+def _overlapping(query, window_start, window_end):
+    """Stays that hold a spot at some point of the window"""
+    return query.where(
+        Reservation.start_time < window_end,
+        or_(
+            and_(Reservation.status.in_(FINISHED), Reservation.started == True, Reservation.end_time >= window_start),
+            Reservation.status.in_(OPEN)
+        )
+    )
+
+
+def _stays(rows, now):
+    """Column arrays of raw reservation rows; open stays end now"""
+    lots, starts, ends, statuses, costs = zip(*rows) if rows else ((),) * 5
+    stays = {
+        'lots': np.array(lots, dtype=np.int64),
+        'starts': np.array(starts, dtype='datetime64[us]'),
+        'ends': np.array(ends, dtype='datetime64[us]'),
+        'statuses': np.array(statuses, dtype='U16'),
+        'costs': np.nan_to_num(np.array(costs, dtype=np.float64)),
+    }
+    is_open = np.isin(stays['statuses'], [status.name for status in OPEN])
+    stays['ends'] = np.where(is_open, np.maximum(stays['starts'], np.datetime64(now, 'us')), stays['ends'])
+    return stays
+
+
+def _buckets(window_start, days, stays):
+    """Hourly counters of every lot in the window, as (lot_ids, {name: array[lots, hours]})"""
+    lot_ids, lot_index = np.unique(stays['lots'], return_inverse=True)
+    hours = days * 24
+    size = len(lot_ids) * hours
+    base = np.datetime64(window_start, 'us')
+    window_end = base + hours * HOUR
+    starts, ends, statuses = stays['starts'], stays['ends'], stays['statuses']
+
+    def histogram(times, mask, weights=None):
+        hour = ((times - base) // HOUR).astype(np.int64)
+        mask = mask & (hour >= 0) & (hour < hours)
+        flat = lot_index[mask] * hours + hour[mask]
+        return np.bincount(flat, None if weights is None else weights[mask], minlength=size).reshape(-1, hours)
+
+    completed = statuses == ReservationStatus.COMPLETED.name
+    cancelled = statuses == ReservationStatus.CANCELLED.name
+    counters = {
+        'started': histogram(starts, np.ones(len(starts), dtype=bool)),
+        'completed': histogram(ends, completed),
+        'cancelled': histogram(ends, cancelled),
+        'revenue': histogram(ends, completed | cancelled, stays['costs']),
+    }
+
+    # Peak occupancy: sweep +1/-1 events of every stay clipped to the window.
+    # Sorted by lot, each lot's events sum to zero, so one running sum gives
+    # every lot's level; a spot freed and retaken at the same instant counts once.
+    clipped_starts = np.maximum(starts, base)
+    clipped_ends = np.minimum(ends, window_end)
+    spans = clipped_ends > clipped_starts
+    times = np.concatenate((clipped_starts[spans], clipped_ends[spans]))
+    deltas = np.concatenate((np.ones(spans.sum(), np.int64), -np.ones(spans.sum(), np.int64)))
+    event_lots = np.concatenate((lot_index[spans], lot_index[spans]))
+    order = np.lexsort((deltas, times, event_lots))
+    times, deltas, event_lots = times[order], deltas[order], event_lots[order]
+    levels = np.cumsum(deltas)
+    hour = ((times - base) // HOUR).astype(np.int64)
+    inside = hour < hours
+    flat = event_lots[inside] * hours + hour[inside]
+
+    peak = np.zeros(size, np.int64)
+    np.maximum.at(peak, flat, levels[inside])
+    # Hours without events keep the level the previous hour ended with
+    closing = np.zeros(size, np.int64)
+    has_events = np.zeros(size, dtype=bool)
+    if len(flat):
+        last = np.append(flat[1:] != flat[:-1], True)
+        closing[flat[last]] = levels[inside][last]
+        has_events[flat] = True
+    closing, has_events = closing.reshape(-1, hours), has_events.reshape(-1, hours)
+    filled = np.maximum.accumulate(np.where(has_events, np.arange(hours), 0), axis=1)
+    carried = np.take_along_axis(closing, filled, axis=1)
+    opening = np.zeros_like(carried)
+    opening[:, 1:] = carried[:, :-1]
+    counters['peak_occupancy'] = np.maximum(peak.reshape(-1, hours), opening)
+    return lot_ids, counters
+
+
+def _write(window_start, days, stays, lot_ids=None):
+    """Replace the window's buckets (of the given lots, or all) with those of `stays`"""
+    cleared = delete(LotRollup).where(
+        LotRollup.bucket_start >= window_start, LotRollup.bucket_start < window_start + timedelta(days=days)
+    )
+    if lot_ids is not None:
+        cleared = cleared.where(LotRollup.parking_lot_id.in_(lot_ids))
+    db.session.execute(cleared)
+    if not len(stays['lots']):
+        return 0
+
+    found, counters = _buckets(window_start, days, stays)
+    daily = {
+        name: (values.reshape(len(found), days, 24).max(axis=2) if name == 'peak_occupancy'
+               else values.reshape(len(found), days, 24).sum(axis=2))
+        for name, values in counters.items()
+    }
+    records = []
+    for granularity, series, step in (('hour', counters, timedelta(hours=1)), ('day', daily, timedelta(days=1))):
+        active = np.argwhere(
+            (series['started'] > 0) | (series['completed'] > 0) | (series['cancelled'] > 0) |
+            (series['peak_occupancy'] > 0)
+        )
+        for lot, bucket in active:
+            records.append({
+                'parking_lot_id': int(found[lot]), 'granularity': granularity,
+                'bucket_start': window_start + step * int(bucket),
+                'started': int(series['started'][lot, bucket]),
+                'completed': int(series['completed'][lot, bucket]),
+                'cancelled': int(series['cancelled'][lot, bucket]),
+                'revenue': round(float(series['revenue'][lot, bucket]), 2),
+                'peak_occupancy': int(series['peak_occupancy'][lot, bucket]),
+            })
+    if records:
+        db.session.execute(insert(LotRollup), records)
+    return len(records)
+
+
+def rebuild(start_day, end_day, lot_ids=None, commit=True):
+    """Recompute the buckets of the days [start_day, end_day) from the reservations.
+
+    Only the given lots are rebuilt, or every lot when `lot_ids` is None.
+    Returns the number of rollup rows written.
+    """
+    window_start, window_end = _midnight(start_day), _midnight(end_day)
+    query = _overlapping(_query(), window_start, window_end)
+    if lot_ids is not None:
+        query = query.where(ParkingSpot.parking_lot_id.in_(lot_ids))
+    stays = _stays(db.session.execute(query).all(), datetime.utcnow())
+    rows = _write(window_start, (end_day - start_day).days, stays, lot_ids)
+    if commit:
+        db.session.commit()
+    return rows
+
+
+def backfill(start=None, end=None, chunk_days=7):
+    """Rebuild every bucket from `start` to `end` (dates), `chunk_days` per transaction.
+
+    Walks back from the newest window: each finished stay is read once, with
+    the window it ended in, and kept while it reaches into earlier windows, so
+    no window has to scan the history after it.
+    """
+    now = datetime.utcnow()
+    begun = now - timedelta(seconds=current_app.config['ROLLUP_LAG_SECONDS'])
+    if start is None:
+        first = db.session.query(func.min(Reservation.start_time)).scalar()
+        start = first.date() if first else now.date()
+    end = end or now.date() + timedelta(days=1)
+
+    # Stays still running at the end of the range
+    carry = _stays(db.session.execute(_overlapping(_query(), _midnight(end), _midnight(end))).all(), now)
+    rows = 0
+    day = end
+    while day > start:
+        chunk_start = max(day - timedelta(days=chunk_days), start)
+        window_start, window_end = _midnight(chunk_start), _midnight(day)
+        ended = _stays(db.session.execute(_query().where(
+            Reservation.status.in_(FINISHED), Reservation.started == True,
+            Reservation.end_time >= window_start, Reservation.end_time < window_end
+        )).all(), now)
+        keep = carry['starts'] < np.datetime64(window_end, 'us')
+        carry = {name: np.concatenate((values[keep], ended[name])) for name, values in carry.items()}
+        rows += _write(window_start, (day - chunk_start).days, carry)
+        db.session.commit()
+        day = chunk_start
+
+    # The refresh picks up whatever changed while the backfill ran
+    if JobCheckpoint.get_watermark(CHECKPOINT) is None:
+        JobCheckpoint.set_watermark(CHECKPOINT, begun)
+        db.session.commit()
+    print(f"Rollups: Backfilled {start} to {end} ({rows} bucket rows)")
+    return rows
+
+
+def refresh():
+    """Rebuild the lot-days touched by reservations changed since the last run"""
+    watermark = JobCheckpoint.get_watermark(CHECKPOINT)
+    if watermark is None:
+        # First run on this database
+        return backfill()
+    # Writers stamp updated_at before they commit; stay a little behind them
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['ROLLUP_LAG_SECONDS'])
+    if cutoff <= watermark:
+        return 0
+    now = datetime.utcnow()
+
+    touched = {}
+    changed = db.session.query(
+        ParkingSpot.parking_lot_id, Reservation.start_time, Reservation.end_time, Reservation.status,
+        Reservation.started
+    ).join(ParkingSpot, Reservation.parking_spot_id == ParkingSpot.id).filter(
+        Reservation.updated_at > watermark, Reservation.updated_at <= cutoff
+    )
+    for lot_id, start_time, end_time, status, started in changed:
+        if status == ReservationStatus.SCHEDULED or not started:
+            continue
+        last = now if status in OPEN else max(start_time, end_time)
+        day = start_time.date()
+        while day <= last.date():
+            touched.setdefault(day, set()).add(lot_id)
+            day += timedelta(days=1)
+
+    # Open stays keep occupying new hours without any row changing
+    if cutoff.replace(minute=0, second=0, microsecond=0) > watermark:
+        open_lots = {lot_id for lot_id, in db.session.query(ParkingSpot.parking_lot_id).join(
+            Reservation, Reservation.parking_spot_id == ParkingSpot.id
+        ).filter(Reservation.status.in_(OPEN)).distinct()}
+        for day in {watermark.date(), cutoff.date()}:
+            touched.setdefault(day, set()).update(open_lots)
+
+    rows = 0
+    for day, lot_ids in sorted(touched.items()):
+        if lot_ids:
+            rows += rebuild(day, day + timedelta(days=1), sorted(lot_ids), commit=False)
+    JobCheckpoint.set_watermark(CHECKPOINT, cutoff)
+    db.session.commit()
+    if touched:
+        print(f"Rollups: Rebuilt {sum(len(lots) for lots in touched.values())} lot-day(s), {rows} bucket rows")
+    return rows
+
+
+def trend(days=90, lot_id=None, granularity='day'):
+    """Dense series for the charts, one point per bucket, read from the rollups only.
+
+    Across several lots peak_occupancy adds up each lot's own peak.
+    """
+    step = timedelta(days=1) if granularity == 'day' else timedelta(hours=1)
+    now = datetime.utcnow()
+    last = _midnight(now.date()) if granularity == 'day' else now.replace(minute=0, second=0, microsecond=0)
+    first = last - step * (days - 1 if granularity == 'day' else days * 24 - 1)
+
+    query = db.session.query(
+        LotRollup.bucket_start,
+        func.sum(LotRollup.started), func.sum(LotRollup.completed), func.sum(LotRollup.cancelled),
+        func.sum(LotRollup.revenue), func.sum(LotRollup.peak_occupancy)
+    ).filter(LotRollup.granularity == granularity, LotRollup.bucket_start >= first)
+    if lot_id is not None:
+        query = query.filter(LotRollup.parking_lot_id == lot_id)
+    found = {row[0]: row[1:] for row in query.group_by(LotRollup.bucket_start)}
+
+    series = {'labels': [], 'started': [], 'completed': [], 'cancelled': [], 'revenue': [], 'peak_occupancy': []}
+    bucket = first
+    while bucket <= last:
+        started, completed, cancelled, revenue, peak = found.get(bucket, (0, 0, 0, 0, 0))
+        series['labels'].append(bucket.isoformat())
+        series['started'].append(int(started))
+        series['completed'].append(int(completed))
+        series['cancelled'].append(int(cancelled))
+        series['revenue'].append(float(revenue or 0))
+        series['peak_occupancy'].append(int(peak))
+        bucket += step
+    return series
+
+
+rollup_refresher = PeriodicTask('lot-rollups', 60, refresh)
@@ -0,0 +1,167 @@
+# Advance reservations - future time-slot bookings with indexed overlap checks
+#
+# Scheduled bookings are Reservation rows with status SCHEDULED and a real
+# end_time, which they keep once activated. Booking length is capped, so any
+# booking that overlaps a window [start, end) must itself start inside
+# (start - max length, end). That keeps every overlap check a short range scan
+# on (parking_spot_id, status, start_time) no matter how many future bookings a
+# spot has.
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import exists, insert, literal, select
+from app.extensions import db
+from app.models.enums import ParkingLotStatus, SpotStatus, ReservationStatus
+from app.models.parking import ParkingLot, ParkingSpot, Reservation
+from app.services.allocation import AllocationError, NotFoundError, SpotTakenError, LotFullError, claim_spot, claim_any_spot
+from app.services.background import PeriodicTask
+from app.services.free_spots import free_spot_index
+from app.services.stats import record_reservations_created
+
+# Bookings that hold their spot for [start_time, end_time). An activated booking
+# keeps its scheduled end_time; a walk-in's end_time equals its start until it
+# is vacated, so it never overlaps a future window (activation moves it instead).
+BOOKED_STATUSES = [ReservationStatus.SCHEDULED, ReservationStatus.ACTIVE]
+
+# Spots in these states cannot be booked ahead
+BLOCKED_SPOT_STATUSES = [SpotStatus.UNDER_MAINTENANCE, SpotStatus.BANNED]
+
+
+def _max_length():
+    return timedelta(hours=current_app.config['ADVANCE_BOOKING_MAX_HOURS'])
+
+
+def overlapping(spot_id_column, start, end):
+    """SQL condition: a scheduled or activated booking on the given spot overlaps [start, end)"""
+    return exists().where(
+        Reservation.parking_spot_id == spot_id_column,
+        Reservation.status.in_(BOOKED_STATUSES),
+        Reservation.start_time > start - _max_length(),
+        Reservation.start_time < end,
+        Reservation.end_time > start
+    )
+
+
+def validate_window(start, end, now=None):
+    """Raise AllocationError unless [start, end) is a bookable future window"""
+    now = now or datetime.utcnow()
+    if end <= start:
+        raise AllocationError('End time must be after start time')
+    if start < now:
+        raise AllocationError('Start time must be in the future')
+    if end - start > _max_length():
+        raise AllocationError(f"Bookings cannot be longer than {current_app.config['ADVANCE_BOOKING_MAX_HOURS']} hours")
+    if start > now + timedelta(days=current_app.config['ADVANCE_BOOKING_MAX_DAYS']):
+        raise AllocationError(f"Bookings can be made at most {current_app.config['ADVANCE_BOOKING_MAX_DAYS']} days ahead")
+
+
+def free_spots_for_window(lot_id, start, end, limit=None):
+    """Ids of the lot's spots that have no scheduled booking overlapping [start, end)"""
+    query = select(ParkingSpot.id).where(
+        ParkingSpot.parking_lot_id == lot_id,
+        ParkingSpot.is_deleted == False,
+        ParkingSpot.status.not_in(BLOCKED_SPOT_STATUSES),
+        ~overlapping(ParkingSpot.id, start, end)
+    ).order_by(ParkingSpot.id)
+    if limit:
+        query = query.limit(limit)
+    return list(db.session.execute(query).scalars())
+
+
+def schedule_reservation(user_id, vehicle_number, start, end, spot_id=None, lot_id=None):
+    """Book a spot (or any spot of a lot) for a future window.
+
+    The booking is inserted with INSERT ... SELECT ... WHERE NOT EXISTS, so
+    two requests racing for the same window cannot both succeed.
+    """
+    if not vehicle_number:
+        raise AllocationError('Vehicle number is required')
+    validate_window(start, end)
+
+    if spot_id is not None:
+        spot = db.session.get(ParkingSpot, spot_id)
+        if spot is None or spot.is_deleted:
+            raise NotFoundError('Spot not found')
+        if spot.status in BLOCKED_SPOT_STATUSES:
+            raise AllocationError(f'Spot is {spot.status.value}')
+        lot = spot.parking_lot
+        candidates = [spot_id]
+    else:
+        lot = db.session.get(ParkingLot, lot_id)
+        if lot is None or lot.is_deleted:
+            raise NotFoundError('Lot not found')
+        candidates = free_spots_for_window(lot.id, start, end, limit=5)
+    if lot.status != ParkingLotStatus.ACTIVE:
+        raise AllocationError(f'Lot is {lot.status.value}')
+
+    now = datetime.utcnow()
+    for candidate in candidates:
+        values = select(
+            literal(user_id), literal(candidate), literal(start), literal(end),
+            literal(vehicle_number), literal(0), literal(lot.price_per_hour), literal(ReservationStatus.SCHEDULED.name),
+            literal(False),
+            literal(now), literal(now), literal(False), literal(1)
+        ).where(~overlapping(literal(candidate), start, end))
+        result = db.session.execute(
+            insert(Reservation).from_select(
+                ['user_id', 'parking_spot_id', 'start_time', 'end_time', 'vehicle_number',
+                 'total_cost', 'hourly_rate', 'status', 'started', 'created_at', 'updated_at', 'is_deleted', 'version'],
+                values
+            ).returning(Reservation.id)
+        ).scalar()
+        if result is not None:
+            record_reservations_created(1, now)
+            db.session.commit()
+            return db.session.get(Reservation, result)
+    db.session.rollback()
+    if spot_id is not None:
+        raise SpotTakenError('Spot is already booked for part of this window')
+    raise LotFullError('No spot in this lot is free for the whole window')
+
+
+def activate_due_reservations(now=None):
+    """Turn scheduled bookings whose start time has come into active ones.
+
+    Each booking claims its spot like a walk-in. If a walk-in is still parked
+    there, it is moved to another free spot of the same lot; bookings that
+    cannot be placed stay scheduled and are retried on the next run, and
+    expire as no-shows (EXPIRED) once their window has passed.
+    """
+    now = now or datetime.utcnow()
+    due = Reservation.query.filter(
+        Reservation.status == ReservationStatus.SCHEDULED,
+        Reservation.start_time <= now
+    ).order_by(Reservation.start_time).all()
+    activated, moved, waiting, expired = 0, 0, 0, 0
+    for reservation in due:
+        spot = reservation.parking_spot
+        lot_id = spot.parking_lot_id
+        if reservation.end_time <= now:
+            # Window passed without the booking ever being placed
+            reservation.status = ReservationStatus.EXPIRED
+            db.session.commit()
+            expired += 1
+            continue
+        # Other bookings during this one's window keep their spots
+        if claim_spot(spot.id, reservation.end_time, reservation.id):
+            spot_id = spot.id
+        else:
+            spot_id = claim_any_spot(lot_id, until=reservation.end_time, booking_id=reservation.id)
+        if spot_id is None:
+            db.session.rollback()
+            waiting += 1
+            continue
+        if spot_id != reservation.parking_spot_id:
+            reservation.parking_spot_id = spot_id
+            moved += 1
+        free_spot_index.mark_taken(lot_id, spot_id)
+        ParkingLot.adjust_available_spots(lot_id, -1)
+        reservation.status = ReservationStatus.ACTIVE
+        reservation.started = True
+        db.session.commit()
+        activated += 1
+    if due:
+        print(f"Scheduled Reservations: activated {activated} (moved {moved}), {waiting} waiting, {expired} expired")
+    return {'activated': activated, 'moved': moved, 'waiting': waiting, 'expired': expired}
+
+
+activation_task = PeriodicTask('reservation-activator', 60, activate_due_reservations)
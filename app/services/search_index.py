@@ -0,0 +1,120 @@
+# Full-text search over parking lots (SQLite FTS5)
+#
+# lot_search is an FTS5 table with one row per lot (rowid = lot id) holding
+# its name, address, city and state names. A search term becomes a MATCH of
+# every word as a prefix ("mg ro" finds "MG Road"), served by the FTS index
+# with a prefix index for two and three letter starts, instead of a LIKE
+# scan that could not see city or state names at all. Results rank by bm25
+# with the name weighted above the address and the address above the place
+# names.
+#
+# ORM writes keep it current inside the writing transaction: a lot's row is
+# rewritten when its name, address or city changes, and renaming or moving a
+# city or renaming a state rewrites its lots' rows. Bulk INSERTs of lots
+# bypass mapper events; build() at startup and the rebuild-search-index
+# command recompute the whole table.
+import re
+from sqlalchemy import DDL, column, delete, event, func, inspect, insert, literal_column, select, table
+from app.extensions import db
+from app.models.geography import City, State
+from app.models.parking import ParkingLot
+
+lot_search = table('lot_search', column('rowid'), column('name'), column('address'), column('city'), column('state'))
+
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lot_search USING fts5("
+    "name, address, city, state, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+).execute_if(dialect='sqlite'))
+
+# bm25 column weights, in table column order
+WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+
+# Columns a location filter looks in
+PLACE_COLUMNS = '{address city state}'
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _rows(*conditions):
+    return select(ParkingLot.id, ParkingLot.name, ParkingLot.address, City.name, State.name).join(
+        City, City.id == ParkingLot.city_id
+    ).join(State, State.id == City.state_id).where(*conditions)
+
+
+def _reindex(connection, *conditions):
+    """Rewrite the rows of the lots matching `conditions`"""
+    lot_ids = select(ParkingLot.id).join(City, City.id == ParkingLot.city_id).where(*conditions)
+    connection.execute(delete(lot_search).where(lot_search.c.rowid.in_(lot_ids)))
+    connection.execute(insert(lot_search).from_select(list(lot_search.c.keys()), _rows(*conditions)))
+
+
+def _changed(target, *names):
+    attrs = inspect(target).attrs
+    return any(attrs[name].history.has_changes() for name in names)
+
+
+@event.listens_for(ParkingLot, 'after_insert')
+def _lot_inserted(mapper, connection, target):
+    connection.execute(insert(lot_search).from_select(list(lot_search.c.keys()), _rows(ParkingLot.id == target.id)))
+
+
+@event.listens_for(ParkingLot, 'after_update')
+def _lot_updated(mapper, connection, target):
+    if _changed(target, 'name', 'address', 'city_id'):
+        _reindex(connection, ParkingLot.id == target.id)
+
+
+@event.listens_for(ParkingLot, 'after_delete')
+def _lot_deleted(mapper, connection, target):
+    connection.execute(delete(lot_search).where(lot_search.c.rowid == target.id))
+
+
+@event.listens_for(City, 'after_update')
+def _city_updated(mapper, connection, target):
+    if _changed(target, 'name', 'state_id'):
+        _reindex(connection, ParkingLot.city_id == target.id)
+
+
+@event.listens_for(State, 'after_update')
+def _state_updated(mapper, connection, target):
+    if _changed(target, 'name'):
+        _reindex(connection, City.state_id == target.id)
+
+
+def _prefix_query(term):
+    """Every word of `term` as a quoted prefix, or None when it has no words"""
+    words = WORD.findall(term or '')
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def matching(search=None, location=None):
+    """(lot_id, rank) of the lots matching `search` anywhere and `location` in their
+    address, city or state; None when neither has a word to look for. Lower ranks are better."""
+    search, location = _prefix_query(search), _prefix_query(location)
+    if not search and not location:
+        return None
+    parts = []
+    if search:
+        parts.append(f'({search})')
+    if location:
+        parts.append(f'{PLACE_COLUMNS} : ({location})')
+    return select(
+        lot_search.c.rowid.label('lot_id'),
+        func.bm25(literal_column('lot_search'), *WEIGHTS).label('rank')
+    ).where(literal_column('lot_search').op('MATCH')(' AND '.join(parts))).subquery()
+
+
+def rebuild():
+    """Recompute every lot's row; returns the number of lots indexed"""
+    db.session.execute(delete(lot_search))
+    db.session.execute(insert(lot_search).from_select(list(lot_search.c.keys()), _rows()))
+    db.session.commit()
+    return db.session.query(func.count()).select_from(lot_search).scalar()
+
+
+def build(app):
+    """Fill the index at startup when it does not hold every lot (bulk loads, older databases)"""
+    with app.app_context():
+        indexed = db.session.query(func.count()).select_from(lot_search).scalar()
+        if indexed != db.session.query(func.count(ParkingLot.id)).scalar():
+            print(f"Search Index: Rebuilt with {rebuild()} lots")
@@ -0,0 +1,249 @@
+# Materialized admin dashboard statistics
+#
+# Every count and revenue figure on the admin dashboard lives in the
+# dashboard_stats table and is shifted by the write that changes it, inside
+# the same transaction. ORM writes are picked up by mapper events; the
+# set-based UPDATEs and bulk INSERTs of the allocation, hold, scheduling and
+# checkout services call the `record_*` helpers themselves. Rendering the dashboard is a
+# single SELECT. A periodic reconcile recomputes everything from the source
+# tables to correct any drift (e.g. rows written outside the app).
+from datetime import datetime, timedelta
+from sqlalchemy import case, event, exists, func, insert, inspect, literal, select, update
+from app.extensions import db
+from app.models.enums import ReservationStatus, SpotStatus
+from app.models.geography import Continent, Country, State, City
+from app.models.parking import DashboardStat, ParkingLot, ParkingSpot, Reservation
+from app.models.user import User
+from app.services.background import PeriodicTask
+
+FINISHED = (ReservationStatus.COMPLETED, ReservationStatus.CANCELLED)
+
+# Plain row counts kept per model
+MODEL_KEYS = {
+    Continent: 'continents',
+    Country: 'countries',
+    State: 'states',
+    City: 'cities',
+    ParkingLot: 'parking_lots',
+}
+
+GLOBAL_KEYS = (
+    ['continents', 'countries', 'states', 'cities', 'users', 'parking_lots', 'spots_total',
+     'reservations', 'revenue'] +
+    [f'spots_{status.name.lower()}' for status in SpotStatus]
+)
+
+
+def day_keys(day):
+    """Keys of the per-day buckets (UTC dates)"""
+    return f'reservations_day:{day.isoformat()}', f'revenue_day:{day.isoformat()}'
+
+
+def _spot_key(status):
+    if not isinstance(status, SpotStatus):
+        status = SpotStatus(status) if status in SpotStatus._value2member_map_ else SpotStatus[status]
+    return f'spots_{status.name.lower()}'
+
+
+def _apply(connection, deltas):
+    """Shift several counters with one UPDATE; day buckets are created on first use"""
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not deltas:
+        return
+    table = DashboardStat.__table__
+    for key in deltas:
+        if ':' in key:
+            connection.execute(insert(table).from_select(
+                ['key', 'value', 'updated_at'],
+                select(literal(key), literal(0), literal(datetime.utcnow())).where(~exists().where(table.c.key == key))
+            ))
+    connection.execute(
+        update(table)
+        .where(table.c.key.in_(list(deltas)))
+        .values(value=table.c.value + case(deltas, value=table.c.key), updated_at=datetime.utcnow())
+    )
+
+
+def record_spot_transition(old_status, new_status, count=1, connection=None):
+    """Move `count` spots from one status counter to another"""
+    if not count or old_status == new_status:
+        return
+    deltas = {_spot_key(old_status): -count, _spot_key(new_status): count}
+    _apply(connection or db.session.connection(), deltas)
+
+
+def record_spots_removed(status_counts, connection=None):
+    """Take hard-deleted spots, given as {status: count}, out of the counters"""
+    deltas = {'spots_total': -sum(status_counts.values())}
+    for status, count in status_counts.items():
+        deltas[_spot_key(status)] = -count
+    _apply(connection or db.session.connection(), deltas)
+
+
+def record_reservations_created(count, created_at=None, connection=None):
+    key = day_keys((created_at or datetime.utcnow()).date())[0]
+    _apply(connection or db.session.connection(), {'reservations': count, key: count})
+
+
+def record_revenue(amount, ended_at=None, connection=None):
+    key = day_keys((ended_at or datetime.utcnow()).date())[1]
+    _apply(connection or db.session.connection(), {'revenue': amount, key: amount})
+
+
+# --- ORM write hooks -------------------------------------------------------
+
+def _count_model(key, delta):
+    def listener(mapper, connection, target):
+        _apply(connection, {key: delta})
+    return listener
+
+
+for _model, _key in MODEL_KEYS.items():
+    event.listen(_model, 'after_insert', _count_model(_key, 1))
+    event.listen(_model, 'after_delete', _count_model(_key, -1))
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, target):
+    if target.username != 'admin':
+        _apply(connection, {'users': 1})
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    if target.username != 'admin':
+        _apply(connection, {'users': -1})
+
+
+@event.listens_for(ParkingSpot, 'after_insert')
+def _spot_inserted(mapper, connection, target):
+    if not target.is_deleted:
+        _apply(connection, {'spots_total': 1, _spot_key(target.status): 1})
+
+
+@event.listens_for(ParkingSpot, 'after_update')
+def _spot_updated(mapper, connection, target):
+    attrs = inspect(target).attrs
+    status, deleted = attrs.status.history, attrs.is_deleted.history
+    old_status = status.deleted[0] if status.deleted else target.status
+    was_deleted = deleted.deleted[0] if deleted.deleted else target.is_deleted
+    deltas = {}
+    if not was_deleted:
+        deltas['spots_total'] = -1
+        deltas[_spot_key(old_status)] = -1
+    if not target.is_deleted:
+        deltas['spots_total'] = deltas.get('spots_total', 0) + 1
+        key = _spot_key(target.status)
+        deltas[key] = deltas.get(key, 0) + 1
+    _apply(connection, deltas)
+
+
+@event.listens_for(ParkingSpot, 'after_delete')
+def _spot_deleted(mapper, connection, target):
+    if not target.is_deleted:
+        _apply(connection, {'spots_total': -1, _spot_key(target.status): -1})
+
+
+@event.listens_for(Reservation, 'after_insert')
+def _reservation_inserted(mapper, connection, target):
+    record_reservations_created(1, target.created_at, connection)
+    if target.status in FINISHED and target.total_cost:
+        record_revenue(target.total_cost, target.end_time, connection)
+
+
+@event.listens_for(Reservation, 'after_update')
+def _reservation_updated(mapper, connection, target):
+    status = inspect(target).attrs.status.history
+    was_finished = status.deleted[0] in FINISHED if status.deleted else target.status in FINISHED
+    if target.status in FINISHED and not was_finished and target.total_cost:
+        record_revenue(target.total_cost, target.end_time, connection)
+
+
+@event.listens_for(Reservation, 'after_delete')
+def _reservation_deleted(mapper, connection, target):
+    _apply(connection, {'reservations': -1})
+
+
+# --- Reading and reconciling -----------------------------------------------
+
+def snapshot():
+    """All dashboard statistics in one read"""
+    today_reservations, today_revenue = day_keys(datetime.utcnow().date())
+    rows = dict(db.session.query(DashboardStat.key, DashboardStat.value).filter(
+        DashboardStat.key.in_(GLOBAL_KEYS + [today_reservations, today_revenue])
+    ).all())
+    if 'spots_total' not in rows:
+        # First run on this database
+        reconcile()
+        return snapshot()
+    value = lambda key: rows.get(key) or 0
+    total_spots = int(value('spots_total'))
+    occupancy_count = int(value('spots_occupied')) + int(value('spots_reserved'))
+    return {
+        'total_continents': int(value('continents')),
+        'total_countries': int(value('countries')),
+        'total_states': int(value('states')),
+        'total_cities': int(value('cities')),
+        'total_users': int(value('users')),
+        'total_parking_lots': int(value('parking_lots')),
+        'total_parking_spots': total_spots,
+        'total_reservations': int(value('reservations')),
+        'occupied_spots': int(value('spots_occupied')),
+        'available_spots': int(value('spots_available')),
+        'reserved_spots': int(value('spots_reserved')),
+        'today_reservations': int(value(today_reservations)),
+        'today_revenue': float(value(today_revenue)),
+        'total_revenue': float(value('revenue')),
+        'occupancy_rate': round((occupancy_count / total_spots * 100), 2) if total_spots > 0 else 0
+    }
+
+
+def compute():
+    """Recompute every counter from the source tables (the slow path)"""
+    today = datetime.utcnow().date()
+    today_start = datetime.combine(today, datetime.min.time())
+    values = {key: 0 for key in GLOBAL_KEYS}
+    for model, key in MODEL_KEYS.items():
+        values[key] = db.session.query(func.count()).select_from(model).scalar()
+    values['users'] = User.query.filter(User.username != 'admin').count()
+    for status, count in db.session.query(ParkingSpot.status, func.count(ParkingSpot.id)).filter(
+        ParkingSpot.is_deleted == False
+    ).group_by(ParkingSpot.status):
+        values[_spot_key(status)] = count
+        values['spots_total'] += count
+    values['reservations'] = db.session.query(func.count(Reservation.id)).scalar()
+    values['revenue'] = db.session.query(func.coalesce(func.sum(Reservation.total_cost), 0)).filter(
+        Reservation.status.in_(FINISHED)
+    ).scalar()
+    reservations_key, revenue_key = day_keys(today)
+    values[reservations_key] = Reservation.query.filter(Reservation.created_at >= today_start).count()
+    values[revenue_key] = db.session.query(func.coalesce(func.sum(Reservation.total_cost), 0)).filter(
+        Reservation.status.in_(FINISHED), Reservation.end_time >= today_start
+    ).scalar()
+    return values
+
+
+def reconcile(keep_days=2):
+    """Overwrite the counters with freshly computed values. Returns the keys that drifted."""
+    values = compute()
+    current = dict(db.session.query(DashboardStat.key, DashboardStat.value).all())
+    now = datetime.utcnow()
+    drifted = [key for key, value in values.items() if key not in current or current[key] != value]
+    updates = [{'key': key, 'value': values[key], 'updated_at': now} for key in drifted if key in current]
+    inserts = [{'key': key, 'value': values[key], 'updated_at': now} for key in drifted if key not in current]
+    if updates:
+        db.session.execute(update(DashboardStat), updates)
+    if inserts:
+        db.session.execute(insert(DashboardStat), inserts)
+    # Old day buckets are no longer shown
+    oldest = (now.date() - timedelta(days=keep_days)).isoformat()
+    stale = [key for key in current if ':' in key and key.split(':', 1)[1] < oldest]
+    if stale:
+        db.session.query(DashboardStat).filter(DashboardStat.key.in_(stale)).delete(synchronize_session=False)
+    db.session.commit()
+    if current and drifted:
+        print(f"Dashboard Stats: Reconciled {len(drifted)} drifted counter(s): {', '.join(sorted(drifted))}")
+    return drifted
+
+
+stats_reconciler = PeriodicTask('stats-reconciler', 300, reconcile)
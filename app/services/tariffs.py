@@ -0,0 +1,147 @@
+# Tariff engine - time-of-day, weekend, first-hour and daily-cap pricing
+#
+# A lot's tariff is compiled once into a table with the hourly rate of every
+# minute of the week and its cumulative sum. Pricing any interval is then two
+# lookups and a subtraction, whatever its length. Compiled tariffs are cached
+# per lot and keyed by the lot's pricing columns, so a changed price is never
+# served from a stale table.
+import threading
+import numpy as np
+from flask import current_app
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# 1970-01-01 (minute 0 of the epoch) was a Thursday; tables start on Monday
+EPOCH_WEEKDAY = 3
+
+
+class TariffError(ValueError):
+    """The lot's tariff settings are invalid"""
+
+
+def parse_peak_hours(text):
+    """Parse "8-10,17-20" into [(8, 10), (17, 20)] (weekday hours, local time)"""
+    windows = []
+    for part in (text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            start, end = (int(h) for h in part.split('-'))
+        except ValueError:
+            raise TariffError(f"Invalid peak window '{part}', expected e.g. 8-10")
+        if not 0 <= start < end <= 24:
+            raise TariffError(f"Invalid peak window '{part}', hours must be within 0-24")
+        windows.append((start, end))
+    return windows
+
+
+def pricing_key(lot):
+    """Everything a compiled tariff depends on"""
+    return (
+        lot.price_per_hour, lot.peak_price_per_hour, lot.peak_hours,
+        lot.weekend_price_per_hour, lot.first_hour_price, lot.daily_cap
+    )
+
+
+class CompiledTariff:
+    """Per-minute rate table of one lot with O(1) interval pricing"""
+
+    def __init__(self, base_rate, peak_rate=None, peak_hours=None, weekend_rate=None,
+                 first_hour_rate=None, daily_cap=None, utc_offset_minutes=0):
+        rates = np.full(MINUTES_PER_WEEK, float(base_rate))
+        if peak_rate is not None:
+            for day in range(5):
+                for start, end in parse_peak_hours(peak_hours):
+                    offset = day * MINUTES_PER_DAY
+                    rates[offset + start * 60:offset + end * 60] = float(peak_rate)
+        if weekend_rate is not None:
+            rates[5 * MINUTES_PER_DAY:] = float(weekend_rate)
+        # cumulative[m] = sum of the hourly rates of minutes [0, m) of the week
+        self.cumulative = np.concatenate(([0.0], np.cumsum(rates)))
+        self.week_total = self.cumulative[-1]
+        self.first_hour_rate = None if first_hour_rate is None else float(first_hour_rate)
+        self.daily_cap = None if daily_cap is None else float(daily_cap)
+        self.utc_offset_minutes = utc_offset_minutes
+
+    def _minutes(self, times):
+        """Local minutes since the first Monday of the epoch"""
+        minutes = np.asarray(times, dtype='datetime64[m]').astype(np.int64)
+        return minutes + self.utc_offset_minutes + EPOCH_WEEKDAY * MINUTES_PER_DAY
+
+    def _integral(self, minutes):
+        """Rate-minutes from the epoch Monday up to each minute"""
+        weeks, minute_of_week = np.divmod(minutes, MINUTES_PER_WEEK)
+        return weeks * self.week_total + self.cumulative[minute_of_week]
+
+    def cost_many(self, start_times, end_times, minimum_hours=0):
+        """Vectorized cost of stays, billed per started hour like the flat rate"""
+        start_times = np.asarray(start_times, dtype='datetime64[us]')
+        end_times = np.asarray(end_times, dtype='datetime64[us]')
+        seconds = (end_times - start_times) / np.timedelta64(1, 's')
+        hours = np.maximum(np.ceil(np.clip(seconds, 0, None) / 3600), minimum_hours).astype(np.int64)
+        start = self._minutes(start_times)
+        end = start + hours * 60
+
+        # The first hour may have its own flat price
+        if self.first_hour_rate is None:
+            first, rest_start = np.zeros(len(start)), start
+        else:
+            rest_start = np.minimum(start + 60, end)
+            first = (rest_start - start) * self.first_hour_rate
+
+        if self.daily_cap is None:
+            total = first + self._integral(end) - self._integral(rest_start)
+        else:
+            # Cap every 24h block of the stay separately
+            cap = self.daily_cap * 60
+            total = np.zeros(len(start))
+            blocks = int(np.max(np.ceil(hours / 24))) if len(start) else 0
+            for block in range(blocks):
+                block_start = start + block * MINUTES_PER_DAY
+                block_end = np.minimum(end, block_start + MINUTES_PER_DAY)
+                from_minute = np.minimum(np.maximum(block_start, rest_start), block_end)
+                cost = self._integral(block_end) - self._integral(from_minute)
+                if block == 0:
+                    cost = cost + first
+                # Shorter stays have no minutes in the later blocks
+                total += np.where(block_start < end, np.minimum(cost, cap), 0)
+        return np.round(total / 60, 2)
+
+    def cost(self, start_time, end_time, minimum_hours=0):
+        """Cost of one stay"""
+        return float(self.cost_many([start_time], [end_time], minimum_hours)[0])
+
+
+class TariffCache:
+    """Compiled tariffs per lot, recompiled when the lot's pricing changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tariffs = {}
+
+    def get(self, lot):
+        key = pricing_key(lot)
+        with self._lock:
+            cached = self._tariffs.get(lot.id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        tariff = CompiledTariff(
+            lot.price_per_hour,
+            peak_rate=lot.peak_price_per_hour,
+            peak_hours=lot.peak_hours,
+            weekend_rate=lot.weekend_price_per_hour,
+            first_hour_rate=lot.first_hour_price,
+            daily_cap=lot.daily_cap,
+            utc_offset_minutes=current_app.config['TARIFF_UTC_OFFSET_MINUTES']
+        )
+        with self._lock:
+            self._tariffs[lot.id] = (key, tariff)
+        return tariff
+
+    def invalidate(self, lot_id):
+        with self._lock:
+            self._tariffs.pop(lot_id, None)
+
+
+tariff_cache = TariffCache()
@@ -0,0 +1,221 @@
+# Per-lot FIFO waitlist for full parking lots
+#
+# Waiters are stored in the waitlist_entries table. Whenever a spot is freed
+# (vacate, cancel, expired hold, admin change) the free spot index signals the
+# promoter thread, which hands the spot to the oldest waiter as a hold and
+# notifies them. Nothing here runs on the request thread.
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+from app.extensions import db
+from app.models.enums import ParkingLotStatus, WaitlistStatus
+from app.models.parking import ParkingLot, WaitlistEntry
+from app.services.allocation import AllocationError, NotFoundError
+from app.services.free_spots import free_spot_index
+from app.services.holds import hold_any_spot, release_hold
+
+
+class LocalNotificationSink:
+    """Stand-in notification channel that keeps recent messages in memory"""
+
+    def __init__(self, maxlen=1000):
+        self.messages = deque(maxlen=maxlen)
+
+    def send(self, user_id, message, **data):
+        self.messages.append({'user_id': user_id, 'message': message, 'sent_at': datetime.utcnow(), **data})
+        print(f"Notify: User {user_id}: {message}")
+
+
+def join_waitlist(lot_id, user_id, vehicle_number):
+    """Queue the user for the lot. Returns (entry, position)."""
+    if not vehicle_number:
+        raise AllocationError('Vehicle number is required')
+    lot = db.session.get(ParkingLot, lot_id)
+    if lot is None or lot.is_deleted:
+        raise NotFoundError('Lot not found')
+    if lot.status != ParkingLotStatus.ACTIVE:
+        raise AllocationError(f'Lot is {lot.status.value}')
+
+    entry = WaitlistEntry.query.filter_by(
+        parking_lot_id=lot_id, user_id=user_id, status=WaitlistStatus.WAITING
+    ).first()
+    if entry is None:
+        entry = WaitlistEntry(parking_lot_id=lot_id, user_id=user_id, vehicle_number=vehicle_number)
+        db.session.add(entry)
+        db.session.commit()
+    # A spot may already be free (e.g. freed by another worker), let the promoter check
+    promoter.signal(lot_id)
+    return entry, queue_position(entry)
+
+
+def leave_waitlist(lot_id, user_id):
+    """Drop the user's waiting entry. Returns True if there was one."""
+    updated = WaitlistEntry.query.filter_by(
+        parking_lot_id=lot_id, user_id=user_id, status=WaitlistStatus.WAITING
+    ).update({'status': WaitlistStatus.CANCELLED, 'updated_at': datetime.utcnow()})
+    db.session.commit()
+    return updated > 0
+
+
+def queue_position(entry):
+    """1-based place in the lot's queue, or None once the entry left the queue"""
+    if entry.status != WaitlistStatus.WAITING:
+        return None
+    return WaitlistEntry.query.filter(
+        WaitlistEntry.parking_lot_id == entry.parking_lot_id,
+        WaitlistEntry.status == WaitlistStatus.WAITING,
+        WaitlistEntry.id <= entry.id
+    ).count()
+
+
+def promote_next(lot_id):
+    """Give one free spot of the lot to its oldest waiter. Returns the entry or None."""
+    while True:
+        entry = WaitlistEntry.query.filter_by(
+            parking_lot_id=lot_id, status=WaitlistStatus.WAITING
+        ).order_by(WaitlistEntry.id).first()
+        if entry is None:
+            return None
+        held = hold_any_spot(lot_id, entry.user_id, current_app.config['WAITLIST_HOLD_TTL_SECONDS'])
+        if held is None:
+            return None
+        spot_id, held_until = held
+        now = datetime.utcnow()
+        updated = WaitlistEntry.query.filter_by(id=entry.id, status=WaitlistStatus.WAITING).update({
+            'status': WaitlistStatus.PROMOTED, 'promoted_at': now, 'held_spot_id': spot_id, 'updated_at': now
+        })
+        db.session.commit()
+        if updated:
+            break
+        # The user left the queue meanwhile: free the spot again and offer it to the next waiter
+        release_hold(spot_id, entry.user_id)
+    promoter.notifier.send(
+        entry.user_id,
+        f'A spot is waiting for you in {entry.parking_lot.name} until {held_until:%H:%M} UTC',
+        lot_id=lot_id, spot_id=spot_id, waitlist_entry_id=entry.id
+    )
+    return entry
+
+
+class WaitlistPromoter:
+    """Background thread that promotes waiters when spots are freed"""
+
+    def __init__(self, notifier=None):
+        self.notifier = notifier or LocalNotificationSink()
+        self._signals = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics_lock = threading.Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        with self._metrics_lock:
+            self.promotions = 0
+            self.total_wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.total_lag_seconds = 0.0
+            self.busy_seconds = 0.0
+
+    def signal(self, lot_id, spot_id=None):
+        """Note that a lot may have a free spot (safe to call from any thread)"""
+        if self._thread is None:
+            return
+        self._signals.put((lot_id, time.perf_counter()))
+
+    def start(self, app, poll_seconds=None):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(app, poll_seconds or 30), name='waitlist-promoter', daemon=True
+        )
+        self._thread.start()
+        print("Background: Started waitlist-promoter")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._signals.put(None)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def drain(self, timeout=10):
+        """Wait until every queued signal has been handled (for benchmarks)"""
+        deadline = time.perf_counter() + timeout
+        while self._signals.unfinished_tasks and time.perf_counter() < deadline:
+            time.sleep(0.01)
+
+    def _run(self, app, poll_seconds):
+        while not self._stop.is_set():
+            try:
+                item = self._signals.get(timeout=poll_seconds)
+            except queue.Empty:
+                # Catch spots freed by other workers that never signalled us
+                with app.app_context():
+                    for lot_id in self._lots_with_waiters_and_space():
+                        self._signals.put((lot_id, time.perf_counter()))
+                continue
+            try:
+                if item is None:
+                    continue
+                lot_id, signalled_at = item
+                with app.app_context():
+                    self._promote_lot(lot_id, signalled_at)
+            finally:
+                self._signals.task_done()
+
+    def _promote_lot(self, lot_id, signalled_at):
+        started = time.perf_counter()
+        try:
+            while True:
+                entry = promote_next(lot_id)
+                if entry is None:
+                    break
+                waited = (entry.promoted_at - entry.created_at).total_seconds()
+                with self._metrics_lock:
+                    self.promotions += 1
+                    self.total_wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                    self.total_lag_seconds += time.perf_counter() - signalled_at
+        except Exception as e:
+            db.session.rollback()
+            print(f"Waitlist Error: Promotion failed for lot {lot_id}: {str(e)}")
+        finally:
+            with self._metrics_lock:
+                self.busy_seconds += time.perf_counter() - started
+
+    def _lots_with_waiters_and_space(self):
+        return [
+            lot_id for (lot_id,) in db.session.query(WaitlistEntry.parking_lot_id).join(
+                ParkingLot, WaitlistEntry.parking_lot_id == ParkingLot.id
+            ).filter(
+                WaitlistEntry.status == WaitlistStatus.WAITING,
+                ParkingLot.available_spots > 0
+            ).distinct()
+        ]
+
+    def metrics(self):
+        """Promotion throughput and queue latency since the last reset"""
+        waiting = db.session.query(func.count(WaitlistEntry.id)).filter(
+            WaitlistEntry.status == WaitlistStatus.WAITING
+        ).scalar()
+        with self._metrics_lock:
+            count = self.promotions
+            return {
+                'promotions': count,
+                'promotions_per_second': round(count / self.busy_seconds, 2) if self.busy_seconds else 0,
+                'avg_wait_seconds': round(self.total_wait_seconds / count, 3) if count else 0,
+                'max_wait_seconds': round(self.max_wait_seconds, 3),
+                'avg_signal_to_promotion_ms': round(self.total_lag_seconds / count * 1000, 2) if count else 0,
+                'pending_signals': self._signals.qsize(),
+                'waiting_entries': waiting
+            }
+
+
+promoter = WaitlistPromoter()
+
+# Every freed spot wakes the promoter for its lot
+free_spot_index.on_free(promoter.signal)
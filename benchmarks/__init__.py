@@ -0,0 +1 @@
+# Benchmarks and stress checks - run with `python -m benchmarks.<name>`
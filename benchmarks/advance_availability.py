@@ -0,0 +1,81 @@
+# Availability queries over a large calendar of advance bookings
+#
+#   python -m benchmarks.advance_availability --spots 500 --bookings 200000
+#
+# Fills one lot with back-to-back future bookings, then times the
+# "which spots are free for this window" query against random windows.
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from app.extensions import db
+from app.models import Reservation, ReservationStatus
+from app.services import scheduling
+from benchmarks.common import make_app, create_lot, create_users
+
+
+def fill_calendar(lot_id, spot_ids, user_id, bookings, days):
+    """Insert `bookings` non-overlapping scheduled bookings spread over the next `days` days"""
+    base = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    per_spot = max(1, bookings // len(spot_ids))
+    slot = timedelta(minutes=days * 24 * 60 // per_spot)
+    now = datetime.utcnow()
+    batch = []
+    for spot_id in spot_ids:
+        start = base + timedelta(minutes=random.randint(0, 59))
+        for _ in range(per_spot):
+            length = timedelta(minutes=random.randint(30, max(31, int(slot.total_seconds() // 60) - 1)))
+            batch.append({
+                'user_id': user_id, 'parking_spot_id': spot_id,
+                'start_time': start, 'end_time': start + length,
+                'vehicle_number': 'CAL0001', 'total_cost': 0,
+                'status': ReservationStatus.SCHEDULED,
+                'created_at': now, 'updated_at': now, 'is_deleted': False
+            })
+            start += slot
+        if len(batch) >= 20000:
+            db.session.bulk_insert_mappings(Reservation, batch)
+            batch = []
+    if batch:
+        db.session.bulk_insert_mappings(Reservation, batch)
+    db.session.commit()
+    return per_spot * len(spot_ids)
+
+
+def run(spots, bookings, days, queries):
+    app = make_app()
+    with app.app_context():
+        lot = create_lot('Calendar Lot', spots)
+        spot_ids = [s.id for s in lot.parking_spots]
+        user_id = create_users(1, prefix='calendar')[0]
+
+        start = time.perf_counter()
+        inserted = fill_calendar(lot.id, spot_ids, user_id, bookings, days)
+        print(f"inserted {inserted} scheduled bookings in {time.perf_counter() - start:.1f}s")
+
+        now = datetime.utcnow()
+        timings = []
+        free_counts = []
+        for _ in range(queries):
+            window_start = now + timedelta(minutes=random.randint(60, days * 24 * 60))
+            window_end = window_start + timedelta(minutes=random.randint(30, 240))
+            t0 = time.perf_counter()
+            free_counts.append(len(scheduling.free_spots_for_window(lot.id, window_start, window_end)))
+            timings.append(time.perf_counter() - t0)
+
+    timings.sort()
+    print(f"{queries} availability queries over {spots} spots / {inserted} bookings")
+    print(f"p50={timings[len(timings) // 2] * 1000:.2f}ms "
+          f"p95={timings[int(len(timings) * 0.95)] * 1000:.2f}ms "
+          f"max={timings[-1] * 1000:.2f}ms")
+    print(f"average free spots per window: {sum(free_counts) / len(free_counts):.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark advance-booking availability queries')
+    parser.add_argument('--spots', type=int, default=500)
+    parser.add_argument('--bookings', type=int, default=200000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    run(args.spots, args.bookings, args.days, args.queries)
@@ -0,0 +1,71 @@
+# Re-billing throughput: ORM loop vs. the vectorized billing engine
+#
+#   python -m benchmarks.billing_reprice --rows 200000
+#
+# Loads `rows` finished reservations, then reprices all of them at a new rate
+# twice: once by looping over ORM objects with Reservation.calculate_cost, once
+# with billing.audit_reservations. Both totals must match.
+import argparse
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import insert
+from app.extensions import db
+from app.models import Reservation, ReservationStatus
+from app.services import billing
+from benchmarks.common import make_app, create_lot, create_users, timed
+
+
+def seed(rows, spot_ids, user_id, days=30):
+    """Bulk insert finished reservations spread over the last `days` days"""
+    rng = random.Random(42)
+    base = datetime.utcnow() - timedelta(days=days)
+    for offset in range(0, rows, 50000):
+        batch = []
+        for _ in range(min(50000, rows - offset)):
+            start = base + timedelta(seconds=rng.randrange(days * 86400))
+            end = start + timedelta(seconds=rng.randrange(1, 12 * 3600))
+            cancelled = rng.random() < 0.1
+            batch.append({
+                'user_id': user_id, 'parking_spot_id': rng.choice(spot_ids),
+                'start_time': start, 'end_time': end, 'vehicle_number': 'BENCH',
+                'total_cost': billing.reservation_cost(start, end, 20, 'cancel' if cancelled else 'vacate'),
+                'status': ReservationStatus.CANCELLED if cancelled else ReservationStatus.COMPLETED,
+                'created_at': start, 'updated_at': end, 'is_deleted': False
+            })
+        db.session.execute(insert(Reservation), batch)
+    db.session.commit()
+
+
+def run(rows, rate):
+    app = make_app()
+    with app.app_context():
+        lot = create_lot('Billing Lot', 200)
+        spot_ids = [spot.id for spot in lot.parking_spots]
+        seed(rows, spot_ids, create_users(1, prefix='billing')[0])
+        db.session.expunge_all()
+
+        with timed(f'ORM loop ({rows} reservations)') as orm:
+            orm_total = Decimal('0')
+            for reservation in Reservation.query.yield_per(10000):
+                mode = 'cancel' if reservation.status == ReservationStatus.CANCELLED else 'vacate'
+                reservation.calculate_cost(rate, mode)
+                orm_total += reservation.total_cost
+            db.session.rollback()
+
+        with timed(f'vectorized ({rows} reservations)') as vectorized:
+            audit = billing.audit_reservations(hourly_rate=rate)
+
+    print(f"ORM loop:   {rows / orm['seconds']:,.0f} reservations/sec")
+    print(f"vectorized: {rows / vectorized['seconds']:,.0f} reservations/sec")
+    print(f"speedup:    {orm['seconds'] / vectorized['seconds']:.1f}x")
+    print(f"repriced total: ORM {float(orm_total):.2f}, vectorized {audit['repriced']:.2f}")
+    print("PASS" if abs(float(orm_total) - audit['repriced']) < 0.01 else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark re-billing finished reservations')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--rate', type=float, default=35.0)
+    args = parser.parse_args()
+    run(args.rows, args.rate)
@@ -0,0 +1,91 @@
+# Multi-threaded booking stress test for the allocation engine
+#
+#   python -m benchmarks.booking_stress --threads 16 --spots 200
+#
+# Many threads race for the same lot, both by picking specific spots and by
+# asking for "any free spot". The run fails if any spot ends up with more than
+# one active reservation or more bookings succeed than there are spots.
+import argparse
+import random
+import sys
+import threading
+import time
+from sqlalchemy import func
+from app.extensions import db
+from app.models import ParkingSpot, Reservation, ReservationStatus, SpotStatus
+from app.services import allocation
+from benchmarks.common import make_app, create_lot, create_users
+
+
+def worker(app, user_id, lot_id, spot_ids, mode, counters, lock):
+    with app.app_context():
+        pending = list(spot_ids)
+        random.shuffle(pending)
+        while True:
+            try:
+                if mode == 'lot':
+                    allocation.book_spot(user_id, f'KA01{user_id:04d}', lot_id=lot_id)
+                else:
+                    if not pending:
+                        break
+                    allocation.book_spot(user_id, f'KA01{user_id:04d}', spot_id=pending.pop())
+                key = 'booked'
+            except allocation.LotFullError:
+                with lock:
+                    counters['full'] += 1
+                break
+            except allocation.SpotTakenError:
+                key = 'lost'
+            with lock:
+                counters[key] += 1
+
+
+def run(threads, spots, mode):
+    app = make_app()
+    with app.app_context():
+        lot = create_lot('Stress Lot', spots)
+        lot_id = lot.id
+        spot_ids = [s.id for s in ParkingSpot.query.filter_by(parking_lot_id=lot_id).all()]
+        user_ids = create_users(threads, prefix='stress')
+
+    counters = {'booked': 0, 'lost': 0, 'full': 0}
+    lock = threading.Lock()
+    pool = [
+        threading.Thread(target=worker, args=(app, user_ids[i], lot_id, spot_ids, mode, counters, lock))
+        for i in range(threads)
+    ]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        double_booked = db.session.query(Reservation.parking_spot_id).filter(
+            Reservation.status == ReservationStatus.ACTIVE
+        ).group_by(Reservation.parking_spot_id).having(func.count(Reservation.id) > 1).count()
+        active = Reservation.query.filter(
+            Reservation.status == ReservationStatus.ACTIVE,
+            Reservation.parking_spot_id.in_(spot_ids)
+        ).count()
+        still_free = ParkingSpot.query.filter_by(parking_lot_id=lot_id, status=SpotStatus.AVAILABLE).count()
+
+    print(f"mode={mode} threads={threads} spots={spots}")
+    print(f"booked={counters['booked']} lost_races={counters['lost']} saw_full={counters['full']}")
+    print(f"active reservations={active} spots still free={still_free}")
+    print(f"double booked spots={double_booked}")
+    print(f"elapsed={elapsed:.3f}s bookings/sec={counters['booked'] / elapsed:.1f}")
+
+    ok = double_booked == 0 and counters['booked'] == active and active + still_free == spots
+    print('PASS' if ok else 'FAIL')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--spots', type=int, default=200)
+    parser.add_argument('--mode', choices=['spot', 'lot'], default='lot')
+    args = parser.parse_args()
+    sys.exit(0 if run(args.threads, args.spots, args.mode) else 1)
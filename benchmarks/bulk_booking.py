@@ -0,0 +1,37 @@
+# Fleet booking throughput: one bulk transaction vs. one booking per spot
+#
+#   python -m benchmarks.bulk_booking --spots 500
+import argparse
+from app.models import Reservation, ReservationStatus
+from app.services import allocation
+from benchmarks.common import make_app, create_lot, create_users, timed
+
+
+def run(spots):
+    app = make_app()
+    with app.app_context():
+        per_spot_lot = create_lot('Per Spot Lot', spots).id
+        bulk_lot = create_lot('Bulk Lot', spots).id
+        user_id = create_users(1, prefix='fleet')[0]
+        plates = [f'FLEET{i:04d}' for i in range(spots)]
+
+        with timed(f'per-spot path ({spots} bookings)') as per_spot:
+            for plate in plates:
+                allocation.book_spot(user_id, plate, lot_id=per_spot_lot)
+
+        with timed(f'bulk path ({spots} bookings, one transaction)') as bulk:
+            allocation.book_bulk(user_id, [(bulk_lot, spots)], plates)
+
+        booked = Reservation.query.filter_by(user_id=user_id, status=ReservationStatus.ACTIVE).count()
+
+    print(f"per-spot: {spots / per_spot['seconds']:.1f} bookings/sec")
+    print(f"bulk:     {spots / bulk['seconds']:.1f} bookings/sec")
+    print(f"speedup:  {per_spot['seconds'] / bulk['seconds']:.1f}x")
+    print(f"active reservations: {booked} (expected {2 * spots})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare bulk and per-spot booking throughput')
+    parser.add_argument('--spots', type=int, default=500)
+    args = parser.parse_args()
+    run(args.spots)
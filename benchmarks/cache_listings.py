@@ -0,0 +1,75 @@
+# Read-through cache on the lot listing and geography endpoints
+#
+#   python -m benchmarks.cache_listings --lots 2000 --backend memory
+#   python -m benchmarks.cache_listings --lots 2000 --backend sqlite
+#
+# Times /user/get_lots and /user/get_cities with a cold cache (every request
+# computes) and a warm one, then books a spot and checks that the next listing
+# shows the lot's new availability rather than the cached one.
+import argparse
+import os
+import tempfile
+import time
+from app.extensions import db
+from app.models import City, ParkingLot
+from app.services.cache import cache
+from benchmarks.common import make_app, create_lot, create_users
+from benchmarks.lot_search import seed
+
+
+def average_ms(client, url, repeat, cold):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        if cold:
+            cache.clear()
+        response = client.get(url)
+        assert response.status_code == 200, response.data
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def run(lots, backend, repeat):
+    app = make_app()
+    app.config['CACHE_BACKEND'] = backend
+    app.config['CACHE_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='cache-bench-'), 'cache.sqlite3')
+    cache.init_app(app)
+    with app.app_context():
+        seed(lots, 4)
+        city_id = db.session.query(ParkingLot.city_id).group_by(ParkingLot.city_id).order_by(
+            db.func.count().desc()
+        ).limit(1).scalar()
+        city = db.session.get(City, city_id)
+        lot = create_lot('Cache Lot', 10)
+        lot.city_id = city_id
+        db.session.commit()
+        lot_id, state_id = lot.id, city.state_id
+        user_id = create_users(1, prefix='cache')[0]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    for url in (f'/user/get_lots?city_id={city_id}', f'/user/get_cities?state_id={state_id}'):
+        cold = average_ms(client, url, repeat, cold=True)
+        warm = average_ms(client, url, repeat, cold=False)
+        print(f"{url}: {cold:.2f}ms cold, {warm:.2f}ms warm ({cold / warm:.0f}x)")
+
+    listing = f'/user/get_lots?city_id={city_id}'
+    before = next(l for l in client.get(listing).get_json() if l['id'] == lot_id)['available_spots']
+    response = client.post(f'/user/book-lot/{lot_id}', json={'vehicle_number': 'CACHE01'})
+    assert response.status_code == 200, response.data
+    after = next(l for l in client.get(listing).get_json() if l['id'] == lot_id)['available_spots']
+    fresh = after == before - 1
+    print(f"available spots after a booking: {before} -> {after}")
+
+    metrics = cache.metrics()
+    print(f"hit rate {metrics['hit_rate']:.2%}, {metrics['invalidations']} invalidation(s), {metrics['entries']} entries")
+    print("PASS" if fresh else "FAIL (stale listing served after a booking)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the read-through cache on listing endpoints')
+    parser.add_argument('--lots', type=int, default=2000)
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    run(args.lots, args.backend, args.repeat)
@@ -0,0 +1,77 @@
+# Shared helpers for the benchmark scripts
+import os
+import time
+from decimal import Decimal
+from contextlib import contextmanager
+from config import config
+from app import create_app
+from app.extensions import db
+from app.services.free_spots import free_spot_index
+from app.models import User, UserRole, Role, RoleType, GenderEnum, UserStatus, City, ParkingLot, ParkingSpot, ParkingLotStatus, SpotStatus
+
+
+def make_app():
+    """Create the app against a fresh benchmark database"""
+    uri = config['benchmark'].SQLALCHEMY_DATABASE_URI
+    if uri.startswith('sqlite:///'):
+        path = uri[len('sqlite:///'):]
+        if os.path.exists(path):
+            os.remove(path)
+    return create_app('benchmark')
+
+
+def create_lot(name, total_spots, price_per_hour=Decimal('20.00')):
+    """Create a parking lot with `total_spots` available spots"""
+    city = City.query.first()
+    lot = ParkingLot(
+        name=name,
+        address=f'{name} Benchmark Road',
+        city_id=city.id,
+        total_spots=total_spots,
+        available_spots=total_spots,
+        price_per_hour=price_per_hour,
+        status=ParkingLotStatus.ACTIVE
+    )
+    db.session.add(lot)
+    db.session.flush()
+    db.session.bulk_insert_mappings(ParkingSpot, [
+        {'spot_number': f'B{i:05d}', 'parking_lot_id': lot.id, 'status': SpotStatus.AVAILABLE}
+        for i in range(1, total_spots + 1)
+    ])
+    db.session.commit()
+    free_spot_index.reload_lot(lot.id)
+    return lot
+
+
+def create_users(count, prefix='bench'):
+    """Create `count` active users with the regular user role and return their ids"""
+    user_role = Role.query.filter_by(name=RoleType.USER.value).first()
+    ids = []
+    for i in range(count):
+        user = User(
+            email=f'{prefix}{i}@example.com',
+            username=f'{prefix}{i}',
+            first_name='Bench',
+            last_name=f'User{i}',
+            phone=f'+91{7000000000 + i}',
+            gender=GenderEnum.OTHER,
+            status=UserStatus.ACTIVE,
+            # Hashing a real password per user would dominate setup time
+            password_hash='!'
+        )
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(UserRole(user_id=user.id, role_id=user_role.id))
+        ids.append(user.id)
+    db.session.commit()
+    return ids
+
+
+@contextmanager
+def timed(label):
+    """Print how long the wrapped block took"""
+    start = time.perf_counter()
+    result = {}
+    yield result
+    result['seconds'] = time.perf_counter() - start
+    print(f"{label}: {result['seconds']:.3f}s")
@@ -0,0 +1,48 @@
+# Admin dashboard statistics: materialized snapshot vs. recounting on every view
+#
+#   python -m benchmarks.dashboard_stats --rows 500000
+#
+# Seeds finished reservations, then times the materialized single-read
+# snapshot against stats.compute(), which runs the COUNT/SUM queries the
+# dashboard used to issue per page view. Both must agree.
+import argparse
+import time
+from app.extensions import db
+from app.services import stats
+from benchmarks.billing_reprice import seed
+from benchmarks.common import make_app, create_lot, create_users, timed
+
+
+def average_ms(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(rows, repeat):
+    app = make_app()
+    with app.app_context():
+        lot = create_lot('Dashboard Lot', 200)
+        with timed(f'seed {rows} reservations'):
+            seed(rows, [spot.id for spot in lot.parking_spots], create_users(1, prefix='dash')[0])
+        # Seeding uses bulk inserts, so bring the counters up to date once
+        stats.reconcile()
+        db.session.expunge_all()
+
+        materialized = average_ms(stats.snapshot, repeat)
+        recount = average_ms(stats.compute, max(1, repeat // 10))
+        drifted = stats.reconcile()
+
+    print(f"materialized snapshot: {materialized:.2f}ms per view")
+    print(f"recount queries:       {recount:.2f}ms per view")
+    print(f"speedup:               {recount / materialized:.0f}x")
+    print("PASS" if not drifted else f"FAIL (drifted: {', '.join(drifted)})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark admin dashboard statistics')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
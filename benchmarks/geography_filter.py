@@ -0,0 +1,100 @@
+# Lots under a country/state: one indexed join instead of id lists and a lookup per lot
+#
+#   python -m benchmarks.geography_filter --lots 20000 --cities 1000
+#
+# Adds `cities` cities spread over new states of the seeded countries, bulk
+# loads `lots` lots among all cities, then times /user/api/lots?country_id=..
+# (cache cleared on every request) against the way the endpoint used to
+# filter: every state id, then every city id into an IN list, then one city
+# lookup per lot. Both must return the same lots, and the statements per
+# request must not grow with the lot count. Moving a state to another
+# country must leave the ancestor index equal to a full recompute.
+import argparse
+import time
+from sqlalchemy import event, select
+from app.extensions import db
+from app.models import City, CityAncestor, Country, GeographyStatus, ParkingLot, State
+from app.services import geo_index
+from app.services.cache import cache
+from benchmarks.common import make_app, create_users
+from benchmarks.lot_search import seed
+
+
+def add_cities(count, per_state=20):
+    countries = Country.query.all()
+    for index in range(0, count, per_state):
+        state = State(name=f'Bench State {index}', code=f'BS{index}', status=GeographyStatus.ACTIVE,
+                      country_id=countries[index // per_state % len(countries)].id)
+        db.session.add(state)
+        db.session.flush()
+        db.session.add_all(City(name=f'Bench City {index + n}', code=f'BC{n}', state_id=state.id,
+                                status=GeographyStatus.ACTIVE) for n in range(min(per_state, count - index)))
+    db.session.commit()
+
+
+def legacy_lots(country_id):
+    """The country filter as the endpoint used to run it"""
+    state_ids = [s.id for s in State.query.filter_by(country_id=country_id).all()]
+    city_ids = [c.id for c in City.query.filter(City.state_id.in_(state_ids)).all()]
+    result = []
+    for lot in ParkingLot.query.filter(ParkingLot.city_id.in_(city_ids)).all():
+        city = db.session.get(City, lot.city_id)
+        result.append({'id': lot.id, 'city_name': city.name if city else ''})
+    return result
+
+
+def measure(fn, repeat, statements):
+    del statements[:]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat * 1000, len(statements) // repeat
+
+
+def run(lots, cities, repeat):
+    app = make_app()
+    with app.app_context():
+        add_cities(cities)
+        seed(lots, 2)
+        country_id = db.session.query(State.country_id).join(City).join(ParkingLot).group_by(
+            State.country_id).order_by(db.func.count().desc()).limit(1).scalar()
+        user_id = create_users(1, prefix='geo')[0]
+        engine = db.engine
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    def indexed():
+        cache.clear()
+        return client.get(f'/user/api/lots?country_id={country_id}').get_json()
+
+    new, new_ms, new_statements = measure(indexed, repeat, statements)
+    with app.app_context():
+        old, old_ms, old_statements = measure(lambda: legacy_lots(country_id), repeat, statements)
+        db.session.rollback()
+    same = sorted((l['id'], l['city_name']) for l in new) == sorted((l['id'], l['city_name']) for l in old)
+    print(f"{len(new)} lots in country {country_id}: {'same lots' if same else 'DIFFERENT lots'}")
+    print(f"  ancestor index: {new_ms:.2f}ms, {new_statements} statement(s) per request")
+    print(f"  id lists + lookup per lot: {old_ms:.2f}ms, {old_statements} statements ({old_ms / new_ms:.1f}x slower)")
+
+    with app.app_context():
+        state = State.query.filter(State.country_id == country_id).first()
+        state.country_id = Country.query.filter(Country.id != country_id).first().id
+        db.session.commit()
+        closure = set(db.session.execute(select(CityAncestor.level, CityAncestor.ancestor_id, CityAncestor.city_id)).all())
+        consistent = closure == set(db.session.execute(geo_index._paths()).all())
+    print(f"ancestor rows after moving a state: {'match a recompute' if consistent else 'DIFFER from a recompute'}")
+    ok = same and consistent and new_statements <= 2 and new_ms < old_ms
+    print("PASS" if ok else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark geography filters on the lot listing')
+    parser.add_argument('--lots', type=int, default=20000)
+    parser.add_argument('--cities', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(args.lots, args.cities, args.repeat)
@@ -0,0 +1,83 @@
+# Geography dropdowns served from the in-process tree with ETags
+#
+#   python -m benchmarks.geography_tree --cities 5000
+#
+# Adds `cities` cities, then times /user/get_cities for the largest state and
+# /user/get_countries: a plain 200 from the tree, a 304 for a client sending
+# the ETag it already has, and the queries the endpoints used to run per
+# request. Served lists must run no SQL, must match the tables, and a
+# geography write must change the ETag of the affected list only.
+import argparse
+import time
+from flask import jsonify
+from sqlalchemy import event
+from app.extensions import db
+from app.models import City, Country
+from app.services.geo_tree import geography_tree
+from benchmarks.common import make_app, create_users
+from benchmarks.geography_filter import add_cities
+
+
+def average_ms(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def run(cities, repeat):
+    app = make_app()
+    with app.app_context():
+        add_cities(cities, per_state=cities // 10 or 1)
+        state_id = db.session.query(City.state_id).group_by(City.state_id).order_by(
+            db.func.count().desc()).limit(1).scalar()
+        expected = [{'id': c.id, 'name': c.name} for c in City.query.filter_by(state_id=state_id).order_by(City.id)]
+        user_id = create_users(1, prefix='tree')[0]
+        engine = db.engine
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    ok = True
+    for url, legacy in ((f'/user/get_cities?state_id={state_id}', lambda: City.query.filter_by(state_id=state_id)),
+                        ('/user/get_countries', lambda: Country.query)):
+        first = client.get(url)
+        etag = first.headers['ETag']
+        del statements[:]
+        served = average_ms(lambda: client.get(url), repeat)
+        queries = len(statements) // repeat
+        not_modified = average_ms(lambda: client.get(url, headers={'If-None-Match': etag}), repeat)
+        status = client.get(url, headers={'If-None-Match': etag}).status_code
+        with app.test_request_context():
+            query_ms = average_ms(lambda: jsonify([{'id': g.id, 'name': g.name} for g in legacy().all()]), repeat)
+            db.session.rollback()
+        ok = ok and queries == 0 and status == 304
+        print(f"{url}: {len(first.data):,} bytes; tree {served:.2f}ms ({queries} statements), "
+              f"304 {not_modified:.2f}ms, query per request {query_ms:.2f}ms")
+    correct = client.get(f'/user/get_cities?state_id={state_id}').get_json() == expected
+    print(f"cities of state {state_id}: {'match the table' if correct else 'DIFFER from the table'}")
+
+    cities_url, countries_url = f'/user/get_cities?state_id={state_id}', '/user/get_countries'
+    before = {url: client.get(url).headers['ETag'] for url in (cities_url, countries_url)}
+    builds = geography_tree.builds
+    with app.app_context():
+        db.session.get(City, expected[0]['id']).name = 'Renamed City'
+        db.session.commit()
+    started = time.perf_counter()
+    after = {url: client.get(url).headers['ETag'] for url in (cities_url, countries_url)}
+    rebuild_ms = (time.perf_counter() - started) * 1000
+    changed = after[cities_url] != before[cities_url] and after[countries_url] == before[countries_url]
+    print(f"after renaming a city: {geography_tree.builds - builds} rebuild ({rebuild_ms:.1f}ms), "
+          f"{'only the cities list changed ETag' if changed else 'WRONG ETags changed'}")
+    print("PASS" if ok and correct and changed else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the geography dropdowns served from the in-process tree')
+    parser.add_argument('--cities', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(args.cities, args.repeat)
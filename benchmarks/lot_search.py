@@ -0,0 +1,105 @@
+# Admin lot search latency with thousands of lots
+#
+#   python -m benchmarks.lot_search --lots 5000 --spots 40
+#
+# Bulk loads `lots` lots with `spots` spots each in random states, then times
+# the availability-filtered, occupancy-sorted search pages. The stats of the
+# returned page must match a recount of the spots.
+import argparse
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import insert
+from app.extensions import db
+from app.models import City, ParkingLot, ParkingLotStatus, ParkingSpot, SpotStatus
+from app.services import search_index
+from benchmarks.common import make_app, timed
+
+STATUSES = [SpotStatus.AVAILABLE] * 5 + [SpotStatus.OCCUPIED] * 3 + [SpotStatus.RESERVED, SpotStatus.UNDER_MAINTENANCE]
+SEARCHES = [
+    'sort=occupancy&order=desc',
+    'status=partial&sort=occupancy',
+    'status=full',
+    'search=lot 12&sort=total_spots&order=desc',
+    'location=bengaluru&sort=occupancy&order=desc&page=3',
+]
+
+
+def seed(lots, spots):
+    rng = random.Random(3)
+    city_ids = [city.id for city in City.query.all()]
+    now = datetime.utcnow()
+    start_id = (db.session.query(db.func.max(ParkingLot.id)).scalar() or 0) + 1
+    lot_rows, spot_rows = [], []
+    for lot_id in range(start_id, start_id + lots):
+        size = rng.randint(spots // 2, spots * 2)
+        # Some lots are full
+        full = rng.random() < 0.1
+        lot_rows.append({
+            'id': lot_id, 'name': f'Search Lot {lot_id}', 'address': f'{lot_id} Benchmark Road',
+            'city_id': rng.choice(city_ids), 'total_spots': size, 'available_spots': 0,
+            'price_per_hour': Decimal('20.00'), 'status': ParkingLotStatus.ACTIVE,
+            'created_at': now, 'updated_at': now, 'is_deleted': False
+        })
+        for number in range(size):
+            spot_rows.append({
+                'spot_number': f'S{number:04d}', 'parking_lot_id': lot_id,
+                'status': SpotStatus.OCCUPIED if full else rng.choice(STATUSES),
+                'created_at': now, 'updated_at': now, 'is_deleted': False, 'version': 1
+            })
+    db.session.execute(insert(ParkingLot), lot_rows)
+    for offset in range(0, len(spot_rows), 50000):
+        db.session.execute(insert(ParkingSpot), spot_rows[offset:offset + 50000])
+    db.session.commit()
+    # Bulk inserts skip the mapper events that index new lots
+    search_index.rebuild()
+    return len(spot_rows)
+
+
+def run(lots, spots, repeat):
+    app = make_app()
+    with app.app_context():
+        with timed(f'seed {lots} lots'):
+            total_spots = seed(lots, spots)
+        print(f"  {total_spots} spots")
+
+    client = app.test_client()
+    response = client.post('/auth/login', json={'username': 'admin', 'password': 'Admin@123'})
+    assert response.status_code == 200, response.data
+
+    mismatches = 0
+    for params in SEARCHES:
+        url = f'/admin/parking/lots/search?format=json&per_page=50&{params}'
+        started = time.perf_counter()
+        for _ in range(repeat):
+            body = client.get(url).get_json()
+        elapsed = (time.perf_counter() - started) / repeat * 1000
+        assert body['success'], body
+        print(f"{params}: {elapsed:.1f}ms per page ({body['pagination']['total']} matching lots)")
+
+        with app.app_context():
+            for result in body['results']:
+                counts = Counter(status for status, in db.session.query(ParkingSpot.status).filter_by(
+                    parking_lot_id=result['id'], is_deleted=False
+                ))
+                total = sum(counts.values())
+                expected = (total, counts[SpotStatus.AVAILABLE], counts[SpotStatus.OCCUPIED], counts[SpotStatus.RESERVED])
+                if expected != (result['total_spots'], result['available'], result['occupied'], result['reserved']):
+                    mismatches += 1
+        rates = [result['occupancy_rate'] for result in body['results']]
+        if 'sort=occupancy&order=desc' in params and rates != sorted(rates, reverse=True):
+            mismatches += 1
+
+    print(f"mismatches: {mismatches}")
+    print("PASS" if mismatches == 0 else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark admin lot search')
+    parser.add_argument('--lots', type=int, default=5000)
+    parser.add_argument('--spots', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.lots, args.spots, args.repeat)
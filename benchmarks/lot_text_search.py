@@ -0,0 +1,143 @@
+# Full-text lot search over 100k lots: FTS5 index against LIKE scans
+#
+#   python -m benchmarks.lot_text_search --lots 100000
+#
+# Bulk loads `lots` lots with synthetic names and addresses across a few
+# hundred cities, indexes them, then times the user lot search and the admin
+# lot search for whole words, prefixes, place names and multi-word queries,
+# next to the LIKE search the user endpoint used to run. Every search must
+# return exactly the lots with a word starting with each term in the name,
+# address, city or state; from SPEED_CHECK_MIN_LOTS lots up, searches
+# matching up to 1000 lots must be faster than the LIKE scan (below that the
+# scan of a small table costs about as much as the request around it); lots
+# matching by name must rank first, and a lot added
+# or renamed through the ORM must be found at once.
+import argparse
+import random
+import re
+import time
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import insert
+from app.extensions import db
+from app.models import City, ParkingLot, ParkingLotStatus, State
+from app.services import search_index
+from benchmarks.common import make_app, timed
+from benchmarks.geography_filter import add_cities
+
+PREFIXES = ['Central', 'North', 'South', 'East', 'West', 'Harbor', 'Airport', 'Riverside', 'Old Town', 'Tech']
+KINDS = ['Mall', 'Station', 'Plaza', 'Market', 'Park', 'Tower', 'Square', 'Arena', 'Hospital', 'Campus']
+STREETS = ['MG Road', 'Church Street', 'Lake View Avenue', 'Hill Road', 'Ring Road', 'Canal Street',
+           'Station Road', 'Garden Lane', 'Marine Drive', 'Brigade Road']
+# Smallest table on which the index is required to beat the LIKE scan
+SPEED_CHECK_MIN_LOTS = 20000
+
+SEARCHES = ['harbor', 'harb', 'marine', 'north plaza', 'tower 4242', 'riverside arena 99', 'bench city 12']
+
+
+def seed(lots):
+    rng = random.Random(25)
+    cities = db.session.query(City.id).all()
+    now = datetime.utcnow()
+    rows = [{
+        'name': f'{rng.choice(PREFIXES)} {rng.choice(KINDS)} Parking {number}',
+        'address': f'{rng.randint(1, 999)} {rng.choice(STREETS)}',
+        'city_id': rng.choice(cities)[0], 'total_spots': 0, 'available_spots': 0,
+        'price_per_hour': Decimal('20.00'), 'status': ParkingLotStatus.ACTIVE,
+        'created_at': now, 'updated_at': now, 'is_deleted': False
+    } for number in range(lots)]
+    for offset in range(0, lots, 20000):
+        db.session.execute(insert(ParkingLot), rows[offset:offset + 20000])
+    db.session.commit()
+
+
+def expected_ids(term):
+    """Lots with a word starting with every term word, by a scan in Python"""
+    words = re.findall(r'\w+', term.lower())
+    found = set()
+    for lot_id, *fields in db.session.query(ParkingLot.id, ParkingLot.name, ParkingLot.address, City.name, State.name).join(
+        City, City.id == ParkingLot.city_id
+    ).join(State, State.id == City.state_id):
+        tokens = re.findall(r'\w+', ' '.join(fields).lower())
+        if all(any(token.startswith(word) for token in tokens) for word in words):
+            found.add(lot_id)
+    return found
+
+
+def like_search(term):
+    """The user search as it used to run: LIKE on the name, a count, the page, a city lookup per lot"""
+    query = ParkingLot.query.filter(ParkingLot.status == ParkingLotStatus.ACTIVE, ParkingLot.name.ilike(f'%{term}%'))
+    total = query.count()
+    page = query.limit(50).all()
+    return total, [db.session.get(City, lot.city_id).name for lot in page]
+
+
+def average_ms(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def run(lots, repeat):
+    app = make_app()
+    with app.app_context():
+        add_cities(300)
+        with timed(f'seed {lots} lots'):
+            seed(lots)
+        with timed('build the search index'):
+            search_index.rebuild()
+
+    client = app.test_client()
+    response = client.post('/auth/login', json={'username': 'admin', 'password': 'Admin@123'})
+    assert response.status_code == 200, response.data
+
+    ok = True
+    if lots < SPEED_CHECK_MIN_LOTS:
+        print(f"{lots} lots is below {SPEED_CHECK_MIN_LOTS}: checking results only, not speed")
+    for term in SEARCHES:
+        body, user_ms = average_ms(lambda: client.post('/user/search_lots', json={'lot_name': term, 'per_page': 50}).get_json(), repeat)
+        admin, admin_ms = average_ms(lambda: client.get(
+            '/admin/parking/lots/search', query_string={'format': 'json', 'search': term, 'per_page': 50}).get_json(), repeat)
+        with app.app_context():
+            (like_total, _), like_ms = average_ms(lambda: like_search(term), repeat)
+            db.session.rollback()
+            expected = expected_ids(term)
+            everything = set()
+            page = 1
+            while True:
+                chunk = client.post('/user/search_lots', json={'lot_name': term, 'per_page': 1000, 'page': page}).get_json()
+                everything.update(lot['id'] for lot in chunk['lots'])
+                if page >= chunk['pages']:
+                    break
+                page += 1
+        exact = everything == expected and body['total'] == admin['pagination']['total'] == len(expected)
+        # Searches that narrow to a few lots are the common case and must beat the scan
+        fast = lots < SPEED_CHECK_MIN_LOTS or len(expected) > 1000 or user_ms < like_ms
+        ok = ok and exact and fast
+        print(f"'{term}': {len(expected)} lots, user search {user_ms:.1f}ms, admin search {admin_ms:.1f}ms; "
+              f"LIKE on name {like_ms:.1f}ms ({like_total} lots){'' if exact else ' - RESULTS DIFFER'}")
+
+    # 'marine' is a street word only, so a lot named after it must outrank them all
+    with app.app_context():
+        city_id = db.session.query(City.id).first()[0]
+        lot = ParkingLot(name='Marine Drive Parking', address='1 Quiet Lane', city_id=city_id, total_spots=0, available_spots=0)
+        db.session.add(lot)
+        db.session.commit()
+        lot_id = lot.id
+    first = client.post('/user/search_lots', json={'lot_name': 'marine'}).get_json()['lots'][0]['id']
+    with app.app_context():
+        db.session.get(ParkingLot, lot_id).name = 'Quayside Parking'
+        db.session.commit()
+    renamed = client.post('/user/search_lots', json={'lot_name': 'quaysi'}).get_json()['lots']
+    synced = first == lot_id and [l['id'] for l in renamed] == [lot_id]
+    print(f"new lot ranked first by name: {first == lot_id}; found by its new name at once: {[l['id'] for l in renamed] == [lot_id]}")
+    print("PASS" if ok and synced else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full-text lot search')
+    parser.add_argument('--lots', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.lots, args.repeat)
@@ -0,0 +1,65 @@
+# Reservation export throughput and memory: the footprint must not grow with the table
+#
+#   python -m benchmarks.reservation_export --rows 500000
+#
+# Exports a fifth of `rows` reservations, then all of them, as month-partitioned
+# Parquet, measuring the peak Python and Arrow memory of each run. Both runs
+# read the same chunk size, so the peaks must be about the same. The files are
+# read back and must hold every exported row. Needs pyarrow.
+import argparse
+import shutil
+import tempfile
+import tracemalloc
+from app.services import exports
+from benchmarks.billing_reprice import seed
+from benchmarks.common import make_app, create_lot, create_users, timed
+
+
+def export(directory, chunk_size):
+    import pyarrow
+    pool = pyarrow.default_memory_pool()
+    arrow_before = pool.max_memory() or 0
+    tracemalloc.start()
+    with timed('export') as elapsed:
+        result = exports.export_reservations(directory, full=True, chunk_size=chunk_size)
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    arrow_peak = max((pool.max_memory() or 0) - arrow_before, 0)
+    return result, elapsed['seconds'], python_peak, arrow_peak
+
+
+def run(rows, chunk_size):
+    import pyarrow.dataset
+    app = make_app()
+    directory = tempfile.mkdtemp(prefix='reservation-export-')
+    try:
+        with app.app_context():
+            app.config['EXPORT_LAG_SECONDS'] = 0
+            lot = create_lot('Export Lot', 200)
+            spot_ids = [spot.id for spot in lot.parking_spots]
+            user_id = create_users(1, prefix='export')[0]
+            peaks = []
+            for step, count in enumerate((rows // 5, rows - rows // 5)):
+                seed(count, spot_ids, user_id, days=365)
+                shutil.rmtree(directory, ignore_errors=True)
+                result, seconds, python_peak, arrow_peak = export(directory, chunk_size)
+                peaks.append(python_peak + arrow_peak)
+                print(f"  {result['rows']} rows: {result['rows'] / seconds:,.0f} rows/sec, "
+                      f"peak memory {python_peak / 2**20:.1f}MB Python + {arrow_peak / 2**20:.1f}MB Arrow, "
+                      f"{len(result['files'])} month partition(s)")
+            read_back = pyarrow.dataset.dataset(directory, format='parquet', partitioning='hive').count_rows()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    flat = peaks[1] < peaks[0] * 1.5
+    print(f"rows read back: {read_back} of {result['rows']}")
+    print(f"memory growth for 5x the rows: {peaks[1] / peaks[0]:.2f}x")
+    print("PASS" if read_back == result['rows'] and flat else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the columnar reservation export')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+    run(args.rows, args.chunk_size)
@@ -0,0 +1,91 @@
+# Reservation history paging: a deep page must cost about the same as the first
+#
+#   python -m benchmarks.reservation_pages --reservations 200000
+#
+# Seeds one user's history, then times /user/user_reservations_paginated for
+# the first page and for a page near the end of the history (by cursor), and
+# the same deep page read with OFFSET for comparison. Walking a short history
+# page by page, forwards and back, must visit every reservation exactly once.
+import argparse
+import time
+from app.extensions import db
+from app.models import Reservation
+from app.services import keyset
+from benchmarks.billing_reprice import seed
+from benchmarks.common import make_app, create_lot, create_users
+
+
+def average_ms(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def walk(client, per_page):
+    """Every id, newest first, following next_cursor; then back to the start via prev_cursor"""
+    url = '/user/user_reservations_paginated'
+    pages, cursor = [], None
+    while True:
+        body = client.get(url, query_string={'per_page': per_page, **({'cursor': cursor} if cursor else {})}).get_json()
+        pages.append([r['id'] for r in body['reservations']])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    back, before = [pages[-1]], body['prev_cursor']
+    while before:
+        body = client.get(url, query_string={'per_page': per_page, 'before': before}).get_json()
+        back.append([r['id'] for r in body['reservations']])
+        before = body['prev_cursor']
+    return pages, back[::-1]
+
+
+def run(reservations, per_page, repeat):
+    app = make_app()
+    with app.app_context():
+        lot = create_lot('Paging Lot', 200)
+        spot_ids = [spot.id for spot in lot.parking_spots]
+        short_user, long_user = create_users(2, prefix='pages')
+        seed(137, spot_ids, short_user, days=365)
+        seed(reservations, spot_ids, long_user, days=365)
+        newest = Reservation.query.filter_by(user_id=long_user).order_by(
+            Reservation.created_at.desc(), Reservation.id.desc())
+        depth = reservations - per_page * 2
+        boundary = newest.offset(depth - 1).first()
+        deep_cursor = keyset.encode_cursor(boundary.created_at, boundary.id)
+        expected_short = [r.id for r in Reservation.query.filter_by(user_id=short_user).order_by(
+            Reservation.created_at.desc(), Reservation.id.desc())]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = short_user
+    forward, backward = walk(client, 10)
+    walked = [rid for page in forward for rid in page]
+    complete = walked == expected_short and forward == backward
+    print(f"walk of {len(expected_short)} reservations: {len(forward)} pages, "
+          f"{'every row once, same pages both ways' if complete else 'MISMATCH'}")
+
+    with client.session_transaction() as session:
+        session['user_id'] = long_user
+    url = '/user/user_reservations_paginated'
+    first = average_ms(lambda: client.get(url, query_string={'per_page': per_page}), repeat)
+    deep = average_ms(lambda: client.get(url, query_string={'per_page': per_page, 'cursor': deep_cursor}), repeat)
+    with app.app_context():
+        offset = average_ms(lambda: newest.offset(depth).limit(per_page + 1).all(), repeat)
+        cursor_sql = average_ms(lambda: keyset.newest_first(newest.order_by(None), Reservation, per_page, after=deep_cursor), repeat)
+        db.session.rollback()
+
+    print(f"endpoint, first page: {first:.2f}ms")
+    print(f"endpoint, page at row {depth:,} by cursor: {deep:.2f}ms ({deep / first:.2f}x the first page)")
+    print(f"same page by cursor, query only: {cursor_sql:.2f}ms; by OFFSET {depth:,}: {offset:.2f}ms")
+    ok = complete and deep < first * 1.5
+    print("PASS" if ok else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark cursor pagination of reservation history')
+    parser.add_argument('--reservations', type=int, default=200000)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    run(args.reservations, args.per_page, args.repeat)
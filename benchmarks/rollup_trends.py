@@ -0,0 +1,104 @@
+# 90-day trend chart: reading the rollups vs. aggregating the reservations
+#
+#   python -m benchmarks.rollup_trends --rows 500000
+#
+# Seeds 90 days of finished reservations across several lots, backfills the
+# rollups, then times rollups.trend() against the GROUP BY over reservations a
+# chart endpoint would otherwise run per view. Daily reservation counts and
+# revenue must agree, and a booking cancelled before it started must not
+# change any bucket of its lot.
+import argparse
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app.extensions import db
+from app.models import LotRollup, ParkingSpot, Reservation, ReservationStatus
+from app.services import rollups
+from benchmarks.billing_reprice import seed
+from benchmarks.common import make_app, create_lot, create_users, timed
+
+DAYS = 90
+
+
+def raw_trend():
+    """Per-day started counts and revenue straight from the reservations"""
+    since = datetime.combine(datetime.utcnow().date() - timedelta(days=DAYS - 1), datetime.min.time())
+    started = dict(db.session.query(func.date(Reservation.start_time), func.count(Reservation.id)).filter(
+        Reservation.start_time >= since
+    ).group_by(func.date(Reservation.start_time)).all())
+    revenue = dict(db.session.query(func.date(Reservation.end_time), func.sum(Reservation.total_cost)).filter(
+        Reservation.status.in_([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED]),
+        Reservation.end_time >= since
+    ).group_by(func.date(Reservation.end_time)).all())
+    return started, revenue
+
+
+def unstarted_booking_ignored(spot_id, user_id):
+    """Add a booking for yesterday that was cancelled before it started; its lot's buckets must not move"""
+    spot = db.session.get(ParkingSpot, spot_id)
+    day = datetime.utcnow().date() - timedelta(days=1)
+    start = datetime.combine(day, datetime.min.time()) + timedelta(hours=10)
+
+    def buckets():
+        rollups.rebuild(day, day + timedelta(days=1), [spot.parking_lot_id])
+        return sorted(db.session.query(
+            LotRollup.granularity, LotRollup.bucket_start, LotRollup.started,
+            LotRollup.cancelled, LotRollup.peak_occupancy
+        ).filter(LotRollup.parking_lot_id == spot.parking_lot_id, LotRollup.bucket_start >= start - timedelta(hours=10),
+                 LotRollup.bucket_start < start + timedelta(hours=14)).all())
+
+    before = buckets()
+    db.session.add(Reservation(
+        user_id=user_id, parking_spot_id=spot_id, start_time=start, end_time=start + timedelta(hours=4),
+        vehicle_number='TREND-NOSHOW', total_cost=0, status=ReservationStatus.CANCELLED, started=False
+    ))
+    db.session.commit()
+    return buckets() == before
+
+
+def average_ms(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(rows, lots, repeat):
+    app = make_app()
+    with app.app_context():
+        user_id = create_users(1, prefix='trend')[0]
+        spot_ids = [spot.id for i in range(lots) for spot in create_lot(f'Trend Lot {i}', 50).parking_spots]
+        with timed(f'seed {rows} reservations over {DAYS} days'):
+            seed(rows, spot_ids, user_id, days=DAYS)
+        with timed('backfill rollups') as backfill:
+            rollups.backfill()
+        db.session.expunge_all()
+
+        rollup_ms = average_ms(lambda: rollups.trend(DAYS), repeat)
+        raw_ms = average_ms(raw_trend, max(1, repeat // 10))
+
+        series = rollups.trend(DAYS)
+        started, revenue = raw_trend()
+        mismatches = 0
+        for label, count, amount in zip(series['labels'], series['started'], series['revenue']):
+            day = label[:10]
+            if count != started.get(day, 0) or abs(amount - float(revenue.get(day) or 0)) > 0.01:
+                mismatches += 1
+        ignored = unstarted_booking_ignored(spot_ids[0], user_id)
+
+    print(f"backfill:          {rows / backfill['seconds']:,.0f} reservations/sec")
+    print(f"trend from rollups: {rollup_ms:.2f}ms per view")
+    print(f"trend from raw rows: {raw_ms:.2f}ms per view")
+    print(f"speedup:            {raw_ms / rollup_ms:.0f}x")
+    print(f"mismatched days: {mismatches} of {len(series['labels'])}")
+    print(f"booking cancelled before it started left its buckets alone: {ignored}")
+    print("PASS" if mismatches == 0 and ignored else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark trend charts from rollups')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(args.rows, args.lots, args.repeat)
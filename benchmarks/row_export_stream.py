@@ -0,0 +1,73 @@
+# CSV/NDJSON export streaming: memory must stay flat and the first byte must come at once
+#
+#   python -m benchmarks.row_export_stream --rows 200000
+#
+# Downloads a user's reservation history (the user export endpoint) after
+# seeding a fifth of `rows`, then all of them, reading the response chunk by
+# chunk as a client would. Peak Python memory while streaming must be about
+# the same for both sizes, the first chunk must arrive long before the last,
+# and every row must be in the download.
+import argparse
+import time
+import tracemalloc
+from benchmarks.billing_reprice import seed
+from benchmarks.common import make_app, create_lot, create_users
+
+
+def download(client, fmt, trace=False):
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(f'/user/reservations/export?format={fmt}', buffered=False)
+    first_byte = None
+    lines = 0
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if trace else None
+    if trace:
+        tracemalloc.stop()
+    response.close()
+    return lines, first_byte, elapsed, peak
+
+
+def run(rows, fmt):
+    app = make_app()
+    with app.app_context():
+        lot = create_lot('Export Stream Lot', 200)
+        spot_ids = [spot.id for spot in lot.parking_spots]
+        user_id = create_users(1, prefix='stream')[0]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    peaks = []
+    ok = True
+    for count in (rows // 5, rows - rows // 5):
+        with app.app_context():
+            seed(count, spot_ids, user_id)
+        lines, first_byte, elapsed, _ = download(client, fmt)
+        # tracemalloc slows Python down several times, so memory is measured on a second download
+        peak = download(client, fmt, trace=True)[3]
+        peaks.append(peak)
+        # NDJSON has one line per row, CSV adds a header line
+        exported = lines - (1 if fmt == 'csv' else 0)
+        expected = rows // 5 if len(peaks) == 1 else rows
+        ok = ok and exported == expected and first_byte < elapsed / 10
+        print(f"  {exported} of {expected} rows: first byte after {first_byte * 1000:.1f}ms, "
+              f"{exported / elapsed:,.0f} rows/sec, peak memory {peak / 2**20:.1f}MB")
+
+    flat = peaks[1] < peaks[0] * 1.5
+    print(f"memory growth for 5x the rows: {peaks[1] / peaks[0]:.2f}x")
+    print("PASS" if ok and flat else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark streaming CSV/NDJSON exports')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    args = parser.parse_args()
+    run(args.rows, args.format)
@@ -0,0 +1,75 @@
+# Admin spot search: SQL statements per request must not grow with the number of spots
+#
+#   python -m benchmarks.spot_search_queries --spots 2000
+#
+# Searches a small lot and a large lot, both with reservation history and
+# active reservations, and counts the statements each request runs. The
+# search used to issue up to three queries per spot; the counts must now be
+# equal whatever the lot or page size.
+import argparse
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from app.extensions import db
+from app.models import Reservation, ReservationStatus, ParkingSpot, SpotStatus
+from benchmarks.billing_reprice import seed
+from benchmarks.common import make_app, create_lot, create_users, timed
+
+
+def occupy(spot_ids, user_id):
+    """Give every other spot an active reservation"""
+    now = datetime.utcnow()
+    taken = spot_ids[::2]
+    db.session.execute(insert(Reservation), [{
+        'user_id': user_id, 'parking_spot_id': spot_id, 'start_time': now - timedelta(hours=1),
+        'end_time': now, 'vehicle_number': 'SEARCH', 'total_cost': 0, 'status': ReservationStatus.ACTIVE,
+        'created_at': now, 'updated_at': now, 'is_deleted': False, 'version': 1
+    } for spot_id in taken])
+    db.session.query(ParkingSpot).filter(ParkingSpot.id.in_(taken)).update(
+        {'status': SpotStatus.OCCUPIED}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def run(spots):
+    app = make_app()
+    with app.app_context():
+        user_id = create_users(1, prefix='search')[0]
+        lots = {}
+        for size in (10, spots):
+            lot = create_lot(f'Search Lot {size}', size)
+            spot_ids = [spot.id for spot in lot.parking_spots]
+            seed(size * 5, spot_ids, user_id)
+            occupy(spot_ids, user_id)
+            lots[size] = lot.id
+        engine = db.engine
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    client = app.test_client()
+    response = client.post('/auth/login', json={'username': 'admin', 'password': 'Admin@123'})
+    assert response.status_code == 200, response.data
+
+    counts = {}
+    for size, lot_id in lots.items():
+        for per_page in (10, 200):
+            del statements[:]
+            with timed(f'search lot of {size} spots, page of {per_page}'):
+                response = client.get(f'/admin/parking/spots/search?format=json&lot_id={lot_id}&per_page={per_page}')
+            body = response.get_json()
+            assert response.status_code == 200 and body['success'], response.data
+            assert any(r['current_reservation'] for r in body['results']), 'active reservations missing'
+            counts[(size, per_page)] = len(statements)
+            print(f"  {len(body['results'])} of {body['pagination']['total']} spots, {len(statements)} statements")
+
+    print(f"statements per request: {sorted(set(counts.values()))}")
+    ok = len(set(counts.values())) == 1
+    print("PASS" if ok else "FAIL (query count grows with the result set)")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that admin spot search runs a constant number of queries')
+    parser.add_argument('--spots', type=int, default=2000)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.spots) else 1)
@@ -0,0 +1,76 @@
+# Tariff pricing latency: compiled lookup tables vs. walking the stay minute by minute
+#
+#   python -m benchmarks.tariff_pricing --stays 1000000
+#
+# Needs no database. Checks the compiled tariff against a naive per-minute
+# reference on a sample, then times single-stay and vectorized pricing.
+import argparse
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from app.services.tariffs import CompiledTariff, parse_peak_hours
+
+TARIFF = dict(base_rate=20, peak_rate=40, peak_hours='8-10,17-20', weekend_rate=15, first_hour_rate=10, daily_cap=250)
+
+
+def naive_cost(start, end, base_rate, peak_rate, peak_hours, weekend_rate, first_hour_rate, daily_cap):
+    """Reference: add up every billed minute in Python"""
+    hours = max(0, -(-int((end - start).total_seconds()) // 3600))
+    peaks = parse_peak_hours(peak_hours)
+    start = start.replace(second=0, microsecond=0)
+    total, block = 0.0, 0.0
+    for minute in range(hours * 60):
+        t = start + timedelta(minutes=minute)
+        if minute and minute % 1440 == 0:
+            total, block = total + min(block, daily_cap * 60), 0.0
+        if minute < 60:
+            rate = first_hour_rate
+        elif t.weekday() >= 5:
+            rate = weekend_rate
+        elif any(s <= t.hour < e for s, e in peaks):
+            rate = peak_rate
+        else:
+            rate = base_rate
+        block += rate
+    return round((total + min(block, daily_cap * 60)) / 60, 2)
+
+
+def run(stays):
+    rng = np.random.default_rng(7)
+    base = np.datetime64('2024-01-01T00:00')
+    starts = base + rng.integers(0, 365 * 24 * 60, stays).astype('timedelta64[m]')
+    ends = starts + rng.integers(1, 3 * 24 * 60, stays).astype('timedelta64[m]')
+
+    started = time.perf_counter()
+    tariff = CompiledTariff(**TARIFF)
+    print(f"compile: {(time.perf_counter() - started) * 1000:.2f}ms")
+
+    sample = [(s.astype(datetime), e.astype(datetime)) for s, e in zip(starts[:200], ends[:200])]
+    mismatches = sum(tariff.cost(s, e) != naive_cost(s, e, **TARIFF) for s, e in sample)
+
+    started = time.perf_counter()
+    for s, e in sample:
+        naive_cost(s, e, **TARIFF)
+    naive = (time.perf_counter() - started) / len(sample)
+
+    started = time.perf_counter()
+    for s, e in sample:
+        tariff.cost(s, e)
+    single = (time.perf_counter() - started) / len(sample)
+
+    started = time.perf_counter()
+    tariff.cost_many(starts, ends)
+    vectorized = time.perf_counter() - started
+
+    print(f"naive per-minute walk: {naive * 1e6:.1f}us per stay")
+    print(f"compiled, one stay:    {single * 1e6:.1f}us per stay")
+    print(f"compiled, vectorized:  {stays / vectorized:,.0f} stays/sec ({stays} stays in {vectorized:.3f}s)")
+    print(f"mismatches vs reference: {mismatches} of {len(sample)}")
+    print("PASS" if mismatches == 0 else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark compiled tariff pricing')
+    parser.add_argument('--stays', type=int, default=1000000)
+    args = parser.parse_args()
+    run(args.stays)
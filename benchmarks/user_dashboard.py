@@ -0,0 +1,94 @@
+# User dashboard: SQL statements and latency must not grow with a user's history
+#
+#   python -m benchmarks.user_dashboard --reservations 10000
+#
+# Renders the dashboard for a user with `baseline` reservations (enough to fill
+# the recent-history tables) and for one with `reservations`, both with a few
+# active stays, counting the statements each view runs. The counts must be
+# equal, the long history must render about as fast as the short one, and the
+# totals shown must match a recount in Python.
+import argparse
+import re
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from app.extensions import db
+from app.models import Reservation, ReservationStatus
+from benchmarks.billing_reprice import seed
+from benchmarks.common import make_app, create_lot, create_users
+
+
+def add_active(spot_ids, user_id, count=3):
+    now = datetime.utcnow()
+    db.session.execute(insert(Reservation), [{
+        'user_id': user_id, 'parking_spot_id': spot_id, 'start_time': now - timedelta(hours=2),
+        'end_time': now + timedelta(hours=2), 'vehicle_number': 'DASH', 'total_cost': 0,
+        'status': ReservationStatus.ACTIVE, 'created_at': now, 'updated_at': now, 'is_deleted': False, 'version': 1
+    } for spot_id in spot_ids[:count]])
+    db.session.commit()
+
+
+def expected_totals(user_id):
+    """The dashboard totals, recomputed from every reservation the way the page used to"""
+    reservations = Reservation.query.filter_by(user_id=user_id).all()
+    completed = [r for r in reservations if r.status == ReservationStatus.COMPLETED]
+    cancelled = [r for r in reservations if r.status == ReservationStatus.CANCELLED]
+    return {
+        'summary-bookings': str(len(reservations)),
+        'summary-time': f"{sum(r.get_duration_hours() for r in completed):.1f} hrs",
+        'summary-amount': f"{sum(float(r.total_cost) for r in completed):.2f}",
+        'summary-amount-cancelled': f"{sum(float(r.total_cost) for r in completed + cancelled):.2f}",
+    }
+
+
+def shown_totals(html):
+    return {name: re.search(rf'id="{name}">([^<]*)<', html).group(1) for name in (
+        'summary-bookings', 'summary-time', 'summary-amount', 'summary-amount-cancelled'
+    )}
+
+
+def run(reservations, baseline, repeat):
+    app = make_app()
+    with app.app_context():
+        lot = create_lot('Dashboard Lot', 200)
+        spot_ids = [spot.id for spot in lot.parking_spots]
+        users = dict(zip((baseline, reservations), create_users(2, prefix='dash')))
+        for count, user_id in users.items():
+            seed(count, spot_ids, user_id, days=365)
+            add_active(spot_ids, user_id)
+        expected = {count: expected_totals(user_id) for count, user_id in users.items()}
+        engine = db.engine
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    client = app.test_client()
+    results = {}
+    for count, user_id in users.items():
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        client.get('/user/dashboard')
+        del statements[:]
+        html = client.get('/user/dashboard').get_data(as_text=True)
+        queries = len(statements)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            client.get('/user/dashboard')
+        elapsed = (time.perf_counter() - started) / repeat * 1000
+        correct = shown_totals(html) == expected[count]
+        results[count] = (queries, elapsed, correct)
+        print(f"{count} reservations: {queries} statements, {elapsed:.1f}ms per view, "
+              f"totals {'match' if correct else 'DIFFER: ' + str(shown_totals(html)) + ' vs ' + str(expected[count])}")
+
+    (small_queries, small_ms, small_ok), (large_queries, large_ms, large_ok) = results[baseline], results[reservations]
+    print(f"latency ratio: {large_ms / small_ms:.2f}x")
+    ok = small_ok and large_ok and small_queries == large_queries and large_ms < small_ms * 2
+    print("PASS" if ok else "FAIL")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the user dashboard does not scale with history size')
+    parser.add_argument('--reservations', type=int, default=10000)
+    parser.add_argument('--baseline', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    run(args.reservations, args.baseline, args.repeat)
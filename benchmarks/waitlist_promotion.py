@@ -0,0 +1,49 @@
+# Waitlist promotion throughput and queue latency
+#
+#   python -m benchmarks.waitlist_promotion --spots 200
+#
+# Fills a lot, queues one waiter per spot, then frees every spot in one gate
+# burst and measures how fast the promoter hands the spots to the waiters.
+import argparse
+import time
+from app.models import WaitlistEntry, WaitlistStatus
+from app.services import allocation, checkout, waitlist
+from benchmarks.common import make_app, create_lot, create_users
+
+
+def run(spots):
+    app = make_app()
+    with app.app_context():
+        lot_id = create_lot('Waitlist Lot', spots).id
+        fleet_user, *waiters = create_users(spots + 1, prefix='wait')
+        booked = allocation.book_bulk(fleet_user, [(lot_id, spots)], [f'FULL{i:04d}' for i in range(spots)])
+        for user_id in waiters:
+            waitlist.join_waitlist(lot_id, user_id, f'WAIT{user_id:04d}')
+
+    waitlist.promoter.notifier = waitlist.LocalNotificationSink(maxlen=spots)
+    waitlist.promoter.start(app, poll_seconds=60)
+    waitlist.promoter.reset_metrics()
+
+    start = time.perf_counter()
+    with app.app_context():
+        checkout.release_reservations(reservation_ids=[b[0] for b in booked], mode='vacate')
+    waitlist.promoter.drain(timeout=120)
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        metrics = waitlist.promoter.metrics()
+        promoted = WaitlistEntry.query.filter_by(status=WaitlistStatus.PROMOTED).count()
+    waitlist.promoter.stop(timeout=5)
+
+    print(f"spots freed={spots} waiters promoted={promoted} notifications={len(waitlist.promoter.notifier.messages)}")
+    print(f"burst to last promotion: {elapsed:.3f}s")
+    print(f"promotions/sec (promoter busy time): {metrics['promotions_per_second']}")
+    print(f"avg signal-to-promotion latency: {metrics['avg_signal_to_promotion_ms']}ms")
+    print(f"avg time in queue: {metrics['avg_wait_seconds']}s (max {metrics['max_wait_seconds']}s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark waitlist promotion')
+    parser.add_argument('--spots', type=int, default=200)
+    args = parser.parse_args()
+    run(args.spots)
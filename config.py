@@ -22,6 +22,69 @@ class Config:
     JWT_TOKEN_LOCATION = ['headers']
     JWT_HEADER_NAME = 'Authorization'
     JWT_HEADER_TYPE = 'Bearer'
+    
+    # Largest fleet booking accepted in one request
+    BULK_BOOKING_MAX_SPOTS = 500
+    
+    # Advance reservations: longest bookable slot and how far ahead it may start
+    ADVANCE_BOOKING_MAX_HOURS = 24
+    ADVANCE_BOOKING_MAX_DAYS = 90
+    # How often due bookings are activated
+    ADVANCE_BOOKING_ACTIVATE_SECONDS = 60
+    # Walk-ins and holds skip spots with a booking starting within this many minutes
+    ADVANCE_BOOKING_LEAD_MINUTES = 60
+    
+    # Checkout holds: how long a picked spot is kept and how the sweeper runs
+    SPOT_HOLD_TTL_SECONDS = 300
+    SPOT_HOLD_SWEEP_SECONDS = 30
+    SPOT_HOLD_SWEEP_BATCH = 500
+    
+    # Waitlist: how long a promoted waiter's spot is held, and the fallback poll interval
+    WAITLIST_HOLD_TTL_SECONDS = 600
+    WAITLIST_POLL_SECONDS = 30
+    
+    # Tariff peak hours and weekends are in local time (IST by default)
+    TARIFF_UTC_OFFSET_MINUTES = int(os.environ.get('TARIFF_UTC_OFFSET_MINUTES', 330))
+    
+    # Idempotency-Key responses are kept this long, and purged on this interval
+    IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+    IDEMPOTENCY_PURGE_SECONDS = 300
+    
+    # Dynamic pricing: (occupancy threshold, multiplier of the base price), checked on this interval
+    DYNAMIC_PRICING_ENABLED = True
+    DYNAMIC_PRICING_BANDS = [(0.8, 1.2), (0.95, 1.5)]
+    DYNAMIC_PRICING_SECONDS = 60
+    
+    # Dashboard counters are recomputed from scratch on this interval to correct drift
+    STATS_RECONCILE_SECONDS = 300
+    
+    # Trend chart rollups are refreshed on this interval, staying this far behind open transactions
+    ROLLUP_REFRESH_SECONDS = 60
+    ROLLUP_LAG_SECONDS = 30
+    
+    # Reservation exports (Parquet/Arrow): target directory, rows per read, lag behind open transactions
+    EXPORT_DIRECTORY = os.environ.get('EXPORT_DIRECTORY', str(BASE_DIRECTORY / 'exports'))
+    EXPORT_CHUNK_SIZE = 50000
+    EXPORT_LAG_SECONDS = 30
+    # CSV/NDJSON downloads: rows per read
+    EXPORT_STREAM_CHUNK_SIZE = 1000
+    
+    # Finished reservations of each kind listed on the user dashboard (the totals cover all of them)
+    USER_DASHBOARD_HISTORY = 20
+    
+    # Read-through cache: "memory" (per process), "sqlite" (shared by the workers on a host) or "none"
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH', str(BASE_DIRECTORY / 'cache.sqlite3'))
+    CACHE_MAX_ENTRIES = 10000
+    # Entries are invalidated by writes; the TTLs only bound what other writers (e.g. SQL consoles) can leave stale
+    CACHE_DEFAULT_TTL = 60
+    CACHE_GEOGRAPHY_TTL = 3600
+    CACHE_DASHBOARD_TTL = 30
+    
+    # Background workers (hold sweeper, waitlist promoter, ...) run inside the web process.
+    # They never start in `flask` maintenance commands or in the reloader's parent
+    # process, and in debug mode only in the reloader's child (serve with DEBUG off)
+    BACKGROUND_JOBS_ENABLED = True
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -32,9 +95,21 @@ class ProductionConfig(Config):
 class DefaultConfig(Config):
     DEBUG = True
 
+class BenchmarkConfig(Config):
+    # Throwaway database so benchmarks never touch real data
+    DEBUG = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        "BENCHMARK_DATABASE_URI", f"sqlite:///{Config.BASE_DIRECTORY}/benchmark.db"
+    )
+    # Let concurrent writers wait for the SQLite lock instead of failing
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+    # Benchmarks drive the services directly
+    BACKGROUND_JOBS_ENABLED = False
+
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
+    'benchmark': BenchmarkConfig,
     'default': DefaultConfig
 }
 